@@ -191,6 +191,18 @@ access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
 #       A callable that takes a server instance as the sole argument.
 #
 
+
+def post_fork(server, worker):
+    # Threads don't survive the fork, start them in each worker
+    from services.utils.notifier import start_status_notifier
+    from services.utils.reconciler import start_reconciler
+    from services.utils.warm_pool import start_warm_pool_refiller
+
+    start_status_notifier()
+    start_warm_pool_refiller()
+    start_reconciler()
+
+
 # Max Requests used to reduce memory consumption
 max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
 max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 0))
@@ -1,4 +1,5 @@
 import copy
+import functools
 import logging
 
 from logs.utils import create_logging_handler
@@ -48,6 +49,7 @@ def request_decorator(func):
             current_logger_configuration_mem = copy.deepcopy(active_handler_dict)
         return func(*args, **kwargs)
 
+    @functools.wraps(func)
     def catch_all_exceptions(*args, **kwargs):
         try:
             return update_logging_handler(*args, **kwargs)
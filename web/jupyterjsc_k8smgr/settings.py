@@ -97,6 +97,41 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The "status" cache is shared by all gunicorn workers (see services.status_cache)
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "status": {
+        "BACKEND": os.environ.get(
+            "STATUS_CACHE_BACKEND",
+            "django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        "LOCATION": os.environ.get(
+            "STATUS_CACHE_LOCATION", os.path.join(BASE_DIR, "status_cache")
+        ),
+        # One entry per running service. The file based cache scans all
+        # files when it's full, so cull 10% at once.
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("STATUS_CACHE_MAX_ENTRIES", 10000)),
+            "CULL_FREQUENCY": int(os.environ.get("STATUS_CACHE_CULL_FREQUENCY", 10)),
+        },
+    },
+    # Histograms of the start / stop timings, one entry per worker process
+    "timings": {
+        "BACKEND": os.environ.get(
+            "TIMINGS_CACHE_BACKEND",
+            "django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        "LOCATION": os.environ.get(
+            "TIMINGS_CACHE_LOCATION", "/tmp/k8smgr_timings_cache"
+        ),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
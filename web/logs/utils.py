@@ -1,4 +1,5 @@
 import copy
+import json
 import logging.handlers
 import socket
 import sys
@@ -49,6 +50,56 @@ class ExtraFormatter(logging.Formatter):
         return message
 
 
+"""
+Payload for trace logs. Objects like pods or events are only serialized,
+when a handler formats the record. Records filtered by the handlers
+level won't pay for it.
+log.trace("message", extra={"pod": LazyTracePayload(pod)})
+"""
+
+
+class LazyTracePayload:
+    def __init__(self, obj):
+        self.obj = obj
+
+    def value(self):
+        # obj may not be serializable
+        return json.loads(json.dumps(self.obj, default=str))
+
+    def __str__(self):
+        return str(self.value())
+
+
+def json_default(obj):
+    if isinstance(obj, LazyTracePayload):
+        return obj.value()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+"""
+Lowest level of all handlers of our logger. Used to skip expensive
+preparations for trace logs, if no handler would emit them.
+Handlers are replaced (new list) or added/removed via the functions
+below, which reset the cached value.
+"""
+_min_handler_level = {"handlers": None, "level": None}
+
+
+def get_min_handler_level(logger, default=20):
+    handlers = logger.handlers
+    if (
+        _min_handler_level["handlers"] is not handlers
+        or _min_handler_level["level"] is None
+    ):
+        _min_handler_level["level"] = min([h.level for h in handlers], default=default)
+        _min_handler_level["handlers"] = handlers
+    return _min_handler_level["level"]
+
+
+def reset_min_handler_level():
+    _min_handler_level["level"] = None
+
+
 # Translate level to int
 def get_level(level_str):
     if type(level_str) == int:
@@ -80,7 +131,7 @@ supported_formatter_classes = {"json": JsonFormatter, "simple": ExtraFormatter}
 json_fmt = '{"asctime": "asctime", "levelno": "levelno", "levelname": "levelname", "logger": "name", "file": "pathname", "line": "lineno", "function": "funcName", "Message": "message"}'
 simple_fmt = "%(asctime)s logger=%(name)s levelno=%(levelno)s levelname=%(levelname)s file=%(pathname)s line=%(lineno)d function=%(funcName)s : %(message)s"
 supported_formatter_kwargs = {
-    "json": {"fmt": json_fmt, "mix_extra": True},
+    "json": {"fmt": json_fmt, "mix_extra": True, "default": json_default},
     "simple": {"fmt": simple_fmt},
 }
 
@@ -116,6 +167,7 @@ def create_logging_handler(handler_name, **configuration):
     logger = logging.getLogger(LOGGER_NAME)
     assert logger.__class__.__name__ == "ExtraLoggerClass"
     logger.addHandler(handler)
+    reset_min_handler_level()
     log.debug(f"Logging handler added ({handler_name})", extra=configuration_logs)
 
 
@@ -124,6 +176,7 @@ def remove_logging_handler(handler_name):
     assert logger.__class__.__name__ == "ExtraLoggerClass"
     logger_handlers = logger.handlers
     logger.handlers = [x for x in logger_handlers if x.name != handler_name]
+    reset_min_handler_level()
     log.debug(f"Logging handler removed ({handler_name})")
 
 
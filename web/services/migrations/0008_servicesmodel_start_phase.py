@@ -0,0 +1,28 @@
+# Generated by Django 3.2.16 on 2026-10-18 10:00
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("services", "0007_auto_20230110_1527"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="servicesmodel",
+            name="start_details",
+            field=models.JSONField(default=dict, verbose_name="start_details"),
+        ),
+        migrations.AddField(
+            model_name="servicesmodel",
+            name="start_phase",
+            field=models.TextField(default="", verbose_name="start_phase"),
+        ),
+        migrations.AddField(
+            model_name="servicesmodel",
+            name="start_phase_date",
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 15:00
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("services", "0008_servicesmodel_start_phase"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="servicesmodel",
+            name="stop_pending_date",
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
@@ -9,6 +9,11 @@ class ServicesModel(models.Model):
     jhub_user_id = models.IntegerField("jhub_user_id", null=False)
     jhub_credential = models.TextField("jhub_credential", default="jupyterhub")
     stop_pending = models.BooleanField(null=False, default=False)
+    stop_pending_date = models.DateTimeField(null=True, default=None)
+    # Only used for asynchronous starts: queued -> provisioning -> created / failed
+    start_phase = models.TextField("start_phase", default="")
+    start_phase_date = models.DateTimeField(null=True, default=None)
+    start_details = models.JSONField("start_details", default=dict)
 
 
 class UserModel(models.Model):
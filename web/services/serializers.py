@@ -9,7 +9,9 @@ from rest_framework.exceptions import ValidationError
 from .models import ServicesModel
 from .models import UserJobsModel
 from .utils import get_custom_headers
+from .utils import PodNotFoundError
 from .utils.common import instance_dict_and_custom_headers_to_logs_extra
+from .utils.common import start_phase_status
 from .utils.common import status_service
 
 log = logging.getLogger(LOGGER_NAME)
@@ -61,6 +63,12 @@ class ServicesSerializer(serializers.ModelSerializer):
             raise ValidationError(_errors)
         return super().is_valid(raise_exception=raise_exception)
 
+    def validate_servername(self, value):
+        # Reserved for the actions on all services (_bulk/, _metrics/)
+        if value.startswith("_"):
+            raise ValidationError(f"servername must not start with '_': {value}")
+        return value
+
     def to_internal_value(self, data):
         custom_headers = get_custom_headers(self.context["request"]._request.META)
         servername = custom_headers.get("uuidcode", uuid.uuid4().hex)
@@ -84,25 +92,42 @@ class ServicesSerializer(serializers.ModelSerializer):
             instance.__dict__, custom_headers
         )
         logs_extra["start_date"] = ret["start_date"]
+        start_status = start_phase_status(instance.__dict__)
         if instance.stop_pending:
             log.info("Service is already stopping. Return false", extra=logs_extra)
             status = {"running": False}
+        elif start_status is not None:
+            # Asynchronous start is not finished yet
+            status = start_status
         else:
             try:
-                status = status_service(
-                    instance.__dict__,
-                    custom_headers,
-                    logs_extra=logs_extra,
-                )
+                if "services_status" in self.context.keys():
+                    # Status was already checked for multiple services at once
+                    status = self.context["services_status"][instance.servername]
+                    if isinstance(status, Exception):
+                        raise status
+                else:
+                    status = status_service(
+                        instance.__dict__,
+                        custom_headers,
+                        logs_extra=logs_extra,
+                    )
             except Exception as e:
-                if len(e.args) >= 2 and e.args[1].startswith(
-                    "No pod found with app label"
-                ):
-                    log.warning("Pod does not exist", extra=logs_extra, exc_info=True)
-                    status = {
-                        "running": False,
-                        "details": {"error": e.args[0], "detailed_error": e.args[1]},
-                    }
+                if isinstance(e, PodNotFoundError):
+                    status = start_phase_status(instance.__dict__, pod_missing=True)
+                    if status is not None:
+                        log.debug("Pod not created yet", extra=logs_extra)
+                    else:
+                        log.warning(
+                            "Pod does not exist", extra=logs_extra, exc_info=True
+                        )
+                        status = {
+                            "running": False,
+                            "details": {
+                                "error": e.args[0],
+                                "detailed_error": e.args[1],
+                            },
+                        }
                 else:
                     log.critical(
                         "Could not check status of service",
@@ -126,6 +151,12 @@ class UserJobsSerializer(serializers.ModelSerializer):
 
     required_keys = ["service", "ports", "hostname", "target_node"]
 
+    def validate_service(self, value):
+        # Reserved for the actions on all UserJobs (_metrics/)
+        if value.startswith("_"):
+            raise ValidationError(f"service must not start with '_': {value}")
+        return value
+
     def to_internal_value(self, data):
         jhub_credential = self.context["request"].user.username
         ret = super().to_internal_value(data)
@@ -15,6 +15,14 @@ class MgrExceptionError(Exception):
     pass
 
 
+class PodNotFoundError(MgrExceptionError):
+    """
+    The main pod of a service does not exist (yet).
+    """
+
+    pass
+
+
 def get_error_message(config, logs_extra, key, default):
     if key in config.get("error_messages", {}):
         user_error_msg = config["error_messages"][key]
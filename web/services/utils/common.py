@@ -1,13 +1,24 @@
 import copy
+import datetime
 import logging
+import time
 import uuid
 
+from django.db import close_old_connections
+from django.db import transaction
+from django.utils import timezone
 from jupyterjsc_k8smgr.settings import LOGGER_NAME
 from services.utils import _config
 from services.utils import get_error_message
 from services.utils import k8s
 from services.utils import MgrExceptionError
+from services.utils import PodNotFoundError
+from services.utils import reconciler
 from services.utils import ssh
+from services.utils import ssh_mux
+from services.utils import status_cache
+from services.utils import timing
+from services.utils.executor import get_executor
 
 log = logging.getLogger(LOGGER_NAME)
 assert log.__class__.__name__ == "ExtraLoggerClass"
@@ -22,23 +33,29 @@ def start_service(
     drf_id = f"{servername}-{validated_data['start_id']}"
     config = _config()
 
+    timings = {}
     try:
-        k8s.start_service(
-            servername,
-            drf_id,
-            config,
-            validated_data,
-            initial_data,
-            custom_headers,
-            jhub_credential,
-            logs_extra=logs_extra,
-        )
-        log.info("Service start finished", extra=logs_extra)
+        with timing.collect("start") as timings:
+            k8s.start_service(
+                servername,
+                drf_id,
+                config,
+                validated_data,
+                initial_data,
+                custom_headers,
+                jhub_credential,
+                logs_extra=logs_extra,
+            )
+        timings_logs_extra = dict(logs_extra)
+        timings_logs_extra["timings"] = timing.rounded(timings)
+        log.info("Service start finished", extra=timings_logs_extra)
         return
     except (MgrExceptionError, Exception) as e:
+        timings_logs_extra = dict(logs_extra)
+        timings_logs_extra["timings"] = timing.rounded(timings)
         log.warning(
             "Service start failed",
-            extra=logs_extra,
+            extra=timings_logs_extra,
             exc_info=True,
         )
         stop_service_data = copy.deepcopy(validated_data)
@@ -62,6 +79,148 @@ def start_service(
         raise MgrExceptionError(*e_args)
 
 
+# Asynchronous start (services.async_start.enabled): the ServicesModel is saved
+# first and the request returns immediately. start_service runs on a bounded
+# thread pool afterwards. Until the pod exists, status checks report the
+# start_phase of the model (queued -> provisioning -> created, or failed).
+# A start which stays queued or provisioning for more than pending_timeout
+# seconds (e.g. the worker was restarted) is reported as failed.
+_start_phases_pending = ["queued", "provisioning"]
+
+
+def _get_async_start_config(config):
+    return config.get("services", {}).get("async_start", {})
+
+
+def async_start_enabled():
+    return _get_async_start_config(_config()).get("enabled", False)
+
+
+def _set_start_phase(instance_id, start_phase, start_details=None):
+    """
+    Returns False, if the service was deleted or is stopping in the meantime.
+    """
+    from services.models import ServicesModel
+
+    fields = {"start_phase": start_phase, "start_phase_date": timezone.now()}
+    if start_details is not None:
+        fields["start_details"] = start_details
+    return (
+        ServicesModel.objects.filter(id=instance_id, stop_pending=False).update(
+            **fields
+        )
+        > 0
+    )
+
+
+def _start_service_async(
+    instance_id,
+    validated_data,
+    initial_data,
+    custom_headers,
+    jhub_credential,
+    logs_extra,
+):
+    try:
+        if not _set_start_phase(instance_id, "provisioning"):
+            log.info(
+                "Service stopped before provisioning. Do nothing.", extra=logs_extra
+            )
+            return
+        try:
+            start_service(
+                validated_data,
+                initial_data,
+                custom_headers,
+                jhub_credential,
+                logs_extra,
+            )
+        except MgrExceptionError as e:
+            start_details = {
+                "error": e.args[0] if len(e.args) > 0 else "Could not start service",
+                "detailed_error": e.args[1] if len(e.args) > 1 else "",
+            }
+            _set_start_phase(instance_id, "failed", start_details)
+            return
+        if not _set_start_phase(instance_id, "created"):
+            # The stop request may have missed resources created afterwards
+            log.info(
+                "Service stopped while provisioning. Remove resources.",
+                extra=logs_extra,
+            )
+            stop_service(
+                validated_data, custom_headers, logs_extra, raise_exception=False
+            )
+    except:
+        log.exception("Asynchronous service start failed", extra=logs_extra)
+    finally:
+        close_old_connections()
+
+
+def start_service_async(
+    instance_id,
+    validated_data,
+    initial_data,
+    custom_headers,
+    jhub_credential,
+    logs_extra,
+):
+    async_start_config = _get_async_start_config(_config())
+    executor = get_executor("start", async_start_config.get("max_workers", 4))
+    log.debug("Service start queued", extra=logs_extra)
+    # The worker must see the saved ServicesModel
+    transaction.on_commit(
+        lambda: executor.submit(
+            _start_service_async,
+            instance_id,
+            copy.deepcopy(validated_data),
+            copy.deepcopy(initial_data),
+            copy.deepcopy(custom_headers),
+            jhub_credential,
+            logs_extra,
+        )
+    )
+
+
+def start_phase_status(instance_dict, pod_missing=False):
+    """
+    Status of an asynchronous start, while there's no pod to ask for.
+    Returns None, if the status has to be checked in Kubernetes.
+    """
+    start_phase = instance_dict.get("start_phase", "")
+    if start_phase in _start_phases_pending:
+        # The queue is kept in memory. If the worker died, the start is lost.
+        pending_timeout = _get_async_start_config(_config()).get("pending_timeout", 900)
+        start_phase_date = instance_dict.get("start_phase_date", None)
+        if (
+            start_phase_date
+            and (timezone.now() - start_phase_date).total_seconds() > pending_timeout
+        ):
+            return {
+                "running": False,
+                "details": {
+                    "phase": "failed",
+                    "error": "Service start timed out",
+                    "detailed_error": f"Start phase {start_phase} for more"
+                    f" than {pending_timeout} seconds",
+                },
+            }
+        return {"running": True, "details": {"phase": start_phase}}
+    if start_phase == "failed":
+        details = copy.deepcopy(instance_dict.get("start_details", {}))
+        details["phase"] = start_phase
+        return {"running": False, "details": details}
+    if start_phase == "created" and pod_missing:
+        pod_grace = _get_async_start_config(_config()).get("pod_grace", 300)
+        start_phase_date = instance_dict.get("start_phase_date", None)
+        if (
+            start_phase_date
+            and (timezone.now() - start_phase_date).total_seconds() < pod_grace
+        ):
+            return {"running": True, "details": {"phase": start_phase}}
+    return None
+
+
 def update_service(instance_dict, logs_extra):
     log.debug("Service update", extra=logs_extra)
     drf_id = f"{instance_dict['servername']}-{instance_dict['start_id']}"
@@ -100,9 +259,79 @@ def status_service(instance_dict, custom_headers, logs_extra):
                 "Could not check status service.",
             )
             e_args = (user_error_msg, str(e))
+        if isinstance(e, PodNotFoundError):
+            raise PodNotFoundError(*e_args)
         raise MgrExceptionError(*e_args)
 
 
+def status_services(instance_dicts, custom_headers, logs_extra):
+    """
+    Status check for multiple services with one Kubernetes API call.
+    logs_extra is a dict with a logs_extra dict for each servername.
+    Returns a dict servername -> status. If the status check for a service
+    failed, a MgrExceptionError will be returned instead of the status.
+    """
+    bulk_logs_extra = {
+        "uuidcode": custom_headers.get("uuidcode", uuid.uuid4().hex),
+        "servernames": [x["servername"] for x in instance_dicts],
+    }
+    log.debug("Services status check", extra=bulk_logs_extra)
+
+    config = _config()
+    drf_ids = {}
+    drf_ids_logs_extra = {}
+    for instance_dict in instance_dicts:
+        servername = instance_dict["servername"]
+        drf_id = f"{servername}-{instance_dict['start_id']}"
+        drf_ids[drf_id] = servername
+        drf_ids_logs_extra[drf_id] = logs_extra.get(servername, {})
+    try:
+        statuses = k8s.status_services(
+            drf_ids.keys(), config, logs_extra=drf_ids_logs_extra
+        )
+    except Exception as e:
+        statuses = {drf_id: e for drf_id in drf_ids.keys()}
+
+    ret = {}
+    for drf_id, servername in drf_ids.items():
+        status = statuses.get(drf_id, {})
+        if isinstance(status, Exception):
+            log.warning(
+                "Service status check failed",
+                extra=drf_ids_logs_extra[drf_id],
+                exc_info=status,
+            )
+            if status.__class__.__name__ == "MgrExceptionError":
+                e_args = status.args
+            else:
+                user_error_msg = get_error_message(
+                    config,
+                    drf_ids_logs_extra[drf_id],
+                    "services.utils.status_service",
+                    "Could not check status service.",
+                )
+                e_args = (user_error_msg, str(status))
+            if isinstance(status, PodNotFoundError):
+                status = PodNotFoundError(*e_args)
+            else:
+                status = MgrExceptionError(*e_args)
+        ret[servername] = status
+    log.debug("Services status check finished", extra=bulk_logs_extra)
+    return ret
+
+
+def status_cache_counters():
+    return status_cache.get_counters(_config())
+
+
+def timing_histograms():
+    return timing.get_merged_histograms(_config())
+
+
+def reconciler_metrics():
+    return reconciler.get_metrics(_config())
+
+
 def stop_service(instance_dict, custom_headers, logs_extra, raise_exception=True):
     log.debug("Service stop", extra=logs_extra)
 
@@ -110,8 +339,11 @@ def stop_service(instance_dict, custom_headers, logs_extra, raise_exception=True
     config = _config()
 
     try:
-        k8s.stop_service(drf_id, config, logs_extra=logs_extra)
-        log.info("Service stop finished", extra=logs_extra)
+        with timing.collect("stop") as timings:
+            k8s.stop_service(drf_id, config, logs_extra=logs_extra)
+        timings_logs_extra = dict(logs_extra)
+        timings_logs_extra["timings"] = timing.rounded(timings)
+        log.info("Service stop finished", extra=timings_logs_extra)
         return
     except (MgrExceptionError, Exception) as e:
         log.warning(
@@ -137,6 +369,144 @@ def stop_service(instance_dict, custom_headers, logs_extra, raise_exception=True
             raise MgrExceptionError(*e_args)
 
 
+def stop_services(instance_dicts, custom_headers, logs_extra):
+    """
+    Stops multiple services with one Kubernetes API call per kind.
+    logs_extra is a dict with a logs_extra dict for each servername.
+    Returns a dict servername -> None, or a MgrExceptionError if the stop
+    of (one of the instances with) this servername failed.
+    """
+    bulk_logs_extra = {
+        "uuidcode": custom_headers.get("uuidcode", uuid.uuid4().hex),
+        "servernames": [x["servername"] for x in instance_dicts],
+    }
+    log.debug("Services stop", extra=bulk_logs_extra)
+
+    config = _config()
+    drf_ids = {
+        f"{x['servername']}-{x['start_id']}": x["servername"] for x in instance_dicts
+    }
+    try:
+        with timing.collect("bulk_stop") as timings:
+            results = k8s.stop_services(
+                list(drf_ids.keys()), config, logs_extra=bulk_logs_extra
+            )
+    except Exception as e:
+        log.warning("Services stop failed", extra=bulk_logs_extra, exc_info=True)
+        results = {drf_id: str(e) for drf_id in drf_ids.keys()}
+
+    ret = {}
+    for drf_id, servername in drf_ids.items():
+        if results.get(drf_id, None) is None:
+            ret.setdefault(servername, None)
+            continue
+        log.warning(
+            "Service stop failed",
+            extra=logs_extra.get(servername, {}),
+        )
+        user_error_msg = get_error_message(
+            config,
+            logs_extra.get(servername, {}),
+            "services.utils.common.stop_service",
+            "Could not stop service",
+        )
+        ret[servername] = MgrExceptionError(user_error_msg, results[drf_id])
+    timings_logs_extra = dict(bulk_logs_extra)
+    timings_logs_extra["timings"] = timing.rounded(timings)
+    log.info("Services stop finished", extra=timings_logs_extra)
+    return ret
+
+
+# Asynchronous stop (services.async_stop.enabled): DELETE marks the
+# ServicesModel as stop_pending and returns immediately. stop_service runs on
+# a bounded thread pool afterwards and is retried with exponential backoff.
+# The ServicesModel is deleted once the teardown succeeded. If all attempts
+# fail, stop_pending is reset, so the next DELETE tries again.
+# If the queued stop is lost (e.g. the worker process was restarted),
+# stop_pending stays set. After services.async_stop.stale_after seconds the
+# next DELETE or the reconciler stops the service again.
+
+
+def _get_async_stop_config(config):
+    return config.get("services", {}).get("async_stop", {})
+
+
+def async_stop_enabled():
+    return _get_async_stop_config(_config()).get("enabled", False)
+
+
+def stop_pending_stale_before(now=None):
+    """
+    Services marked as stopping before this date are stale.
+    """
+    stale_after = _get_async_stop_config(_config()).get("stale_after", 600)
+    return (now or timezone.now()) - datetime.timedelta(seconds=stale_after)
+
+
+def stop_pending_stale(instance_dict, now=None):
+    """
+    True, if the service is stopping for longer than stale_after seconds.
+    """
+    if not instance_dict.get("stop_pending", False):
+        return False
+    stop_pending_date = instance_dict.get("stop_pending_date", None)
+    if stop_pending_date is None:
+        # Marked as stopping by an older version
+        return True
+    return stop_pending_date < stop_pending_stale_before(now)
+
+
+def _stop_service_async(instance_id, instance_dict, custom_headers, logs_extra):
+    from services.models import ServicesModel
+
+    async_stop_config = _get_async_stop_config(_config())
+    max_attempts = async_stop_config.get("max_attempts", 5)
+    backoff = async_stop_config.get("retry_backoff", 2)
+    backoff_max = async_stop_config.get("retry_backoff_max", 60)
+    try:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                stop_service(instance_dict, custom_headers, logs_extra)
+            except MgrExceptionError:
+                if attempt == max_attempts:
+                    break
+                delay = min(backoff * 2 ** (attempt - 1), backoff_max)
+                log.info(
+                    f"Service stop attempt {attempt}/{max_attempts} failed."
+                    f" Retry in {delay}s",
+                    extra=logs_extra,
+                )
+                time.sleep(delay)
+                continue
+            ServicesModel.objects.filter(id=instance_id).delete()
+            return
+        log.critical(
+            f"Could not stop service after {max_attempts} attempts.",
+            extra=logs_extra,
+        )
+        ServicesModel.objects.filter(id=instance_id).update(stop_pending=False)
+    except:
+        log.exception("Asynchronous service stop failed", extra=logs_extra)
+    finally:
+        close_old_connections()
+
+
+def stop_service_async(instance_id, instance_dict, custom_headers, logs_extra):
+    async_stop_config = _get_async_stop_config(_config())
+    executor = get_executor("stop", async_stop_config.get("max_workers", 8))
+    log.debug("Service stop queued", extra=logs_extra)
+    # The worker must see stop_pending, so a concurrent async start cleans up
+    transaction.on_commit(
+        lambda: executor.submit(
+            _stop_service_async,
+            instance_id,
+            copy.deepcopy(instance_dict),
+            copy.deepcopy(custom_headers),
+            logs_extra,
+        )
+    )
+
+
 def initial_data_to_logs_extra(servername, initial_data, custom_headers):
     # Remove secrets for logging
     logs_extra = copy.deepcopy(initial_data)
@@ -175,7 +545,33 @@ def instance_dict_and_custom_headers_to_logs_extra(instance_dict, custom_headers
 
 def userjobs_create_ssh_tunnels(ports, hostname, target_node, logs_extra):
     log.debug("UserJobs - Create ssh tunnel", extra=logs_extra)
-    ssh.check_connection(hostname, logs_extra)
+    ssh_mux_config = ssh_mux.get_ssh_mux_config(_config())
+    if ssh_mux_config.get("enabled", False):
+        timeout = ssh_mux_config.get("timeout", 10)
+        # The fallback uses the same local ports. The ControlMaster may have
+        # opened some of the forwards before the error, ssh -O forward
+        # accepts these again instead of leaving them behind.
+        ports = {key: (ssh.get_port(), value) for key, value in ports.items()}
+        try:
+            ssh_mux.check_connection(hostname, timeout, logs_extra)
+        except ssh_mux.SSHMuxError:
+            # e.g. there's no ControlMaster yet, ssh creates it
+            log.debug("UserJobs - mux check failed", exc_info=True, extra=logs_extra)
+            ssh.check_connection(hostname, logs_extra)
+        try:
+            used_ports, returncode = ssh_mux.forward(
+                ports, hostname, target_node, timeout, logs_extra
+            )
+            log.debug("UserJobs - Create ssh tunnel done", extra=logs_extra)
+            return used_ports, returncode
+        except ssh_mux.SSHMuxError:
+            log.warning(
+                "UserJobs - mux forward failed, use ssh -O",
+                exc_info=True,
+                extra=logs_extra,
+            )
+    else:
+        ssh.check_connection(hostname, logs_extra)
     used_ports, returncode = ssh.forward(ports, hostname, target_node, logs_extra)
     log.debug("UserJobs - Create ssh tunnel done", extra=logs_extra)
     return used_ports, returncode
@@ -186,8 +582,57 @@ def userjobs_create_k8s_svc(servername, used_ports, logs_extra):
 
 
 def userjobs_delete_ssh_tunnels(used_ports, hostname, target_node, logs_extra):
+    ssh_mux_config = ssh_mux.get_ssh_mux_config(_config())
+    if ssh_mux_config.get("enabled", False):
+        try:
+            ssh_mux.cancel(
+                used_ports,
+                hostname,
+                target_node,
+                ssh_mux_config.get("timeout", 10),
+                logs_extra,
+            )
+            return
+        except ssh_mux.SSHMuxError:
+            log.warning(
+                "UserJobs - mux cancel failed, use ssh -O",
+                exc_info=True,
+                extra=logs_extra,
+            )
     ssh.cancel(used_ports, hostname, target_node, logs_extra)
 
 
+def userjobs_tunnels(instance_dicts, logs_extra):
+    """
+    Returns a dict hostname -> state of its ControlMaster and the forwards
+    of the given UserJobs.
+    """
+    ssh_mux_config = ssh_mux.get_ssh_mux_config(_config())
+    ret = {}
+    for instance_dict in instance_dicts:
+        hostname = instance_dict["hostname"]
+        if hostname not in ret.keys():
+            ret[hostname] = {"alive": None, "pid": None, "forwards": []}
+            if ssh_mux_config.get("enabled", False):
+                try:
+                    ret[hostname]["pid"] = ssh_mux.check_connection(
+                        hostname, ssh_mux_config.get("timeout", 10), logs_extra
+                    )
+                    ret[hostname]["alive"] = True
+                except ssh_mux.SSHMuxError:
+                    ret[hostname]["alive"] = False
+        for key, value in (instance_dict.get("used_ports", None) or {}).items():
+            ret[hostname]["forwards"].append(
+                {
+                    "service": instance_dict["service"],
+                    "port": int(key),
+                    "local_port": value[0],
+                    "target_node": instance_dict["target_node"],
+                    "target_port": int(value[1]),
+                }
+            )
+    return ret
+
+
 def userjobs_delete_k8s_svc(servername, logs_extra):
     k8s.k8s_delete_userjobs_svc(servername, logs_extra)
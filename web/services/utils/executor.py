@@ -0,0 +1,25 @@
+"""
+Process wide thread pools, one for each purpose. gunicorn forks its workers
+after loading the app (preload_app), so the pools are created lazily and
+bound to the pid of the process which created them.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executors = {}
+_executors_pid = None
+_executors_lock = threading.Lock()
+
+
+def get_executor(name, max_workers):
+    global _executors, _executors_pid
+    with _executors_lock:
+        if _executors_pid != os.getpid():
+            _executors = {}
+            _executors_pid = os.getpid()
+        if name not in _executors.keys():
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f"k8smgr-{name}"
+            )
+        return _executors[name]
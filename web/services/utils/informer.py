@@ -0,0 +1,202 @@
+"""
+Informer-style pod cache. One watch stream per namespace and worker process
+keeps an in-memory index of all pods by their "name" label. Status checks can
+read from this index instead of calling list_namespaced_pod for each request.
+
+gunicorn forks its workers after loading the app (preload_app). Threads do not
+survive a fork, so the informers are created lazily and bound to the pid of
+the process which created them.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from jupyterjsc_k8smgr.settings import LOGGER_NAME
+from kubernetes.client.rest import ApiException
+from services.utils.projection import project_pod
+from services.utils.projection import project_pod_list
+from services.utils.projection import read_json
+
+log = logging.getLogger(LOGGER_NAME)
+assert log.__class__.__name__ == "ExtraLoggerClass"
+
+_informers = {}
+_informers_pid = None
+_informers_lock = threading.Lock()
+
+
+class PodInformer:
+    def __init__(
+        self,
+        get_client,
+        namespace,
+        label_key="name",
+        watch_timeout=300,
+        listener=None,
+    ):
+        self.get_client = get_client
+        self.namespace = namespace
+        self.label_key = label_key
+        self.watch_timeout = watch_timeout
+        # listener(event_type, pod) is called for each pod change.
+        # After a (re)list it's called with "ADDED" for all pods.
+        self.listener = listener
+        self.resource_version = None
+        self._index = {}
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name=f"pod-informer-{self.namespace}", daemon=True
+        )
+        self._thread.start()
+
+    def is_synced(self):
+        return self._synced.is_set()
+
+    def get(self, name_label):
+        """
+        Returns a list of all pods with the given name label, or None
+        if the cache is not synced yet.
+        """
+        if not self.is_synced():
+            return None
+        with self._lock:
+            return list(self._index.get(name_label, {}).values())
+
+    def _pod_key(self, pod):
+        metadata = pod.get("metadata", {}) or {}
+        name_label = (metadata.get("labels", {}) or {}).get(self.label_key, None)
+        return name_label, metadata.get("name", "")
+
+    def _list(self, k8s_client):
+        pods = project_pod_list(
+            read_json(
+                k8s_client.list_namespaced_pod(
+                    namespace=self.namespace, _preload_content=False
+                )
+            )
+        )
+        index = {}
+        for pod in pods.get("items", []):
+            name_label, pod_name = self._pod_key(pod)
+            if name_label:
+                index.setdefault(name_label, {})[pod_name] = pod
+        with self._lock:
+            self._index = index
+        self.resource_version = pods.get("metadata", {}).get("resource_version")
+        self._synced.set()
+        if self.listener:
+            for pod in pods.get("items", []):
+                self._notify("ADDED", pod)
+
+    def _notify(self, event_type, pod):
+        try:
+            self.listener(event_type, pod)
+        except:
+            log.exception(
+                "PodInformer - listener failed",
+                extra={"uuidcode": "PodInformer", "namespace": self.namespace},
+            )
+
+    def _apply(self, event_type, pod):
+        name_label, pod_name = self._pod_key(pod)
+        if not name_label:
+            return
+        with self._lock:
+            pods = self._index.setdefault(name_label, {})
+            if event_type == "DELETED":
+                pods.pop(pod_name, None)
+                if not pods:
+                    del self._index[name_label]
+            else:
+                pods[pod_name] = pod
+        if self.listener:
+            self._notify(event_type, pod)
+
+    def _watch_events(self, k8s_client):
+        """
+        Yields the events of a watch on the raw response. The pods are not
+        deserialized into models, we only need the projection of raw_object.
+        """
+        resp = k8s_client.list_namespaced_pod(
+            namespace=self.namespace,
+            watch=True,
+            resource_version=self.resource_version,
+            timeout_seconds=self.watch_timeout,
+            _preload_content=False,
+        )
+        try:
+            buffer = b""
+            for chunk in resp.stream(amt=None, decode_content=False):
+                buffer += chunk
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    if line.strip():
+                        yield json.loads(line)
+            if buffer.strip():
+                yield json.loads(buffer)
+        finally:
+            resp.close()
+            resp.release_conn()
+
+    def _watch(self, k8s_client):
+        for event in self._watch_events(k8s_client):
+            event_type = event.get("type")
+            raw_object = event.get("object", {}) or {}
+            raw_metadata = raw_object.get("metadata", {}) or {}
+            if event_type == "ERROR":
+                # Most likely 410 Gone, resource_version is too old. Relist.
+                self.resource_version = None
+                return
+            if raw_metadata.get("resourceVersion"):
+                self.resource_version = raw_metadata["resourceVersion"]
+            if event_type in ["ADDED", "MODIFIED", "DELETED"]:
+                self._apply(event_type, project_pod(raw_object))
+
+    def _run(self):
+        logs_extra = {"uuidcode": "PodInformer", "namespace": self.namespace}
+        backoff = 1
+        while True:
+            try:
+                k8s_client = self.get_client()
+                if not self.resource_version:
+                    log.debug("PodInformer - list pods", extra=logs_extra)
+                    self._list(k8s_client)
+                self._watch(k8s_client)
+                backoff = 1
+            except Exception as e:
+                self.resource_version = None
+                if isinstance(e, ApiException) and e.status == 410:
+                    # resource_version too old, relist immediately
+                    continue
+                self._synced.clear()
+                log.warning(
+                    "PodInformer - watch failed", extra=logs_extra, exc_info=True
+                )
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+def get_pod_informer(get_client, namespace, config):
+    global _informers, _informers_pid
+    informer_config = config.get("services", {}).get("pod_informer", {})
+    if not informer_config.get("enabled", False):
+        return None
+    with _informers_lock:
+        if _informers_pid != os.getpid():
+            _informers = {}
+            _informers_pid = os.getpid()
+        if namespace not in _informers.keys():
+            informer = PodInformer(
+                get_client,
+                namespace,
+                watch_timeout=informer_config.get("watch_timeout", 300),
+            )
+            informer.start()
+            _informers[namespace] = informer
+        return _informers[namespace]
@@ -1,19 +1,41 @@
 import base64
 import copy
+import functools
+import gzip
+import hashlib
 import html
+import io
 import json
 import logging
 import os
+import re
 import shutil
 import tarfile
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import lockfile
+import yaml
 from jupyterjsc_k8smgr.settings import LOGGER_NAME
 from kubernetes import client
 from kubernetes import config
 from kubernetes import utils as k8s_utils
-
-import yaml
+from kubernetes.client.rest import ApiException
+from logs.utils import get_min_handler_level
+from logs.utils import LazyTracePayload
+from services.utils import _config
+from services.utils import PodNotFoundError
+from services.utils import status_cache
+from services.utils import timing
+from services.utils import userhome
+from services.utils.executor import get_executor
+from services.utils.informer import get_pod_informer
+from services.utils.projection import project_event_list
+from services.utils.projection import project_pod_list
+from services.utils.projection import read_json
 
 log = logging.getLogger(LOGGER_NAME)
 assert log.__class__.__name__ == "ExtraLoggerClass"
@@ -22,7 +44,16 @@ assert log.__class__.__name__ == "ExtraLoggerClass"
 def update_service(drf_id, config, logs_extra):
     filename = config.get("services", {}).get("yaml_filename_update", "update.yaml")
     update_yaml_file = _get_yaml_file_name(drf_id, config, filename=filename)
-    _create_service_resource(update_yaml_file, logs_extra)
+    owner_references = None
+    if _get_owner_references_enabled(config):
+        owner_references = _get_anchor_owner_references(drf_id)
+    _create_service_resource(
+        update_yaml_file,
+        config,
+        logs_extra,
+        labels=_get_service_labels(drf_id),
+        owner_references=owner_references,
+    )
 
 
 def start_service(
@@ -35,7 +66,8 @@ def start_service(
     jhub_credential,
     logs_extra,
 ):
-    _create_user_home(config, validated_data, jhub_credential, logs_extra)
+    with timing.span("create_user_home"):
+        _create_user_home(config, validated_data, jhub_credential, logs_extra)
     _create_service_yaml(
         servername,
         drf_id,
@@ -50,6 +82,92 @@ def start_service(
 
 def stop_service(drf_id, config, logs_extra={}):
     _delete_service_yaml(drf_id, config, logs_extra)
+    _deployment_main_cache_remove(drf_id)
+    status_cache.remove_status(drf_id, config)
+
+
+def stop_services(drf_ids, config, logs_extra={}):
+    """
+    Stops many services at once. Labelled objects are deleted with one
+    label selector (drf_id label in (...)) per kind for up to
+    services.bulk_stop.chunk_size services. Services without labels
+    are stopped one by one.
+    Returns a dict drf_id -> None or the error message.
+    """
+    bulk_stop_config = config.get("services", {}).get("bulk_stop", {})
+    chunk_size = bulk_stop_config.get("chunk_size", 50)
+    owner = os.environ.get("DEPLOYMENT_NAME", "k8smgr")[0:63]
+    k8s_client = _k8s_get_client_core()
+    namespace = _k8s_get_namespace()
+    label_values = {_get_drf_id_label_value(drf_id): drf_id for drf_id in drf_ids}
+    results = {}
+    unlabelled = []
+    input_hashes = set()
+    values = list(label_values.keys())
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i : i + chunk_size]
+        label_selector = (
+            f"{_owner_label}={owner},{_drf_id_label} in ({','.join(chunk)})"
+        )
+        try:
+            secrets = read_json(
+                k8s_client.list_namespaced_secret(
+                    namespace=namespace,
+                    label_selector=label_selector,
+                    _preload_content=False,
+                )
+            )
+        except:
+            log.warning(
+                "Could not list secrets of services", exc_info=True, extra=logs_extra
+            )
+            secrets = {}
+        labelled = set()
+        for secret in secrets.get("items", []):
+            labels = secret.get("metadata", {}).get("labels", {}) or {}
+            labelled.add(labels.get(_drf_id_label, None))
+            if _get_shared_input_enabled(config) and labels.get(
+                _shared_input_label, None
+            ):
+                input_hashes.add(labels[_shared_input_label])
+        unlabelled.extend(label_values[x] for x in chunk if x not in labelled)
+        with timing.span("delete_resources"):
+            failed = _delete_objects_by_label_selector(
+                label_selector, config, logs_extra
+            )
+        for label_value in chunk:
+            if label_value in labelled:
+                results[label_values[label_value]] = (
+                    f"Could not delete {', '.join(failed)}" if failed else None
+                )
+
+    def stop_unlabelled(drf_id):
+        # Secret is gone or created by an older version, without labels
+        _delete_service_yaml(drf_id, config, logs_extra)
+
+    executor = get_executor("bulk_stop", bulk_stop_config.get("max_workers", 4))
+    futures = {
+        drf_id: executor.submit(timing.run_in_context(stop_unlabelled), drf_id)
+        for drf_id in unlabelled
+    }
+    for drf_id, future in futures.items():
+        try:
+            future.result()
+            results[drf_id] = None
+        except Exception as e:
+            log.warning(
+                f"Could not stop service {drf_id}", exc_info=True, extra=logs_extra
+            )
+            results[drf_id] = str(e)
+
+    for input_hash in input_hashes:
+        with timing.span("delete_shared_input"):
+            _delete_shared_input_configmap_if_unused(input_hash, logs_extra)
+    for drf_id in drf_ids:
+        if results.get(drf_id, None) is None:
+            _deployment_main_cache_remove(drf_id)
+            status_cache.remove_status(drf_id, config)
+    return results
 
 
 def k8s_delete_userjobs_svc(name, logs_extra):
@@ -63,7 +181,11 @@ def k8s_create_userjobs_svc(servername, used_ports, logs_extra):
     log.debug("Create UserJobs svc ...", extra=logs_extra)
     v1 = _k8s_get_client_core()
     namespace = _k8s_get_namespace()
-    labels = {"userjobs_servername": servername}
+    # The owner label scopes the reconciler to this manager's Services
+    labels = {
+        "userjobs_servername": servername,
+        _owner_label: os.environ.get("DEPLOYMENT_NAME", "k8smgr")[0:63],
+    }
     ports = [
         {"port": int(wanted), "protocol": "TCP", "targetPort": int(used[0])}
         for wanted, used in used_ports.items()
@@ -90,24 +212,77 @@ def k8s_create_userjobs_svc(servername, used_ports, logs_extra):
     log.info("Create UserJobs svc ... done", extra=logs_extra)
 
 
-def _get_deployment_main(drf_id, config, min_log, logs_extra):
-    service_yaml_file = _get_yaml_file_name(drf_id, config)
+# The main deployment of each service is cached per drf_id, so status checks
+# don't have to lock and parse the whole service.yaml file (which contains the
+# base64 encoded input files). Entries are validated against inode, mtime and
+# size of service.yaml and written through when service.yaml is created.
+_deployment_main_cache = OrderedDict()
+_deployment_main_cache_lock = threading.Lock()
+_deployment_main_cache_max = 10000
+
+
+def _deployment_main_cache_key(service_yaml_file):
+    try:
+        st = os.stat(service_yaml_file)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _deployment_main_cache_get(drf_id, stat_key):
+    with _deployment_main_cache_lock:
+        cached = _deployment_main_cache.get(drf_id, None)
+        if cached and stat_key and cached[0] == stat_key:
+            _deployment_main_cache.move_to_end(drf_id)
+            return cached[1]
+    return None
+
+
+def _deployment_main_cache_set(drf_id, stat_key, deployment_main):
+    with _deployment_main_cache_lock:
+        _deployment_main_cache[drf_id] = (stat_key, deployment_main)
+        _deployment_main_cache.move_to_end(drf_id)
+        while len(_deployment_main_cache) > _deployment_main_cache_max:
+            _deployment_main_cache.popitem(last=False)
+
+
+def _deployment_main_cache_remove(drf_id):
+    with _deployment_main_cache_lock:
+        _deployment_main_cache.pop(drf_id, None)
+
+
+def _get_deployment_main_name(drf_id, config):
     deployment_main_name_prefix = config.get("services", {}).get(
         "deployment_main_name_prefix", "deployment-main-"
     )
-    deployment_main_name = f"{deployment_main_name_prefix}{drf_id}"
+    return f"{deployment_main_name_prefix}{drf_id}"
 
-    # Load configuration of all applied deployments
-    with lockfile.LockFile(service_yaml_file):
-        with open(service_yaml_file) as f:
-            all_services = yaml.safe_load_all(f)
-            deployments = [x for x in all_services if x["kind"] == "Deployment"]
+
+def _select_deployment_main(drf_id, config, all_services):
+    """
+    Returns the list of all deployments and the list of deployments with
+    the name of the main deployment in the parsed service description.
+    """
+    deployment_main_name = _get_deployment_main_name(drf_id, config)
+    deployments = [
+        x for x in all_services if isinstance(x, dict) and x.get("kind") == "Deployment"
+    ]
 
     # Look for deployment with name deployment_main_name
     # Status of this deployment will determine the status of the service
     deployment_main_list = [
-        x for x in deployments if x["metadata"]["name"] == deployment_main_name
+        x
+        for x in deployments
+        if (x.get("metadata", {}) or {}).get("name") == deployment_main_name
     ]
+    return deployments, deployment_main_list
+
+
+def _find_deployment_main(drf_id, config, all_services, service_yaml_file, logs_extra):
+    deployment_main_name = _get_deployment_main_name(drf_id, config)
+    deployments, deployment_main_list = _select_deployment_main(
+        drf_id, config, all_services
+    )
 
     if not deployments:
         log.critical(
@@ -121,39 +296,102 @@ def _get_deployment_main(drf_id, config, min_log, logs_extra):
         )
         raise Exception(f"No deployment configured with name {deployment_main_name}")
 
-    deployment_main = deployment_main_list[0]
+    return deployment_main_list[0]
+
+
+def _get_deployment_main(drf_id, config, min_log, logs_extra):
+    service_yaml_file = _get_yaml_file_name(drf_id, config)
+
+    stat_key = _deployment_main_cache_key(service_yaml_file)
+    deployment_main = _deployment_main_cache_get(drf_id, stat_key)
+    if not deployment_main:
+        # Load configuration of all applied deployments
+        with lockfile.LockFile(service_yaml_file):
+            stat_key = _deployment_main_cache_key(service_yaml_file)
+            with open(service_yaml_file) as f:
+                all_services = list(yaml.safe_load_all(f))
+        deployment_main = _find_deployment_main(
+            drf_id, config, all_services, service_yaml_file, logs_extra
+        )
+        _deployment_main_cache_set(drf_id, stat_key, deployment_main)
 
     if min_log <= 5:
         # deployments may not be serializable, but at trace level we want to log it for debugging
-        trace_logs_extra_deployments_dict = json.loads(
-            json.dumps(deployment_main, default=str)
-        )
-        trace_logs_extra = copy.deepcopy(logs_extra)
-        trace_logs_extra["deployment_main"] = trace_logs_extra_deployments_dict
+        trace_logs_extra = dict(logs_extra)
+        trace_logs_extra["deployment_main"] = LazyTracePayload(deployment_main)
         log.trace("Check pod status for deployment", extra=trace_logs_extra)
 
     return deployment_main
 
 
-def _get_pod(k8s_client, namespace, deployment_main, min_log, logs_extra):
+def _get_pod(k8s_client, namespace, deployment_main, config, min_log, logs_extra):
     # Look for main pod in deployment_main
     name_label = deployment_main["spec"]["selector"]["matchLabels"]["name"]
-    pods = k8s_client.list_namespaced_pod(
-        namespace=namespace, label_selector=f"name={name_label}"
-    ).to_dict()
-    pod_list = [x for x in pods.get("items", [])]
 
+    # Use the watch based pod cache, if it's enabled and synced. Pods which are
+    # not in the cache yet (e.g. just created) will be requested directly.
+    pod_list = None
+    informer = get_pod_informer(_k8s_get_client_core, namespace, config)
+    if informer:
+        pod_list = informer.get(name_label)
+    if not pod_list:
+        pods = project_pod_list(
+            read_json(
+                k8s_client.list_namespaced_pod(
+                    namespace=namespace,
+                    label_selector=f"name={name_label}",
+                    _preload_content=False,
+                )
+            )
+        )
+        pod_list = [x for x in pods.get("items", [])]
+
+    return _select_pod(pod_list, namespace, name_label, min_log, logs_extra)
+
+
+def _get_pods(k8s_client, namespace, name_labels, config):
+    # Returns all pods for the given name labels, grouped by label.
+    # Labels which are not in the pod cache will be requested with set-based
+    # label selectors. Split them in chunks to keep the request url short.
+    ret = {}
+    missing = []
+    informer = get_pod_informer(_k8s_get_client_core, namespace, config)
+    for name_label in name_labels:
+        pod_list = informer.get(name_label) if informer else None
+        if pod_list:
+            ret[name_label] = pod_list
+        else:
+            missing.append(name_label)
+
+    chunk_size = config.get("services", {}).get("status_bulk_chunk_size", 100)
+    for i in range(0, len(missing), chunk_size):
+        label_selector = f"name in ({','.join(missing[i : i + chunk_size])})"
+        pods = project_pod_list(
+            read_json(
+                k8s_client.list_namespaced_pod(
+                    namespace=namespace,
+                    label_selector=label_selector,
+                    _preload_content=False,
+                )
+            )
+        )
+        for pod in pods.get("items", []):
+            labels = (pod.get("metadata", {}) or {}).get("labels", {}) or {}
+            ret.setdefault(labels.get("name", None), []).append(pod)
+    return ret
+
+
+def _select_pod(pod_list, namespace, name_label, min_log, logs_extra):
     if len(pod_list) != 1:
         log.critical(f"No pod found with name label {name_label}", extra=logs_extra)
-        raise Exception(f"No pod found with name label {name_label}")
+        raise PodNotFoundError(f"No pod found with name label {name_label}")
 
     pod = pod_list[0]
 
     if min_log <= 5:
         # pods is not serializable, but at trace level we want to log it for debugging
-        trace_logs_extra_pods_dict = json.loads(json.dumps(pod, default=str))
-        trace_logs_extra = copy.deepcopy(logs_extra)
-        trace_logs_extra["pod"] = trace_logs_extra_pods_dict
+        trace_logs_extra = dict(logs_extra)
+        trace_logs_extra["pod"] = LazyTracePayload(pod)
         log.trace(
             f"Check pod status - namespace={namespace} label_selector=name={name_label}",
             extra=trace_logs_extra,
@@ -180,9 +418,8 @@ def _get_container_main(config, pod, min_log, logs_extra):
 
     if min_log <= 5:
         # pods is not serializable, but at trace level we want to log it for debugging
-        trace_logs_extra_pods_dict = json.loads(json.dumps(container_main, default=str))
-        trace_logs_extra = copy.deepcopy(logs_extra)
-        trace_logs_extra["container_main"] = trace_logs_extra_pods_dict
+        trace_logs_extra = dict(logs_extra)
+        trace_logs_extra["container_main"] = LazyTracePayload(container_main)
         log.trace(
             f"Check container status with name {container_main_name}",
             extra=trace_logs_extra,
@@ -191,9 +428,16 @@ def _get_container_main(config, pod, min_log, logs_extra):
     return container_main
 
 
-def _get_detailed_error_logs(
-    k8s_client, pod_name, namespace, config, min_log, logs_extra
-):
+# Rendered container logs of failed pods, cached by pod uid and restart count.
+# JupyterHub polls the status of a failed service until it gives up, the logs
+# of the same pod and container restart won't change in the meantime.
+_detailed_error_logs_cache = OrderedDict()
+_detailed_error_logs_cache_lock = threading.Lock()
+_detailed_error_logs_cache_max = 1000
+
+
+def _get_detailed_error_logs(k8s_client, pod, namespace, config, min_log, logs_extra):
+    pod_name = pod["metadata"]["name"]
     try:
         container_logs_keyword = "<CONTAINER_LOGS>"
         detailed_error_html_logs = (
@@ -210,44 +454,82 @@ def _get_detailed_error_logs(
         container_main_name = config.get("services", {}).get(
             "container_main_name", "main"
         )
+        container_logs_join = (
+            config.get("services", {})
+            .get("status_information", {})
+            .get("container_logs_join", "<br>")
+        )
+        container_logs_lines = (
+            config.get("services", {})
+            .get("status_information", {})
+            .get("container_logs_lines", 5)
+        )
+        container_logs_limit_bytes = (
+            config.get("services", {})
+            .get("status_information", {})
+            .get("container_logs_limit_bytes", 65536)
+        )
+
+        restart_counts = tuple(
+            x.get("restart_count", 0)
+            for x in (pod.get("status", {}).get("container_statuses", []) or [])
+            if x.get("name", "") == container_main_name
+        )
+        cache_key = (
+            pod["metadata"].get("uid", pod_name),
+            restart_counts,
+            detailed_error_html_logs,
+            container_main_name,
+            container_logs_join,
+            container_logs_lines,
+            container_logs_limit_bytes,
+        )
+        with _detailed_error_logs_cache_lock:
+            if cache_key in _detailed_error_logs_cache.keys():
+                _detailed_error_logs_cache.move_to_end(cache_key)
+                return _detailed_error_logs_cache[cache_key]
+
+        # Let the API server cut the logs, we only show the last lines anyway
         all_logs = k8s_client.read_namespaced_pod_log(
-            name=pod_name, namespace=namespace, container=container_main_name
+            name=pod_name,
+            namespace=namespace,
+            container=container_main_name,
+            tail_lines=container_logs_lines,
+            limit_bytes=container_logs_limit_bytes,
+            _request_timeout=_get_status_timeout(config),
         )
 
         if min_log <= 5:
             # pods is not serializable, but at trace level we want to log it for debugging
-            trace_logs_extra_pods_dict = json.loads(json.dumps(all_logs, default=str))
-            trace_logs_extra = copy.deepcopy(logs_extra)
-            trace_logs_extra["all_logs"] = trace_logs_extra_pods_dict
+            trace_logs_extra = dict(logs_extra)
+            trace_logs_extra["all_logs"] = LazyTracePayload(all_logs)
             log.trace(
                 f"Check pod logs for {pod_name}",
                 extra=trace_logs_extra,
             )
         if not all_logs:
-            return detailed_error_html_logs.replace(
+            ret = detailed_error_html_logs.replace(
                 container_logs_keyword, "No logs available"
             )
+        else:
+            container_logs_list_short = all_logs.rstrip().split("\n")[
+                -container_logs_lines:
+            ]
+            container_logs_list_short_escaped = list(
+                map(lambda x: html.escape(x), container_logs_list_short)
+            )
+            container_logs_s = container_logs_join.join(
+                container_logs_list_short_escaped
+            )
+            ret = detailed_error_html_logs.replace(
+                container_logs_keyword, container_logs_s
+            )
 
-        container_logs_join = (
-            config.get("services", {})
-            .get("status_information", {})
-            .get("container_logs_join", "<br>")
-        )
-        container_logs_lines = (
-            config.get("services", {})
-            .get("status_information", {})
-            .get("container_logs_lines", 5)
-        )
-        container_logs_list_short = all_logs.rstrip().split("\n")[
-            -container_logs_lines:
-        ]
-        container_logs_list_short_escaped = list(
-            map(lambda x: html.escape(x), container_logs_list_short)
-        )
-        container_logs_s = container_logs_join.join(container_logs_list_short_escaped)
-        return detailed_error_html_logs.replace(
-            container_logs_keyword, container_logs_s
-        )
+        with _detailed_error_logs_cache_lock:
+            _detailed_error_logs_cache[cache_key] = ret
+            while len(_detailed_error_logs_cache) > _detailed_error_logs_cache_max:
+                _detailed_error_logs_cache.popitem(last=False)
+        return ret
     except:
         log.debug(
             f"Could not receive logs for pod {pod_name}.",
@@ -260,9 +542,17 @@ def _get_detailed_error_logs(
 def _get_pod_recent_events(
     k8s_client, pod_name, namespace, config, min_log, logs_extra
 ):
-    pod_events = k8s_client.list_namespaced_event(
-        namespace=namespace, field_selector=f"involvedObject.name={pod_name}"
-    ).to_dict()
+    # The events are needed in order, so no limit here. Just the fields we use.
+    pod_events = project_event_list(
+        read_json(
+            k8s_client.list_namespaced_event(
+                namespace=namespace,
+                field_selector=f"involvedObject.name={pod_name}",
+                _request_timeout=_get_status_timeout(config),
+                _preload_content=False,
+            )
+        )
+    )
     pod_events_items = pod_events["items"]
 
     if len(pod_events_items) == 0:
@@ -271,11 +561,8 @@ def _get_pod_recent_events(
 
     if min_log <= 5:
         # pods is not serializable, but at trace level we want to log it for debugging
-        trace_logs_extra_pods_dict = json.loads(
-            json.dumps(pod_events_items, default=str)
-        )
-        trace_logs_extra = copy.deepcopy(logs_extra)
-        trace_logs_extra["pod_events_items"] = trace_logs_extra_pods_dict
+        trace_logs_extra = dict(logs_extra)
+        trace_logs_extra["pod_events_items"] = LazyTracePayload(pod_events_items)
         log.trace(
             f"Check pod events - namespace={namespace} pod_name={pod_name}",
             extra=trace_logs_extra,
@@ -298,13 +585,123 @@ def _get_pod_recent_events(
     return ret
 
 
+def _get_status_timeout(config):
+    return config.get("services", {}).get("status_information", {}).get("timeout", 20)
+
+
+def _get_gunicorn_threads():
+    # Same default as gunicorn_http.py and gunicorn_https.py
+    return int(os.environ.get("GUNICORN_THREADS", 25))
+
+
+def _get_status_max_workers(config):
+    return (
+        config.get("services", {})
+        .get("status_information", {})
+        .get("max_workers", 2 * _get_gunicorn_threads())
+    )
+
+
+def _get_status_executor(config):
+    return get_executor("status", _get_status_max_workers(config))
+
+
+def _result_until(future, deadline, default, what, logs_extra):
+    """
+    Wait for the result of future until deadline (time.monotonic()) is reached.
+    Returns default, if the deadline was hit before.
+    """
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeoutError:
+        log.warning(
+            f"Status check deadline reached while waiting for {what}",
+            extra=logs_extra,
+        )
+        return default
+
+
 def status_service(drf_id, config, logs_extra={}):
-    status = {}
+    deadline = time.monotonic() + _get_status_timeout(config)
     k8s_client = _k8s_get_client_core()
     namespace = _k8s_get_namespace()
-    min_log = min([h.level for h in log.handlers], default=20)
+    min_log = get_min_handler_level(log)
     deployment_main = _get_deployment_main(drf_id, config, min_log, logs_extra)
-    pod = _get_pod(k8s_client, namespace, deployment_main, min_log, logs_extra)
+    pod = _get_pod(k8s_client, namespace, deployment_main, config, min_log, logs_extra)
+    return _status_from_pod_cached(
+        drf_id, k8s_client, namespace, config, pod, deadline, min_log, logs_extra
+    )
+
+
+def status_services(drf_ids, config, logs_extra={}):
+    """
+    Status check for multiple services at once. All pods are received with
+    one label selector request (or from the pod cache).
+    logs_extra is a dict with a logs_extra dict for each drf_id.
+    Returns a dict drf_id -> status. If the status check for a drf_id
+    failed, the exception will be returned instead.
+    """
+    ret = {}
+    deadline = time.monotonic() + _get_status_timeout(config)
+    k8s_client = _k8s_get_client_core()
+    namespace = _k8s_get_namespace()
+    min_log = get_min_handler_level(log)
+
+    name_labels = {}
+    for drf_id in drf_ids:
+        try:
+            deployment_main = _get_deployment_main(
+                drf_id, config, min_log, logs_extra.get(drf_id, {})
+            )
+            selector = deployment_main["spec"]["selector"]
+            name_labels[drf_id] = selector["matchLabels"]["name"]
+        except Exception as e:
+            ret[drf_id] = e
+
+    pods = _get_pods(k8s_client, namespace, set(name_labels.values()), config)
+    for drf_id, name_label in name_labels.items():
+        drf_id_logs_extra = logs_extra.get(drf_id, {})
+        try:
+            pod = _select_pod(
+                pods.get(name_label, []),
+                namespace,
+                name_label,
+                min_log,
+                drf_id_logs_extra,
+            )
+            ret[drf_id] = _status_from_pod_cached(
+                drf_id,
+                k8s_client,
+                namespace,
+                config,
+                pod,
+                deadline,
+                min_log,
+                drf_id_logs_extra,
+            )
+        except Exception as e:
+            ret[drf_id] = e
+    return ret
+
+
+def _status_from_pod_cached(
+    drf_id, k8s_client, namespace, config, pod, deadline, min_log, logs_extra
+):
+    resource_version = pod.get("metadata", {}).get("resource_version", None)
+    status = status_cache.get_status(drf_id, resource_version, config)
+    if status is not None:
+        log.trace("Use cached status", extra=logs_extra)
+        return status
+    status = _status_from_pod(
+        k8s_client, namespace, config, pod, deadline, min_log, logs_extra
+    )
+    status_cache.set_status(drf_id, resource_version, status, config)
+    return status
+
+
+def _status_from_pod(k8s_client, namespace, config, pod, deadline, min_log, logs_extra):
+    status = {}
+    executor = _get_status_executor(config)
 
     # To define if a service is running, we check various things
     # https://kubernetes.io/docs/concepts/workloads/pods/pod-lifecycle/
@@ -321,12 +718,19 @@ def status_service(drf_id, config, logs_extra={}):
         if pod_phase == "Succeeded":
             pod_phase = "Failed"
 
-        recent_logs = _get_detailed_error_logs(
-            k8s_client,
-            pod["metadata"]["name"],
-            namespace,
-            config,
-            min_log,
+        recent_logs = _result_until(
+            executor.submit(
+                _get_detailed_error_logs,
+                k8s_client,
+                pod,
+                namespace,
+                config,
+                min_log,
+                logs_extra,
+            ),
+            deadline,
+            "No logs available",
+            "container logs",
             logs_extra,
         )
         status = {
@@ -343,12 +747,19 @@ def status_service(drf_id, config, logs_extra={}):
 
     if container_main["state"]["terminated"]:
         # Main container was terminated. We don't support restarts. So return False
-        recent_logs = _get_detailed_error_logs(
-            k8s_client,
-            pod["metadata"]["name"],
-            namespace,
-            config,
-            min_log,
+        recent_logs = _result_until(
+            executor.submit(
+                _get_detailed_error_logs,
+                k8s_client,
+                pod,
+                namespace,
+                config,
+                min_log,
+                logs_extra,
+            ),
+            deadline,
+            "No logs available",
+            "container logs",
             logs_extra,
         )
         log.debug("Container state not as expected (terminated))", extra=logs_extra)
@@ -370,9 +781,41 @@ def status_service(drf_id, config, logs_extra={}):
     else:
         # Container is still in waiting state or in None. Let's check for events.
         # Maybe we find an ongoing problem, then we can send back False
-        last_n_events = _get_pod_recent_events(
-            k8s_client, pod["metadata"]["name"], namespace, config, min_log, logs_extra
+        # Events and logs are received concurrently. The logs are only
+        # requested in advance, if the waiting reason looks like a problem.
+        # During a normal start we don't want an additional API call.
+        waiting_reason = (container_main["state"].get("waiting") or {}).get(
+            "reason", ""
         )
+        logs_future = None
+        if waiting_reason not in ["ContainerCreating", "PodInitializing"]:
+            logs_future = executor.submit(
+                _get_detailed_error_logs,
+                k8s_client,
+                pod,
+                namespace,
+                config,
+                min_log,
+                logs_extra,
+            )
+        last_n_events = _result_until(
+            executor.submit(
+                _get_pod_recent_events,
+                k8s_client,
+                pod["metadata"]["name"],
+                namespace,
+                config,
+                min_log,
+                logs_extra,
+            ),
+            deadline,
+            None,
+            "pod events",
+            logs_extra,
+        )
+        if last_n_events is None:
+            # We don't know it better yet. JupyterHub will ask again.
+            return {"running": True}
         bad_event_types = config.get("services", {}).get(
             "pod_events_to_fail", ["Warning"]
         )
@@ -380,12 +823,21 @@ def status_service(drf_id, config, logs_extra={}):
         last_event_logs_extra["last_event"] = last_n_events
         last_n_event_types = [x["type"] for x in last_n_events if "type" in x]
         if set(bad_event_types) <= set(last_n_event_types):
-            recent_logs = _get_detailed_error_logs(
-                k8s_client,
-                pod["metadata"]["name"],
-                namespace,
-                config,
-                min_log,
+            if logs_future is None:
+                logs_future = executor.submit(
+                    _get_detailed_error_logs,
+                    k8s_client,
+                    pod,
+                    namespace,
+                    config,
+                    min_log,
+                    logs_extra,
+                )
+            recent_logs = _result_until(
+                logs_future,
+                deadline,
+                "No logs available",
+                "container logs",
                 logs_extra,
             )
 
@@ -484,15 +936,23 @@ def _create_user_home(config, validated_data, jhub_credential, logs_extra):
         log.debug(f"Create home directory {userhome_user_path}", extra=logs_extra)
         os.makedirs(userhome_skel, exist_ok=True)
         ignore_files = config.get("userhomes", {}).get("skel_ignore_files", [])
-        shutil.copytree(
-            src=userhome_skel,
-            dst=userhome_user_path,
-            ignore=shutil.ignore_patterns(*ignore_files),
+        timings = userhome.create_user_home(
+            userhome_user_path,
+            userhome_skel,
+            ignore_files,
+            userhome_uid,
+            userhome_gid,
+            config.get("userhomes", {}),
+            logs_extra,
+        )
+        timings_logs_extra = dict(logs_extra)
+        timings_logs_extra["userhome_timings"] = {
+            key: round(value, 3) for key, value in timings.items()
+        }
+        log.info(
+            f"Home directory {userhome_user_path} created in {timings['total']:.3f}s",
+            extra=timings_logs_extra,
         )
-        for dirpath, dirnames, filenames in os.walk(userhome_user_path):
-            shutil.chown(dirpath, userhome_uid, userhome_gid)
-            for filename in filenames:
-                shutil.chown(os.path.join(dirpath, filename), userhome_uid, userhome_gid)
     else:
         log.debug(
             f"Home directory {userhome_user_path} already exists.", extra=logs_extra
@@ -514,38 +974,135 @@ def _create_service_yaml(
 
     input_dir = config.get("services", {}).get("input_dir", "input")
     service_yaml_file = _get_yaml_file_name(drf_id, config)
-    service_yaml_s = _yaml_get_service_as_string(
-        config,
-        jhub_credential,
-        validated_data,
-        service_yaml_file,
-        input_dir,
-        logs_extra,
-    )
+    with timing.span("yaml_get_service_as_string"):
+        service_yaml_s, input_string = _yaml_get_service_as_string(
+            config,
+            jhub_credential,
+            validated_data,
+            service_yaml_file,
+            input_dir,
+            logs_extra,
+        )
 
-    input_string = _create_input_string(service_yaml_file, input_dir)
+    input_hash = None
+    input_configmap = ""
+    if input_string and _get_shared_input_enabled(config):
+        input_hash = hashlib.sha256(input_string.encode()).hexdigest()[0:32]
+        input_configmap = _get_shared_input_configmap_name(input_hash)
 
-    service_yaml_s = _yaml_replace(
-        drf_id,
-        config,
-        service_yaml_s,
-        jhub_credential,
-        jhub_user_id,
-        input_string,
-        logs_extra,
-    )
+    with timing.span("yaml_replace"):
+        service_yaml_s = _yaml_replace(
+            drf_id,
+            config,
+            service_yaml_s,
+            jhub_credential,
+            jhub_user_id,
+            input_string,
+            logs_extra,
+            input_configmap=input_configmap,
+        )
+    if input_configmap not in service_yaml_s:
+        # Service description does not use the shared ConfigMap
+        input_hash = None
     with lockfile.LockFile(service_yaml_file):
         with open(service_yaml_file, "w") as f:
             f.write(service_yaml_s)
+        stat_key = _deployment_main_cache_key(service_yaml_file)
+    # Parsed once, used for the cache and to create the resources
+    service_objects = list(yaml.safe_load_all(service_yaml_s))
+    deployment_main = None
+    _, deployment_main_list = _select_deployment_main(drf_id, config, service_objects)
+    if len(deployment_main_list) == 1:
+        deployment_main = deployment_main_list[0]
+        _deployment_main_cache_set(drf_id, stat_key, deployment_main)
+    else:
+        # Valid for services without a main deployment.
+        # Status checks will report it, if they need one.
+        deployment_main_name = _get_deployment_main_name(drf_id, config)
+        log.debug(
+            f"No deployment configured with name {deployment_main_name}",
+            extra=logs_extra,
+        )
+        _deployment_main_cache_remove(drf_id)
+
+    owner_references = None
+    if _get_owner_references_enabled(config):
+        with timing.span("create_anchor"):
+            owner_references = _create_anchor(drf_id, logs_extra)
+
+    def create_secret_and_shared_input():
+        # The secret must exist before the shared ConfigMap (reference count)
+        with timing.span("create_secret"):
+            _create_secret_resource(
+                servername,
+                drf_id,
+                config,
+                initial_data,
+                custom_headers,
+                logs_extra,
+                input_hash=input_hash,
+                owner_references=owner_references,
+            )
+        if input_hash:
+            with timing.span("create_shared_input"):
+                _create_shared_input_configmap(
+                    input_configmap, input_hash, input_string, drf_id, logs_extra
+                )
 
-    _create_secret_resource(
-        servername, drf_id, config, initial_data, custom_headers, logs_extra
-    )
+    creations = [
+        (f"Secret {_k8s_get_secret_name(drf_id)}", create_secret_and_shared_input)
+    ]
     if "certs" in initial_data.keys():
-        _create_secret_certificate_resource(
-            servername, drf_id, config, initial_data, custom_headers, logs_extra
+        creations.append(
+            (
+                f"Secret {_k8s_get_secret_certs_name(drf_id)}",
+                functools.partial(
+                    _create_secret_certificate_resource,
+                    servername,
+                    drf_id,
+                    config,
+                    initial_data,
+                    custom_headers,
+                    logs_extra,
+                    owner_references=owner_references,
+                ),
+            )
+        )
+    claim_deployment_main = None
+    pool_key = _get_warm_pool_key(
+        config, jhub_credential, validated_data["user_options"]["service"]
+    )
+    if pool_key and deployment_main:
+        annotations = {
+            "k8smgr/drf-id": drf_id,
+            "k8smgr/secret-name": _k8s_get_secret_name(drf_id),
+        }
+        if "certs" in initial_data.keys():
+            annotations["k8smgr/secret-certs-name"] = _k8s_get_secret_certs_name(drf_id)
+        if input_hash:
+            annotations["k8smgr/input-configmap"] = input_configmap
+        claim_deployment_main = (
+            deployment_main["metadata"]["name"],
+            functools.partial(
+                _claim_warm_pod,
+                pool_key,
+                drf_id,
+                deployment_main,
+                annotations,
+                logs_extra,
+                owner_references=owner_references,
+            ),
+        )
+    with timing.span("create_resources"):
+        _create_service_resources(
+            creations,
+            service_objects,
+            config,
+            logs_extra,
+            claim_deployment_main=claim_deployment_main,
+            labels=_get_service_labels(drf_id),
+            owner_references=owner_references,
         )
-    _create_service_resource(service_yaml_file, logs_extra)
 
     # We've created service.yaml, no we want to prepare update.yaml, if it exists.
     # This allows us to update the service later during the starting phase (e.g. adding
@@ -564,6 +1121,7 @@ def _create_service_yaml(
             jhub_user_id,
             input_string,
             logs_extra,
+            input_configmap=input_configmap,
         )
         with lockfile.LockFile(update_yaml_file):
             with open(update_yaml_file, "w") as f:
@@ -581,9 +1139,145 @@ def _get_yaml_file_name(drf_id, config, filename=None):
     return service_yaml_file
 
 
+# Rendered service descriptions (bundles), cached by a hash of the description
+# directory and the skip/rename rules. A bundle contains all files of the
+# service description, except the input directory, which is stored as the
+# base64 encoded tar.gz string. Starting a service only writes these files
+# and replaces the keywords, instead of copying, renaming and archiving
+# the description directory for every start.
+# Content hashes of single files are cached by their stat values, so only
+# changed files are read again.
+_service_bundle_cache = OrderedDict()
+_service_bundle_cache_lock = threading.Lock()
+_service_bundle_cache_max = 100
+_file_hash_cache = OrderedDict()
+_file_hash_cache_lock = threading.Lock()
+_file_hash_cache_max = 10000
+
+
+def _get_file_hash(path):
+    stat = os.stat(path)
+    stat_key = (path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _file_hash_cache_lock:
+        if stat_key in _file_hash_cache.keys():
+            _file_hash_cache.move_to_end(stat_key)
+            return _file_hash_cache[stat_key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    file_hash = h.hexdigest()
+    with _file_hash_cache_lock:
+        _file_hash_cache[stat_key] = file_hash
+        while len(_file_hash_cache) > _file_hash_cache_max:
+            _file_hash_cache.popitem(last=False)
+    return file_hash
+
+
+def _get_service_bundle_key(services_skel, rules):
+    h = hashlib.sha256(repr(rules).encode())
+    for dirpath, dirnames, filenames in os.walk(services_skel):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            h.update(os.path.relpath(path, services_skel).encode())
+            h.update(_get_file_hash(path).encode())
+    return h.hexdigest()
+
+
+def _rename_stage_credential_files(input_path, stage, jhub_credential):
+    for subdir, dirs, files in os.walk(input_path):
+        for file in files:
+            if file.startswith(f"{stage}_{jhub_credential}_"):
+                newname = file[len(stage) + 1 + len(jhub_credential) + 1 :]
+                shutil.move(f"{subdir}/{file}", f"{subdir}/{newname}")
+            elif file.startswith(f"{stage}_"):
+                newname = file[len(stage) + 1 :]
+                shutil.move(f"{subdir}/{file}", f"{subdir}/{newname}")
+            elif file.startswith(f"{jhub_credential}_"):
+                newname = file[len(jhub_credential) + 1 :]
+                shutil.move(f"{subdir}/{file}", f"{subdir}/{newname}")
+
+
+def _build_service_bundle(
+    services_skel,
+    ignore_files,
+    stage,
+    jhub_credential,
+    input_dir,
+    yaml_filename,
+    compresslevel,
+):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bundle_path = f"{tmp_dir}/service"
+        shutil.copytree(
+            src=services_skel,
+            dst=bundle_path,
+            ignore=shutil.ignore_patterns(*ignore_files),
+        )
+        _rename_stage_credential_files(
+            f"{bundle_path}/{input_dir}", stage, jhub_credential
+        )
+        with timing.span("create_input_string"):
+            input_string = _create_input_string(
+                f"{bundle_path}/{yaml_filename}", input_dir, compresslevel
+            )
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(bundle_path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, bundle_path)] = f.read()
+    return {"files": files, "input_string": input_string}
+
+
+def _get_service_bundle(
+    services_skel,
+    ignore_files,
+    stage,
+    jhub_credential,
+    input_dir,
+    yaml_filename,
+    compresslevel,
+    logs_extra,
+):
+    rules = (
+        ignore_files,
+        stage,
+        jhub_credential,
+        input_dir,
+        yaml_filename,
+        compresslevel,
+    )
+    key = _get_service_bundle_key(services_skel, rules)
+    with _service_bundle_cache_lock:
+        if key in _service_bundle_cache.keys():
+            _service_bundle_cache.move_to_end(key)
+            return _service_bundle_cache[key]
+    log.debug(f"Create service bundle for {services_skel}", extra=logs_extra)
+    bundle = _build_service_bundle(
+        services_skel,
+        ignore_files,
+        stage,
+        jhub_credential,
+        input_dir,
+        yaml_filename,
+        compresslevel,
+    )
+    with _service_bundle_cache_lock:
+        _service_bundle_cache[key] = bundle
+        while len(_service_bundle_cache) > _service_bundle_cache_max:
+            _service_bundle_cache.popitem(last=False)
+    return bundle
+
+
 def _yaml_get_service_as_string(
     config, jhub_credential, validated_data, service_yaml_file, input_dir, logs_extra
 ):
+    """
+    Returns the service yaml template and the input string (base64 encoded
+    tar.gz of the input directory) for this service.
+    """
     services_skel_base = (
         config.get("services", {})
         .get("descriptions", "/tmp/services/descriptions")
@@ -599,6 +1293,7 @@ def _yaml_get_service_as_string(
 
     services_skel = f"{services_skel_base}/{jhub_credential_to_use}/{validated_data['user_options']['service'].rstrip('/')}"
     services_service_path = os.path.dirname(service_yaml_file)
+    compresslevel = config.get("services", {}).get("input_compresslevel", 9)
 
     if not os.path.exists(services_service_path):
         log.debug(
@@ -606,7 +1301,9 @@ def _yaml_get_service_as_string(
             extra=logs_extra,
         )
         os.makedirs(services_skel, exist_ok=True)
-        ignore_files = config.get("services", {}).get("descriptions_ignore_files", [])
+        ignore_files = list(
+            config.get("services", {}).get("descriptions_ignore_files", [])
+        )
         stage = os.environ.get("STAGE", "").lower()
         if stage:
             stages_to_skip = [
@@ -633,56 +1330,88 @@ def _yaml_get_service_as_string(
         ]
         ignore_files.extend(credential_to_skip)
 
-        shutil.copytree(
-            src=services_skel,
-            dst=services_service_path,
-            ignore=shutil.ignore_patterns(*ignore_files),
+        bundle = _get_service_bundle(
+            services_skel,
+            ignore_files,
+            stage,
+            jhub_credential,
+            input_dir,
+            os.path.basename(service_yaml_file),
+            compresslevel,
+            logs_extra,
+        )
+        for relpath, content in bundle["files"].items():
+            path = os.path.join(services_service_path, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(content)
+        input_string = bundle["input_string"]
+        service_yaml_content = bundle["files"].get(
+            os.path.basename(service_yaml_file), None
         )
-
-        # Rename specific files
-        for subdir, dirs, files in os.walk(f"{services_service_path}/{input_dir}"):
-            for file in files:
-                if file.startswith(f"{stage}_{jhub_credential}_"):
-                    newname = file[len(stage) + 1 + len(jhub_credential) + 1 :]
-                    shutil.move(f"{subdir}/{file}", f"{subdir}/{newname}")
-                elif file.startswith(f"{stage}_"):
-                    newname = file[len(stage) + 1 :]
-                    shutil.move(f"{subdir}/{file}", f"{subdir}/{newname}")
-                elif file.startswith(f"{jhub_credential}_"):
-                    newname = file[len(jhub_credential) + 1 :]
-                    shutil.move(f"{subdir}/{file}", f"{subdir}/{newname}")
     else:
         log.critical(
             f"Service specific directory {services_service_path} already exists.",
             extra=logs_extra,
         )
-
-    if not os.path.exists(service_yaml_file):
+        input_string = _create_input_string(service_yaml_file, input_dir, compresslevel)
+        service_yaml_content = None
+        if os.path.exists(service_yaml_file):
+            with lockfile.LockFile(service_yaml_file):
+                with open(service_yaml_file, "rb") as f:
+                    service_yaml_content = f.read()
+
+    if service_yaml_content is None:
         log.critical(
             f"Configured service yaml file {service_yaml_file} does not exist.",
             extra=logs_extra,
         )
         raise Exception("Couldn't find service yaml file.")
-    with lockfile.LockFile(service_yaml_file):
-        with open(service_yaml_file, "r") as f:
-            service_yaml_s = f.read()
-    return service_yaml_s
+    return service_yaml_content.decode(), input_string
+
+
+def _normalize_tarinfo(tarinfo):
+    # Same input, same bytes
+    tarinfo.mtime = 0
+    tarinfo.uid = 0
+    tarinfo.gid = 0
+    tarinfo.uname = ""
+    tarinfo.gname = ""
+    return tarinfo
 
 
-def _create_input_string(service_yaml_file, input_dir):
+def _create_input_string(service_yaml_file, input_dir, compresslevel=9):
+    # The archive is built in memory. tarfile adds directory entries sorted,
+    # gzip without timestamp, so the result is deterministic.
     services_service_path = os.path.dirname(service_yaml_file)
     if os.path.exists(f"{services_service_path}/{input_dir}"):
-        with tarfile.open(f"{services_service_path}/{input_dir}.tar.gz", "w:gz") as tar:
-            tar.add(f"{services_service_path}/{input_dir}", arcname="input")
-        with open(f"{services_service_path}/{input_dir}.tar.gz", "rb") as f:
-            encoded_input = base64.b64encode(f.read())
+        buffer = io.BytesIO()
+        with gzip.GzipFile(
+            filename="", mode="wb", fileobj=buffer, compresslevel=compresslevel, mtime=0
+        ) as gz:
+            with tarfile.open(fileobj=gz, mode="w") as tar:
+                tar.add(
+                    f"{services_service_path}/{input_dir}",
+                    arcname="input",
+                    filter=_normalize_tarinfo,
+                )
         shutil.rmtree(f"{services_service_path}/{input_dir}")
-        os.remove(f"{services_service_path}/{input_dir}.tar.gz")
-        return encoded_input.decode()
+        return base64.b64encode(buffer.getvalue()).decode()
     else:
         return ""
 
 
+@functools.lru_cache(maxsize=256)
+def _yaml_replace_pattern(indicator_start, indicator_end, keywords):
+    # Longest keywords first, so a keyword can't shadow a longer one
+    keywords_re = "|".join(
+        re.escape(x) for x in sorted(keywords, key=len, reverse=True)
+    )
+    return re.compile(
+        f"{re.escape(indicator_start)}({keywords_re}){re.escape(indicator_end)}"
+    )
+
+
 def _yaml_replace(
     drf_id,
     config,
@@ -691,6 +1420,7 @@ def _yaml_replace(
     jhub_user_id,
     input_string,
     logs_extra,
+    input_configmap="",
 ):
     unique_user = f"{jhub_credential}_{jhub_user_id}"
     replace_indicators = (
@@ -725,87 +1455,129 @@ def _yaml_replace(
     input_keyword = (
         config.get("services", {}).get("replace", {}).get("input_keyword", "input")
     )
-    yaml_s = yaml_s.replace(
-        f"{replace_indicators[0]}{input_keyword}{replace_indicators[1]}",
-        input_string,
-    )
-    yaml_s = yaml_s.replace(
-        f"{replace_indicators[0]}{drf_id_keyword}{replace_indicators[1]}",
-        str(drf_id),
-    )
-    yaml_s = yaml_s.replace(
-        f"{replace_indicators[0]}{uniqueuserid_keyword}{replace_indicators[1]}",
-        unique_user,
-    )
-    yaml_s = yaml_s.replace(
-        f"{replace_indicators[0]}{userid_keyword}{replace_indicators[1]}",
-        str(jhub_user_id),
-    )
-    yaml_s = yaml_s.replace(
-        f"{replace_indicators[0]}{secretname_keyword}{replace_indicators[1]}",
-        _k8s_get_secret_name(drf_id),
-    )
-    yaml_s = yaml_s.replace(
-        f"{replace_indicators[0]}{secretcertsname_keyword}{replace_indicators[1]}",
-        _k8s_get_secret_certs_name(drf_id),
-    )
-    yaml_s = yaml_s.replace(
-        f"{replace_indicators[0]}{namespace_keyword}{replace_indicators[1]}",
-        _k8s_get_namespace(),
+    input_configmap_keyword = (
+        config.get("services", {})
+        .get("replace", {})
+        .get("input_configmap_keyword", "input_configmap")
     )
+    # Same order as sequential replaces: fixed keywords, stage_credential,
+    # stage, credential. Values inserted by a group (e.g. a stage_credential
+    # value containing <stagekey>) are expanded by the following groups.
+    # Each group is replaced in one pass over the template.
+    replacements = {
+        input_keyword: input_string,
+        drf_id_keyword: str(drf_id),
+        uniqueuserid_keyword: unique_user,
+        userid_keyword: str(jhub_user_id),
+        secretname_keyword: _k8s_get_secret_name(drf_id),
+        secretcertsname_keyword: _k8s_get_secret_certs_name(drf_id),
+        namespace_keyword: _k8s_get_namespace(),
+    }
+    if input_configmap:
+        replacements[input_configmap_keyword] = input_configmap
+    yaml_s = _yaml_replace_keywords(yaml_s, replace_indicators, replacements)
 
     # Replace stage specific keywords, if stage is defined
     stage = os.environ.get("STAGE", "").lower()
     if stage:
         # First replace stage+credential specific
-        for key, value in (
+        yaml_s = _yaml_replace_keywords(
+            yaml_s,
+            replace_indicators,
             config.get("services", {})
             .get("replace", {})
             .get("stage_credential", {})
             .get(stage, {})
-            .get(jhub_credential, {})
-            .items()
-        ):
-            yaml_s = yaml_s.replace(
-                f"{replace_indicators[0]}{key}{replace_indicators[1]}",
-                value,
-            )
-        for key, value in (
+            .get(jhub_credential, {}),
+        )
+        yaml_s = _yaml_replace_keywords(
+            yaml_s,
+            replace_indicators,
             config.get("services", {})
             .get("replace", {})
             .get("stage", {})
-            .get(stage, {})
-            .items()
-        ):
-            yaml_s = yaml_s.replace(
-                f"{replace_indicators[0]}{key}{replace_indicators[1]}",
-                value,
-            )
+            .get(stage, {}),
+        )
 
     # Replace credential specific keywords
-    for key, value in (
+    return _yaml_replace_keywords(
+        yaml_s,
+        replace_indicators,
         config.get("services", {})
         .get("replace", {})
         .get("credential", {})
-        .get(jhub_credential, {})
-        .items()
-    ):
-        yaml_s = yaml_s.replace(
-            f"{replace_indicators[0]}{key}{replace_indicators[1]}",
-            value,
-        )
-
-    return yaml_s
+        .get(jhub_credential, {}),
+    )
 
 
-def _k8s_get_client_core():
-    config.load_incluster_config()
-    return client.CoreV1Api()
+def _yaml_replace_keywords(yaml_s, replace_indicators, replacements):
+    if not replacements:
+        return yaml_s
+    if any(replace_indicators[0] in value for value in replacements.values()):
+        # A value contains keywords of the same group. Expand them like
+        # sequential replaces in the order of the group would.
+        for key, value in replacements.items():
+            yaml_s = yaml_s.replace(
+                f"{replace_indicators[0]}{key}{replace_indicators[1]}", value
+            )
+        return yaml_s
+    pattern = _yaml_replace_pattern(
+        replace_indicators[0], replace_indicators[1], tuple(replacements.keys())
+    )
+    return pattern.sub(lambda m: replacements[m.group(1)], yaml_s)
+
+
+# Each worker process uses one ApiClient. Its urllib3 connection pool is shared
+# by all threads, so TLS connections to the API server are reused across
+# requests. The client is created lazily and bound to the pid of the process
+# which created it, because gunicorn forks the workers after loading the app.
+# With try_refresh_token the service account token is reloaded from its file
+# once a minute, so rotated tokens are picked up.
+_k8s_api_client = {"pid": None, "client": None}
+_k8s_api_client_lock = threading.Lock()
+
+
+def _k8s_get_connection_pool_maxsize(config):
+    """
+    One connection per gunicorn thread and per thread of the executors
+    calling the API, plus one for the pod informer watch.
+    """
+    services_config = config.get("services", {})
+    default = (
+        _get_gunicorn_threads()
+        + _get_status_max_workers(config)
+        + services_config.get("create_max_workers", 10)
+        + services_config.get("delete_max_workers", 8)
+        + services_config.get("bulk_stop", {}).get("max_workers", 4)
+        + 1
+    )
+    for key, max_workers in [
+        ("async_start", 4),
+        ("async_stop", 8),
+        ("reconciler", 2),
+    ]:
+        if services_config.get(key, {}).get("enabled", False):
+            default += services_config[key].get("max_workers", max_workers)
+    return int(os.environ.get("K8S_CONNECTION_POOL_MAXSIZE", default))
 
 
 def _k8s_get_api_client():
-    config.load_incluster_config()
-    return client.ApiClient()
+    with _k8s_api_client_lock:
+        if _k8s_api_client["pid"] != os.getpid() or _k8s_api_client["client"] is None:
+            configuration = client.Configuration()
+            config.load_incluster_config(
+                client_configuration=configuration, try_refresh_token=True
+            )
+            configuration.connection_pool_maxsize = _k8s_get_connection_pool_maxsize(
+                _config()
+            )
+            _k8s_api_client["client"] = client.ApiClient(configuration)
+            _k8s_api_client["pid"] = os.getpid()
+        return _k8s_api_client["client"]
+
+
+def _k8s_get_client_core():
+    return client.CoreV1Api(_k8s_get_api_client())
 
 
 def _k8s_get_secret_name(drf_id):
@@ -822,18 +1594,160 @@ def _k8s_get_namespace():
     return os.environ.get("DEPLOYMENT_NAMESPACE", "default")
 
 
-def _get_k8s_secret_object(secret_name, data):
+# Every object created for a service is labeled with a hash of its drf_id and
+# the DEPLOYMENT_NAME of this manager. Stop deletes them with a few
+# delete_collection calls by label selector, so it does not depend on
+# service.yaml. Services created without these labels are deleted by the
+# objects listed in service.yaml and update.yaml.
+_drf_id_label = "k8smgr-drf-id"
+_owner_label = "k8smgr-owner"
+
+
+def _get_drf_id_label_value(drf_id):
+    return hashlib.sha256(str(drf_id).encode()).hexdigest()[0:32]
+
+
+def _get_service_labels(drf_id):
+    return {
+        _owner_label: os.environ.get("DEPLOYMENT_NAME", "k8smgr")[0:63],
+        _drf_id_label: _get_drf_id_label_value(drf_id),
+    }
+
+
+def _with_labels(metadata, labels):
+    metadata = dict(metadata or {})
+    metadata["labels"] = dict(metadata.get("labels", None) or {}, **labels)
+    return metadata
+
+
+def _with_service_labels(service_object, labels):
+    """
+    Returns a copy of service_object with labels added to its metadata
+    and to the metadata of its pod template.
+    """
+    service_object = dict(service_object)
+    service_object["metadata"] = _with_labels(service_object.get("metadata"), labels)
+    spec = service_object.get("spec", None)
+    if isinstance(spec, dict) and isinstance(spec.get("template", None), dict):
+        spec = dict(spec)
+        spec["template"] = dict(spec["template"])
+        spec["template"]["metadata"] = _with_labels(
+            spec["template"].get("metadata"), labels
+        )
+        service_object["spec"] = spec
+    return service_object
+
+
+# Anchor (services.owner_references.enabled): an empty ConfigMap per service,
+# created before all other objects. Every object of the service gets an
+# ownerReference to it, so stop deletes only the anchor and the Kubernetes
+# garbage collector deletes the rest (propagation_policy Background or
+# Foreground). Pods of Deployments, Jobs, ... are owned by those already.
+# Services without an anchor are deleted by label.
+
+
+def _get_owner_references_enabled(config):
+    return config.get("services", {}).get("owner_references", {}).get("enabled", False)
+
+
+def _k8s_get_anchor_name(drf_id):
+    deployment_name = os.environ.get("DEPLOYMENT_NAME", "k8smgr")
+    return f"anchor-{drf_id}-{deployment_name}"[0:63]
+
+
+def _get_owner_references(anchor):
+    return [
+        {
+            "apiVersion": "v1",
+            "kind": "ConfigMap",
+            "name": anchor["metadata"]["name"],
+            "uid": anchor["metadata"]["uid"],
+        }
+    ]
+
+
+def _create_anchor(drf_id, logs_extra):
+    """
+    Returns the ownerReferences for all other objects of the service.
+    """
+    name = _k8s_get_anchor_name(drf_id)
+    body = {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {"name": name, "labels": _get_service_labels(drf_id)},
+    }
+    anchor = read_json(
+        _k8s_get_client_core().create_namespaced_config_map(
+            namespace=_k8s_get_namespace(), body=body, _preload_content=False
+        )
+    )
+    log.debug(f"Anchor ConfigMap {name} created", extra=logs_extra)
+    return _get_owner_references(anchor)
+
+
+def _get_anchor_owner_references(drf_id):
+    """
+    Returns None, if the service has no anchor.
+    """
+    try:
+        anchor = read_json(
+            _k8s_get_client_core().read_namespaced_config_map(
+                name=_k8s_get_anchor_name(drf_id),
+                namespace=_k8s_get_namespace(),
+                _preload_content=False,
+            )
+        )
+    except ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+    return _get_owner_references(anchor)
+
+
+def _delete_anchor(drf_id, config, logs_extra):
+    """
+    Returns False, if the service has no anchor.
+    """
+    propagation_policy = (
+        config.get("services", {})
+        .get("owner_references", {})
+        .get("propagation_policy", "Background")
+    )
+    try:
+        _k8s_get_client_core().delete_namespaced_config_map(
+            name=_k8s_get_anchor_name(drf_id),
+            namespace=_k8s_get_namespace(),
+            propagation_policy=propagation_policy,
+        )
+    except ApiException as e:
+        if e.status == 404:
+            return False
+        raise
+    return True
+
+
+def _get_k8s_secret_object(secret_name, data, labels=None, owner_references=None):
     body = client.V1Secret()
     body.api_version = "v1"
     body.string_data = data
     body.kind = "Secret"
     body.metadata = {"name": secret_name}
+    if labels:
+        body.metadata["labels"] = labels
+    if owner_references:
+        body.metadata["ownerReferences"] = owner_references
     body.type = "Opaque"
     return body
 
 
 def _create_secret_certificate_resource(
-    servername, drf_id, config, initial_data, custom_headers, logs_extra
+    servername,
+    drf_id,
+    config,
+    initial_data,
+    custom_headers,
+    logs_extra,
+    owner_references=None,
 ):
     secret_certs_name = _k8s_get_secret_certs_name(drf_id)
     namespace = _k8s_get_namespace()
@@ -850,7 +1764,12 @@ def _create_secret_certificate_resource(
 
     # Create resource with cert_data
     k8s_client = _k8s_get_client_core()
-    body = _get_k8s_secret_object(secret_certs_name, cert_data)
+    body = _get_k8s_secret_object(
+        secret_certs_name,
+        cert_data,
+        labels=_get_service_labels(drf_id),
+        owner_references=owner_references,
+    )
     k8s_client.create_namespaced_secret(namespace=namespace, body=body)
     log.debug(
         f"Create secret cert resource ({secret_certs_name}) for {servername} ... done"
@@ -858,7 +1777,14 @@ def _create_secret_certificate_resource(
 
 
 def _create_secret_resource(
-    servername, drf_id, config, initial_data, custom_headers, logs_extra
+    servername,
+    drf_id,
+    config,
+    initial_data,
+    custom_headers,
+    logs_extra,
+    input_hash=None,
+    owner_references=None,
 ):
     secret_name = _k8s_get_secret_name(drf_id)
     log.debug(
@@ -878,7 +1804,12 @@ def _create_secret_resource(
     data["SERVERNAME"] = servername
     data["DRF_ID"] = str(drf_id)
 
-    body = _get_k8s_secret_object(secret_name, data)
+    labels = _get_service_labels(drf_id)
+    if input_hash:
+        labels[_shared_input_label] = input_hash
+    body = _get_k8s_secret_object(
+        secret_name, data, labels=labels, owner_references=owner_references
+    )
     k8s_client.create_namespaced_secret(namespace=namespace, body=body)
     log.debug(
         f"Create secret resource ({secret_name}) for {servername}... done",
@@ -886,18 +1817,753 @@ def _create_secret_resource(
     )
 
 
-def _create_service_resource(service_yaml_file, logs_extra):
+# Shared input ConfigMaps. Identical input directories (same content hash) are
+# stored in one ConfigMap, which service descriptions can use with the
+# <input_configmap> keyword. The secret of each service using it is labeled
+# with the hash, so the labeled secrets are the reference count. When the last
+# one is deleted, the ConfigMap is deleted as well.
+# The secret is always created before the ConfigMap and deleted before the
+# reference check. A start which finds the ConfigMap annotates it with its
+# drf_id, which changes the resourceVersion. The ConfigMap is only deleted
+# with the resourceVersion read before the reference check, so a start
+# between the check and the deletion keeps it. If it was deleted before the
+# annotation, the start creates it again.
+_shared_input_label = "k8smgr-input"
+_shared_input_user_annotation = "k8smgr/input-last-used-by"
+
+
+def _get_shared_input_enabled(config):
+    return config.get("services", {}).get("shared_input", {}).get("enabled", False)
+
+
+def _get_shared_input_configmap_name(input_hash):
+    deployment_name = os.environ.get("DEPLOYMENT_NAME", "k8smgr")
+    return f"input-{input_hash}-{deployment_name}"[0:63]
+
+
+def _create_shared_input_configmap(name, input_hash, input_string, drf_id, logs_extra):
+    k8s_client = _k8s_get_client_core()
+    namespace = _k8s_get_namespace()
+    annotations = {_shared_input_user_annotation: drf_id}
+    body = {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {
+            "name": name,
+            "labels": {_shared_input_label: input_hash},
+            "annotations": annotations,
+        },
+        "binaryData": {"input.tar.gz": input_string},
+    }
+    for attempt in range(3):
+        try:
+            k8s_client.create_namespaced_config_map(namespace=namespace, body=body)
+            log.debug(f"Shared input ConfigMap {name} created", extra=logs_extra)
+            return
+        except ApiException as e:
+            if e.status != 409:
+                raise
+        try:
+            # Changes the resourceVersion, so a concurrent deletion fails
+            k8s_client.patch_namespaced_config_map(
+                name=name,
+                namespace=namespace,
+                body={"metadata": {"annotations": annotations}},
+            )
+            log.debug(f"Use existing shared input ConfigMap {name}", extra=logs_extra)
+            return
+        except ApiException as e:
+            if e.status != 404:
+                raise
+        log.debug(
+            f"Shared input ConfigMap {name} was deleted in the meantime",
+            extra=logs_extra,
+        )
+    raise Exception(f"Could not create shared input ConfigMap {name}")
+
+
+def _delete_shared_input_configmap_if_unused(input_hash, logs_extra):
+    k8s_client = _k8s_get_client_core()
+    namespace = _k8s_get_namespace()
+    name = _get_shared_input_configmap_name(input_hash)
+    try:
+        # Read before the reference check, see _create_shared_input_configmap
+        configmap = read_json(
+            k8s_client.read_namespaced_config_map(
+                name=name, namespace=namespace, _preload_content=False
+            )
+        )
+        secrets = k8s_client.list_namespaced_secret(
+            namespace=namespace,
+            label_selector=f"{_shared_input_label}={input_hash}",
+            limit=1,
+            _preload_content=False,
+        )
+        if read_json(secrets).get("items", []):
+            return
+        log.debug(f"Delete unused shared input ConfigMap {name}", extra=logs_extra)
+        k8s_client.delete_namespaced_config_map(
+            name=name,
+            namespace=namespace,
+            body={
+                "preconditions": {
+                    "resourceVersion": configmap["metadata"]["resourceVersion"]
+                }
+            },
+        )
+    except Exception as e:
+        if getattr(e, "status", None) == 409:
+            log.debug(f"Shared input ConfigMap {name} is used again", extra=logs_extra)
+        elif getattr(e, "status", None) != 404:
+            log.warning(
+                f"Could not delete shared input ConfigMap {name}",
+                exc_info=True,
+                extra=logs_extra,
+            )
+
+
+# Warm pool (services.warm_pool): for each configured service description
+# (<credential>/<service>, relative to services.descriptions) a Deployment
+# with services.warm_pool.pools.<key>.size standby pods is kept running. It's
+# rendered from the file services.warm_pool.yaml_filename in the description
+# directory. A start claims a ready standby pod instead of creating its main
+# Deployment: the pod gets the labels of the main Deployment's pod template
+# (so Services and status checks find it) and annotations with the names of
+# the per-user secret and input. Standby pods have to wait for these
+# annotations (e.g. downward API volume). Removing the pool label detaches
+# the pod from the pool's ReplicaSet, which creates a replacement. The pod
+# gets the labels of the service, so it's deleted with the service.
+# Everything else of the main Deployment (image, volumes, env, resources) is
+# not applied to a claimed pod. So a pod is only claimed, if the pod spec of
+# the main Deployment (after the replacements of the start) is equal to the
+# pod spec of the pool. Both are compared by a hash, which the pool
+# Deployment and its pods carry as annotation. If warm_pool.yaml changes, the
+# pool Deployment is replaced and the old standby pods are no longer claimed.
+# Contract for the description of a pooled service: the pod template of the
+# main Deployment must not use the keywords which differ per start (<id>,
+# <secret_name>, <input_configmap>, ...). Objects outside of the pod
+# template (Services, ConfigMaps, ...) may use them. The pod gets these
+# values through the annotations of the claim. Rendering a pool checks the
+# description against warm_pool.yaml and logs a warning, if its pods can't
+# be claimed.
+_warm_pool_label = "k8smgr-warm-pool"
+_warm_pool_owner_label = "k8smgr-warm-pool-owner"
+_warm_pool_spec_annotation = "k8smgr/warm-pool-spec"
+# keyword config key -> default, see _yaml_replace
+_warm_pool_per_start_keywords = {
+    "drfid_keyword": "id",
+    "uniqueuserid_keyword": "unique_user_id",
+    "userid_keyword": "user_id",
+    "secretname_keyword": "secret_name",
+    "secretcertsname_keyword": "secret_certs_name",
+    "input_keyword": "input",
+    "input_configmap_keyword": "input_configmap",
+}
+_warm_pool_warnings = {}
+_warm_pool_warnings_lock = threading.Lock()
+
+
+def _get_warm_pool_config(config):
+    return config.get("services", {}).get("warm_pool", {})
+
+
+def _get_warm_pool_key(config, jhub_credential, service):
+    warm_pool_config = _get_warm_pool_config(config)
+    if not warm_pool_config.get("enabled", False):
+        return None
+    jhub_credential_to_use = (
+        config.get("services", {})
+        .get("credential_mapping", {})
+        .get(jhub_credential, jhub_credential)
+    )
+    pool_key = f"{jhub_credential_to_use}/{service.rstrip('/')}"
+    if pool_key not in warm_pool_config.get("pools", {}).keys():
+        return None
+    return pool_key
+
+
+def _get_warm_pool_name(pool_key):
+    deployment_name = os.environ.get("DEPLOYMENT_NAME", "k8smgr")
+    pool_hash = hashlib.sha256(pool_key.encode()).hexdigest()[0:10]
+    return f"warm-{pool_hash}-{deployment_name}"[0:63]
+
+
+def _get_pod_spec_hash(pod_spec):
+    return hashlib.sha256(
+        json.dumps(pod_spec, sort_keys=True, default=str).encode()
+    ).hexdigest()[0:16]
+
+
+def _render_warm_pool_deployment(config, pool_key):
+    warm_pool_config = _get_warm_pool_config(config)
+    services_skel_base = (
+        config.get("services", {})
+        .get("descriptions", "/tmp/services/descriptions")
+        .rstrip("/")
+    )
+    yaml_filename = warm_pool_config.get("yaml_filename", "warm_pool.yaml")
+    with open(f"{services_skel_base}/{pool_key}/{yaml_filename}", "r") as f:
+        yaml_s = f.read()
+    replace_indicators = (
+        config.get("services", {}).get("replace", {}).get("indicators", ["<", ">"])
+    )
+    namespace_keyword = (
+        config.get("services", {})
+        .get("replace", {})
+        .get("namespace_keyword", "namespace")
+    )
+    pool_name = _get_warm_pool_name(pool_key)
+    replacements = {namespace_keyword: _k8s_get_namespace(), "warm_pool": pool_name}
+    pattern = _yaml_replace_pattern(
+        replace_indicators[0], replace_indicators[1], tuple(replacements.keys())
+    )
+    yaml_s = pattern.sub(lambda m: replacements[m.group(1)], yaml_s)
+    deployment = yaml.safe_load(yaml_s)
+    deployment["metadata"]["name"] = pool_name
+    deployment["metadata"]["namespace"] = _k8s_get_namespace()
+    deployment["metadata"].setdefault("labels", {})
+    deployment["metadata"]["labels"][_warm_pool_owner_label] = os.environ.get(
+        "DEPLOYMENT_NAME", "k8smgr"
+    )
+    # Only the pool label selects the pods, so removing it releases a pod
+    deployment["spec"]["replicas"] = warm_pool_config["pools"][pool_key].get("size", 1)
+    deployment["spec"]["selector"] = {"matchLabels": {_warm_pool_label: pool_name}}
+    deployment["spec"]["template"]["metadata"].setdefault("labels", {})
+    deployment["spec"]["template"]["metadata"]["labels"][_warm_pool_label] = pool_name
+    spec_hash = _get_pod_spec_hash(deployment["spec"]["template"].get("spec"))
+    deployment["metadata"].setdefault("annotations", {})
+    deployment["metadata"]["annotations"][_warm_pool_spec_annotation] = spec_hash
+    deployment["spec"]["template"]["metadata"].setdefault("annotations", {})
+    deployment["spec"]["template"]["metadata"]["annotations"][
+        _warm_pool_spec_annotation
+    ] = spec_hash
+    try:
+        problem = _check_warm_pool_description(config, pool_key, spec_hash)
+    except (OSError, yaml.YAMLError) as e:
+        problem = f"Could not check the service description: {e}"
+    _warn_warm_pool(pool_key, problem)
+    return deployment
+
+
+def _check_warm_pool_description(config, pool_key, spec_hash):
+    """
+    Returns why the pods of this pool can't be claimed by a start of its
+    service description, or None if they can.
+    """
+    replace_config = config.get("services", {}).get("replace", {})
+    replace_indicators = replace_config.get("indicators", ["<", ">"])
+    services_skel_base = (
+        config.get("services", {})
+        .get("descriptions", "/tmp/services/descriptions")
+        .rstrip("/")
+    )
+    yaml_filename = config.get("services", {}).get("yaml_filename", "service.yaml")
+    with open(f"{services_skel_base}/{pool_key}/{yaml_filename}", "r") as f:
+        description_s = f.read()
+
+    # In the description, the name of the main deployment contains <id>
+    drf_id_keyword = replace_config.get("drfid_keyword", "id")
+    drf_id = f"{replace_indicators[0]}{drf_id_keyword}{replace_indicators[1]}"
+    deployment_main_name = _get_deployment_main_name(drf_id, config)
+    _, deployment_main_list = _select_deployment_main(
+        drf_id, config, yaml.safe_load_all(description_s)
+    )
+    if len(deployment_main_list) != 1:
+        return f"No deployment configured with name {deployment_main_name}"
+    pod_spec = deployment_main_list[0]["spec"]["template"].get("spec")
+
+    keywords = tuple(
+        replace_config.get(key, default)
+        for key, default in _warm_pool_per_start_keywords.items()
+    )
+    pattern = _yaml_replace_pattern(
+        replace_indicators[0], replace_indicators[1], keywords
+    )
+    used = sorted(set(pattern.findall(json.dumps(pod_spec))))
+    if used:
+        used_s = ", ".join(
+            f"{replace_indicators[0]}{x}{replace_indicators[1]}" for x in used
+        )
+        return f"Pod template of {deployment_main_name} uses {used_s}"
+
+    # The pod template uses only keywords, which are the same for each start
+    credential = pool_key.split("/")[0]
+    description_s = _yaml_replace("", config, description_s, credential, "", "", {})
+    _, deployment_main_list = _select_deployment_main(
+        "", config, yaml.safe_load_all(description_s)
+    )
+    pod_spec = deployment_main_list[0]["spec"]["template"].get("spec")
+    if _get_pod_spec_hash(pod_spec) != spec_hash:
+        return f"Pod template of {deployment_main_name} differs from the pool"
+    return None
+
+
+def _warn_warm_pool(pool_key, problem):
+    # Pools are rendered every refill_interval, log each problem once
+    with _warm_pool_warnings_lock:
+        if _warm_pool_warnings.get(pool_key) == problem:
+            return
+        _warm_pool_warnings[pool_key] = problem
+    if problem:
+        log.warning(
+            f"Warm pool {pool_key}: {problem}. Its pods will not be claimed.",
+            extra={"pool_key": pool_key},
+        )
+
+
+def _ensure_warm_pools(config, logs_extra):
+    """
+    Creates, updates or scales the pool Deployments of all configured pools
+    and removes the ones which are no longer configured.
+    """
+    warm_pool_config = _get_warm_pool_config(config)
+    api_client = _k8s_get_api_client()
+    k8s_app_api = client.AppsV1Api(api_client)
+    namespace = _k8s_get_namespace()
+    pool_names = set()
+    for pool_key in warm_pool_config.get("pools", {}).keys():
+        pool_name = _get_warm_pool_name(pool_key)
+        pool_names.add(pool_name)
+        try:
+            deployment = _render_warm_pool_deployment(config, pool_key)
+            try:
+                current = read_json(
+                    k8s_app_api.read_namespaced_deployment(
+                        name=pool_name, namespace=namespace, _preload_content=False
+                    )
+                )
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+                log.info(f"Create warm pool {pool_key} ({pool_name})", extra=logs_extra)
+                k8s_utils.create_from_dict(
+                    k8s_client=api_client, data=deployment, namespace=namespace
+                )
+                continue
+            current_hash = (current["metadata"].get("annotations") or {}).get(
+                _warm_pool_spec_annotation
+            )
+            if (
+                current_hash
+                != deployment["metadata"]["annotations"][_warm_pool_spec_annotation]
+            ):
+                # Changed warm_pool.yaml, roll out new standby pods
+                log.info(f"Update warm pool {pool_key} ({pool_name})", extra=logs_extra)
+                k8s_app_api.replace_namespaced_deployment(
+                    name=pool_name, namespace=namespace, body=deployment
+                )
+            elif current["spec"].get("replicas") != deployment["spec"]["replicas"]:
+                log.info(
+                    f"Scale warm pool {pool_key} ({pool_name}) to {deployment['spec']['replicas']}",
+                    extra=logs_extra,
+                )
+                k8s_app_api.patch_namespaced_deployment_scale(
+                    name=pool_name,
+                    namespace=namespace,
+                    body={"spec": {"replicas": deployment["spec"]["replicas"]}},
+                )
+        except:
+            log.exception(f"Could not refill warm pool {pool_key}", extra=logs_extra)
+
+    deployments = read_json(
+        k8s_app_api.list_namespaced_deployment(
+            namespace=namespace,
+            label_selector=f"{_warm_pool_owner_label}={os.environ.get('DEPLOYMENT_NAME', 'k8smgr')}",
+            _preload_content=False,
+        )
+    )
+    for deployment in deployments.get("items", []):
+        name = deployment["metadata"]["name"]
+        if name not in pool_names:
+            log.info(f"Delete unconfigured warm pool {name}", extra=logs_extra)
+            k8s_app_api.delete_namespaced_deployment(name=name, namespace=namespace)
+
+
+def _warm_pod_ready(pod):
+    if pod.get("metadata", {}).get("deletionTimestamp"):
+        return False
+    if pod.get("status", {}).get("phase") != "Running":
+        return False
+    return any(
+        x.get("type") == "Ready" and x.get("status") == "True"
+        for x in pod.get("status", {}).get("conditions", []) or []
+    )
+
+
+def _claim_warm_pod(
+    pool_key, drf_id, deployment_main, annotations, logs_extra, owner_references=None
+):
+    """
+    Returns the name of the claimed pod, or None if no standby pod is ready.
+    Only pods with the pod spec of deployment_main are claimed.
+    """
+    k8s_client = _k8s_get_client_core()
+    namespace = _k8s_get_namespace()
+    pool_name = _get_warm_pool_name(pool_key)
+    pods = read_json(
+        k8s_client.list_namespaced_pod(
+            namespace=namespace,
+            label_selector=f"{_warm_pool_label}={pool_name}",
+            _preload_content=False,
+        )
+    )
+    labels = {_warm_pool_label: None}
+    labels.update(deployment_main["spec"]["template"]["metadata"].get("labels", {}))
+    labels.update(deployment_main["spec"]["selector"].get("matchLabels", {}))
+    labels.update(_get_service_labels(drf_id))
+    spec_hash = _get_pod_spec_hash(deployment_main["spec"]["template"].get("spec"))
+    other_pod_spec = 0
+    for pod in pods.get("items", []):
+        if not _warm_pod_ready(pod):
+            continue
+        pod_annotations = pod["metadata"].get("annotations") or {}
+        if pod_annotations.get(_warm_pool_spec_annotation) != spec_hash:
+            # Different image, volumes, env, ... than the main Deployment
+            other_pod_spec += 1
+            continue
+        pod_name = pod["metadata"]["name"]
+        body = {
+            "metadata": {
+                # Fails with 409, if another worker claimed this pod in the meantime
+                "resourceVersion": pod["metadata"]["resourceVersion"],
+                "labels": labels,
+                "annotations": annotations,
+            }
+        }
+        if owner_references:
+            # The pool's ReplicaSet removes its own reference, once the
+            # pod no longer matches its selector
+            body["metadata"]["ownerReferences"] = owner_references
+        try:
+            k8s_client.patch_namespaced_pod(
+                name=pod_name, namespace=namespace, body=body
+            )
+        except ApiException as e:
+            if e.status in [404, 409]:
+                continue
+            raise
+        log.info(f"Claimed warm pod {pod_name} from {pool_key}", extra=logs_extra)
+        return pod_name
+    if other_pod_spec:
+        # Most likely the pod template uses keywords, which differ per start
+        log.warning(
+            f"{other_pod_spec} warm pods ready in {pool_key}, but none with pod spec {spec_hash}",
+            extra=logs_extra,
+        )
+    else:
+        log.debug(
+            f"No warm pod with pod spec {spec_hash} ready in {pool_key}",
+            extra=logs_extra,
+        )
+    return None
+
+
+def _create_service_resource(
+    service_yaml_file, config, logs_extra, labels=None, owner_references=None
+):
+    with open(service_yaml_file, "r") as f:
+        service_objects = list(yaml.safe_load_all(f))
+    _create_service_resources(
+        [],
+        service_objects,
+        config,
+        logs_extra,
+        labels=labels,
+        owner_references=owner_references,
+    )
+
+
+# Kinds which use other resources of the service (secrets, ConfigMaps, ...).
+# They are created after all other resources exist.
+_k8s_dependent_kinds = ["Deployment", "StatefulSet", "DaemonSet", "Job", "Pod"]
+
+
+def _create_k8s_object(description, create, logs_extra):
+    start = time.monotonic()
+    log.debug(f"Create {description} ...", extra=logs_extra)
+    create()
+    log.debug(
+        f"Create {description} ... done ({time.monotonic() - start:.3f}s)",
+        extra=logs_extra,
+    )
+
+
+def _create_service_resources(
+    creations,
+    service_objects,
+    config,
+    logs_extra,
+    claim_deployment_main=None,
+    labels=None,
+    owner_references=None,
+):
+    """
+    Creates all objects of the service description. Independent objects
+    (and the additional creations, list of (description, callable)) are
+    created concurrently, the dependent kinds afterwards.
+    claim_deployment_main: optional (name, callable). If the callable returns
+    a warm pod, the Deployment with this name is not created.
+    labels are added to all objects (see _get_service_labels).
+    owner_references are added to all objects (see _create_anchor).
+    """
     log.debug("Create service resource ...", extra=logs_extra)
     namespace = _k8s_get_namespace()
-    k8s_utils.create_from_yaml(
-        k8s_client=_k8s_get_api_client(),
-        yaml_file=service_yaml_file,
-        namespace=namespace,
+    api_client = _k8s_get_api_client()
+    independent = list(creations)
+    dependent = []
+    for service_object in service_objects:
+        if not service_object:
+            continue
+        kind = service_object.get("kind", "")
+        name = service_object.get("metadata", {}).get("name", "")
+        if labels:
+            service_object = _with_service_labels(service_object, labels)
+        if owner_references:
+            service_object = dict(service_object)
+            service_object["metadata"] = dict(
+                service_object.get("metadata", None) or {},
+                ownerReferences=owner_references,
+            )
+        create = functools.partial(
+            k8s_utils.create_from_dict,
+            k8s_client=api_client,
+            data=service_object,
+            namespace=namespace,
+        )
+        if kind in _k8s_dependent_kinds:
+            dependent.append((f"{kind} {name}", create))
+        else:
+            independent.append((f"{kind} {name}", create))
+
+    executor = get_executor(
+        "create", config.get("services", {}).get("create_max_workers", 10)
     )
+    for group in [independent, dependent]:
+        futures = [
+            executor.submit(
+                timing.run_in_context(_create_k8s_object),
+                description,
+                create,
+                logs_extra,
+            )
+            for description, create in group
+        ]
+        # Wait for all of them, before reporting the first error
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        if group is independent and claim_deployment_main:
+            deployment_main_name, claim = claim_deployment_main
+            with timing.span("claim_warm_pod"):
+                warm_pod = claim()
+            if warm_pod:
+                dependent[:] = [
+                    x for x in dependent if x[0] != f"Deployment {deployment_main_name}"
+                ]
     log.debug("Create service resource ... done", extra=logs_extra)
 
 
+def _get_service_label_selector(drf_id_label_value):
+    owner = os.environ.get("DEPLOYMENT_NAME", "k8smgr")[0:63]
+    return f"{_owner_label}={owner},{_drf_id_label}={drf_id_label_value}"
+
+
+def _list_service_objects(label_selector):
+    """
+    Returns the raw objects (dicts) of all kinds deleted by
+    _delete_objects_by_label_selector, as a list of (kind, object).
+    """
+    namespace = _k8s_get_namespace()
+    k8s_client = _k8s_get_client_core()
+    k8s_api_client = _k8s_get_api_client()
+    k8s_app_api = client.AppsV1Api(k8s_api_client)
+    k8s_batch_api = client.BatchV1Api(k8s_api_client)
+    list_funcs = {
+        "Deployment": k8s_app_api.list_namespaced_deployment,
+        "StatefulSet": k8s_app_api.list_namespaced_stateful_set,
+        "DaemonSet": k8s_app_api.list_namespaced_daemon_set,
+        "Job": k8s_batch_api.list_namespaced_job,
+        "Pod": k8s_client.list_namespaced_pod,
+        "ConfigMap": k8s_client.list_namespaced_config_map,
+        "Secret": k8s_client.list_namespaced_secret,
+        "Service": k8s_client.list_namespaced_service,
+    }
+    ret = []
+    for kind, list_func in list_funcs.items():
+        objects = read_json(
+            list_func(
+                namespace=namespace,
+                label_selector=label_selector,
+                _preload_content=False,
+            )
+        )
+        ret.extend([(kind, x) for x in objects.get("items", [])])
+    return ret
+
+
+def _delete_service_objects_by_label(drf_id, config, logs_extra):
+    return _delete_objects_by_label_selector(
+        _get_service_label_selector(_get_drf_id_label_value(drf_id)),
+        config,
+        logs_extra,
+    )
+
+
+def _delete_objects_by_label_selector(label_selector, config, logs_extra):
+    """
+    Deletes all objects matching label_selector, one call per kind,
+    running concurrently. Returns the kinds which could not be deleted.
+    """
+    namespace = _k8s_get_namespace()
+    k8s_client = _k8s_get_client_core()
+    k8s_api_client = _k8s_get_api_client()
+    k8s_app_api = client.AppsV1Api(k8s_api_client)
+    k8s_batch_api = client.BatchV1Api(k8s_api_client)
+
+    def delete_services():
+        # There's no delete_collection for Services
+        services = read_json(
+            k8s_client.list_namespaced_service(
+                namespace=namespace,
+                label_selector=label_selector,
+                _preload_content=False,
+            )
+        )
+        for service in services.get("items", []):
+            try:
+                k8s_client.delete_namespaced_service(
+                    name=service["metadata"]["name"], namespace=namespace
+                )
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+
+    kwargs = {
+        "namespace": namespace,
+        "label_selector": label_selector,
+        "_preload_content": False,
+    }
+    workload_kwargs = dict(kwargs, propagation_policy="Background")
+    deletions = {
+        "Deployment": functools.partial(
+            k8s_app_api.delete_collection_namespaced_deployment, **workload_kwargs
+        ),
+        "StatefulSet": functools.partial(
+            k8s_app_api.delete_collection_namespaced_stateful_set, **workload_kwargs
+        ),
+        "DaemonSet": functools.partial(
+            k8s_app_api.delete_collection_namespaced_daemon_set, **workload_kwargs
+        ),
+        "Job": functools.partial(
+            k8s_batch_api.delete_collection_namespaced_job, **workload_kwargs
+        ),
+        "Pod": functools.partial(k8s_client.delete_collection_namespaced_pod, **kwargs),
+        "ConfigMap": functools.partial(
+            k8s_client.delete_collection_namespaced_config_map, **kwargs
+        ),
+        "Secret": functools.partial(
+            k8s_client.delete_collection_namespaced_secret, **kwargs
+        ),
+        "Service": delete_services,
+    }
+    log.debug(f"Delete resources with labels {label_selector}", extra=logs_extra)
+    executor = get_executor(
+        "delete", config.get("services", {}).get("delete_max_workers", 8)
+    )
+    futures = {
+        kind: executor.submit(timing.run_in_context(delete))
+        for kind, delete in deletions.items()
+    }
+    failed = []
+    for kind, future in futures.items():
+        try:
+            future.result()
+        except:
+            failed.append(kind)
+            log.critical(
+                f"Could not delete {kind} resources", exc_info=True, extra=logs_extra
+            )
+    return failed
+
+
 def _delete_service_yaml(drf_id, config, logs_extra):
+    """
+    Raises an exception, if some objects could not be deleted. The ones
+    which were deleted stay deleted, so it can be called again.
+    """
+    k8s_client = _k8s_get_client_core()
+    failed = []
+    # None: unknown, e.g. the secret is already gone
+    labelled = None
+    anchored = False
+    input_hash = None
+    try:
+        secret = k8s_client.read_namespaced_secret(
+            name=_k8s_get_secret_name(drf_id), namespace=_k8s_get_namespace()
+        )
+        labels = secret.metadata.labels or {}
+        labelled = _drf_id_label in labels.keys()
+        anchored = any(
+            x.name == _k8s_get_anchor_name(drf_id)
+            for x in getattr(secret.metadata, "owner_references", None) or []
+        )
+        if _get_shared_input_enabled(config):
+            input_hash = labels.get(_shared_input_label, None)
+    except:
+        log.debug(
+            "Could not read labels of secret resource",
+            exc_info=True,
+            extra=logs_extra,
+        )
+    if anchored:
+        try:
+            with timing.span("delete_anchor"):
+                anchored = _delete_anchor(drf_id, config, logs_extra)
+        except:
+            log.warning(
+                "Could not delete anchor, delete by label",
+                exc_info=True,
+                extra=logs_extra,
+            )
+            anchored = False
+    if anchored:
+        if input_hash:
+            # The garbage collector deletes the secret asynchronously,
+            # but the reference count of the shared input must be up to date
+            with timing.span("delete_secret"):
+                try:
+                    k8s_client.delete_namespaced_secret(
+                        name=_k8s_get_secret_name(drf_id),
+                        namespace=_k8s_get_namespace(),
+                    )
+                except ApiException as e:
+                    if e.status != 404:
+                        raise
+    elif labelled is not False:
+        with timing.span("delete_resources"):
+            failed.extend(_delete_service_objects_by_label(drf_id, config, logs_extra))
+    if not labelled:
+        # Created by an older version, without labels
+        failed.extend(_delete_service_yaml_objects(drf_id, config, logs_extra))
+    if input_hash:
+        with timing.span("delete_shared_input"):
+            _delete_shared_input_configmap_if_unused(input_hash, logs_extra)
+    if failed:
+        raise Exception(f"Could not delete {', '.join(failed)}")
+
+
+def _delete_service_yaml_objects(drf_id, config, logs_extra):
+    """
+    Deletes the objects listed in service.yaml and update.yaml and the secrets.
+    Used for services created without the drf_id label.
+    Returns the objects which could not be deleted.
+    """
+    failed = []
     service_yaml_file = _get_yaml_file_name(drf_id, config)
     filename = config.get("services", {}).get("yaml_filename_update", "update.yaml")
     update_yaml_file = _get_yaml_file_name(drf_id, config, filename=filename)
@@ -912,57 +2578,110 @@ def _delete_service_yaml(drf_id, config, logs_extra):
         "Secret": k8s_client.delete_namespaced_secret,
     }
 
-    for file in [service_yaml_file, update_yaml_file]:
-        if os.path.isfile(file):
-            with lockfile.LockFile(file):
-                with open(file) as f:
-                    all_services = yaml.safe_load_all(f)
-                    for service in all_services:
-                        try:
-                            kind = service["kind"]
-                            name = service["metadata"]["name"]
-                            namespace = service["metadata"]["namespace"]
-                            log.debug(
-                                f"Delete {kind} {name} in {namespace}", extra=logs_extra
-                            )
-                            k8s_client_funcs[kind](name=name, namespace=namespace)
-                        except Exception as e:
-                            log.critical(
-                                "Could not delete resource",
-                                exc_info=True,
-                                extra=logs_extra,
-                            )
+    with timing.span("delete_resources_yaml"):
+        for file in [service_yaml_file, update_yaml_file]:
+            if os.path.isfile(file):
+                with lockfile.LockFile(file):
+                    with open(file) as f:
+                        all_services = yaml.safe_load_all(f)
+                        for service in all_services:
+                            try:
+                                kind = service["kind"]
+                                name = service["metadata"]["name"]
+                                namespace = service["metadata"]["namespace"]
+                                log.debug(
+                                    f"Delete {kind} {name} in {namespace}",
+                                    extra=logs_extra,
+                                )
+                                k8s_client_funcs[kind](name=name, namespace=namespace)
+                            except ApiException as e:
+                                if e.status == 404:
+                                    log.debug(
+                                        f"{kind} {name} does not exist",
+                                        extra=logs_extra,
+                                    )
+                                else:
+                                    failed.append(f"{kind} {name}")
+                                    log.critical(
+                                        "Could not delete resource",
+                                        exc_info=True,
+                                        extra=logs_extra,
+                                    )
+                            except KeyError:
+                                # Kinds without delete function, can't be retried
+                                log.warning(
+                                    "Could not delete resource",
+                                    exc_info=True,
+                                    extra=logs_extra,
+                                )
+                            except Exception as e:
+                                failed.append(f"{kind} {name}")
+                                log.critical(
+                                    "Could not delete resource",
+                                    exc_info=True,
+                                    extra=logs_extra,
+                                )
 
     secret_name = _k8s_get_secret_name(drf_id)
     secret_namespace = _k8s_get_namespace()
-    try:
-        log.debug(f"Delete secret resource ({secret_name})...", extra=logs_extra)
-        k8s_client.delete_namespaced_secret(
-            name=secret_name, namespace=secret_namespace
-        )
-        log.debug(f"Delete secret resource ({secret_name})... done", extra=logs_extra)
-    except:
-        log.critical(
-            "Could not delete secret resource", exc_info=True, extra=logs_extra
-        )
-
-    if config.get("services", {}).get("ssl", {}).get("enabled", False):
-        secret_certs_name = _k8s_get_secret_certs_name(drf_id)
+    with timing.span("delete_secret"):
         try:
+            log.debug(f"Delete secret resource ({secret_name})...", extra=logs_extra)
+            k8s_client.delete_namespaced_secret(
+                name=secret_name, namespace=secret_namespace
+            )
             log.debug(
-                f"Delete secret certs resource ({secret_certs_name})...",
-                extra=logs_extra,
+                f"Delete secret resource ({secret_name})... done", extra=logs_extra
             )
-            k8s_client.delete_namespaced_secret(
-                name=secret_certs_name, namespace=secret_namespace
+        except ApiException as e:
+            if e.status == 404:
+                log.debug(
+                    f"Secret resource ({secret_name}) does not exist",
+                    extra=logs_extra,
+                )
+            else:
+                failed.append(f"Secret {secret_name}")
+                log.critical(
+                    "Could not delete secret resource", exc_info=True, extra=logs_extra
+                )
+        except:
+            failed.append(f"Secret {secret_name}")
+            log.critical(
+                "Could not delete secret resource", exc_info=True, extra=logs_extra
             )
+    # Independent of services.ssl.enabled, the certs secret exists if the
+    # start request contained certs
+    secret_certs_name = _k8s_get_secret_certs_name(drf_id)
+    try:
+        log.debug(
+            f"Delete secret certs resource ({secret_certs_name})...",
+            extra=logs_extra,
+        )
+        k8s_client.delete_namespaced_secret(
+            name=secret_certs_name, namespace=secret_namespace
+        )
+        log.debug(
+            f"Delete secret certs resource ({secret_certs_name})... done",
+            extra=logs_extra,
+        )
+    except ApiException as e:
+        if e.status == 404:
             log.debug(
-                f"Delete secret certs resource ({secret_name})... done",
+                f"Secret certs resource ({secret_certs_name}) does not exist",
                 extra=logs_extra,
             )
-        except:
+        else:
+            failed.append(f"Secret {secret_certs_name}")
             log.warning(
                 "Could not delete secret certs resource",
                 exc_info=True,
                 extra=logs_extra,
             )
+    except:
+        failed.append(f"Secret {secret_certs_name}")
+        log.warning(
+            "Could not delete secret certs resource",
+            exc_info=True,
+            extra=logs_extra,
+        )
+    return failed
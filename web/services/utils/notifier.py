@@ -0,0 +1,299 @@
+"""
+Push failed services to JupyterHub, instead of waiting for the next poll.
+One worker process (the one holding the lock file) watches all pods in
+the namespace. If a pod changes in a way status_service classifies as
+failed, the status is sent to the JUPYTERHUB_STATUS_URL of this service,
+with the JUPYTERHUB_API_TOKEN stored in the service's secret.
+The watch thread only runs the cheap pre-check, status_service runs on the
+"notifier" thread pool, so the watch keeps up with the events.
+"""
+import base64
+import fcntl
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from django.db import close_old_connections
+from jupyterjsc_k8smgr.settings import LOGGER_NAME
+from services.utils import _config
+from services.utils import k8s
+from services.utils.executor import get_executor
+from services.utils.informer import PodInformer
+
+log = logging.getLogger(LOGGER_NAME)
+assert log.__class__.__name__ == "ExtraLoggerClass"
+
+_status_notifier = {"pid": None, "notifier": None}
+_status_notifier_lock = threading.Lock()
+
+
+def _get_notifier_config(config):
+    return config.get("services", {}).get("status_notifier", {})
+
+
+def _maybe_failed(pod, config):
+    """
+    Cheap pre-check on the pod itself, before we ask status_service.
+    Pods in a normal start or running state are skipped.
+    """
+    if pod.get("status", {}).get("phase", "") not in ["Pending", "Running"]:
+        return True
+    container_main_name = config.get("services", {}).get("container_main_name", "main")
+    for container in pod.get("status", {}).get("container_statuses", []) or []:
+        if container.get("name", "") != container_main_name:
+            continue
+        state = container.get("state", {}) or {}
+        if state.get("terminated"):
+            return True
+        waiting_reason = (state.get("waiting") or {}).get("reason", "")
+        if state.get("waiting") and waiting_reason not in [
+            "ContainerCreating",
+            "PodInitializing",
+        ]:
+            return True
+    return False
+
+
+class StatusNotifier:
+    def __init__(self, config):
+        self.config = config
+        self.notifier_config = _get_notifier_config(config)
+        self.queue = queue.Queue()
+        self.retries = []
+        self.session = requests.Session()
+        self.logs_extra = {"uuidcode": "StatusNotifier"}
+        # name label -> drf_id, refreshed from the database for unknown labels
+        self.drf_ids = {}
+        self.drf_ids_updated = 0
+        # drf_id -> pod uid which was already reported as failed.
+        # Bounded, in case the DELETED event of a pod was missed.
+        self.notified = OrderedDict()
+        self.notified_max = self.notifier_config.get("notified_max", 10000)
+        self.lock = threading.Lock()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="status-notifier", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        lock_file = self.notifier_config.get(
+            "lock_file", "/tmp/k8smgr_status_notifier.lock"
+        )
+        with open(lock_file, "w") as f:
+            # Only one worker sends notifications. The others wait here
+            # and take over, if the current one dies.
+            fcntl.flock(f, fcntl.LOCK_EX)
+            log.info("StatusNotifier - started", extra=self.logs_extra)
+            informer = PodInformer(
+                k8s._k8s_get_client_core,
+                k8s._k8s_get_namespace(),
+                watch_timeout=self.notifier_config.get("watch_timeout", 300),
+                listener=self.on_pod_event,
+            )
+            informer.start()
+            while True:
+                try:
+                    self.send_pending()
+                except:
+                    log.exception("StatusNotifier - send failed", extra=self.logs_extra)
+
+    def _refresh_drf_ids(self):
+        """
+        Only service.yaml of services which are new since the last refresh
+        is read, services which are gone are removed.
+        """
+        from services.models import ServicesModel
+
+        try:
+            known = {
+                f"{servername}-{start_id}"
+                for servername, start_id in ServicesModel.objects.filter(
+                    stop_pending=False
+                ).values_list("servername", "start_id")
+            }
+        finally:
+            close_old_connections()
+        with self.lock:
+            drf_ids = {
+                name_label: drf_id
+                for name_label, drf_id in self.drf_ids.items()
+                if drf_id in known
+            }
+            for drf_id in list(self.notified.keys()):
+                if drf_id not in known:
+                    del self.notified[drf_id]
+        for drf_id in known - set(drf_ids.values()):
+            try:
+                deployment_main = k8s._get_deployment_main(
+                    drf_id, self.config, 20, self.logs_extra
+                )
+                selector = deployment_main["spec"]["selector"]
+                drf_ids[selector["matchLabels"]["name"]] = drf_id
+            except Exception:
+                # e.g. service.yaml not written yet, tried again with the
+                # next refresh
+                log.debug(
+                    f"StatusNotifier - no main deployment for {drf_id}",
+                    extra=self.logs_extra,
+                    exc_info=True,
+                )
+        with self.lock:
+            self.drf_ids = drf_ids
+            self.drf_ids_updated = time.monotonic()
+
+    def _get_drf_id(self, name_label):
+        with self.lock:
+            refresh = name_label not in self.drf_ids.keys() and (
+                time.monotonic() - self.drf_ids_updated
+                > self.notifier_config.get("refresh_interval", 10)
+            )
+            if refresh:
+                # Other events of this label don't refresh again meanwhile
+                self.drf_ids_updated = time.monotonic()
+        if refresh:
+            self._refresh_drf_ids()
+        with self.lock:
+            return self.drf_ids.get(name_label, None)
+
+    def on_pod_event(self, event_type, pod):
+        metadata = pod.get("metadata", {}) or {}
+        name_label = (metadata.get("labels", {}) or {}).get("name", None)
+        if not name_label:
+            return
+        if event_type == "DELETED":
+            with self.lock:
+                drf_id = self.drf_ids.pop(name_label, None)
+                self.notified.pop(drf_id, None)
+            return
+        if not _maybe_failed(pod, self.config):
+            return
+        executor = get_executor("notifier", self.notifier_config.get("max_workers", 4))
+        executor.submit(self._check_pod, name_label, pod)
+
+    def _check_pod(self, name_label, pod):
+        try:
+            self.check_pod(name_label, pod)
+        except:
+            log.exception("StatusNotifier - check failed", extra=self.logs_extra)
+
+    def check_pod(self, name_label, pod):
+        uid = pod.get("metadata", {}).get("uid")
+        drf_id = self._get_drf_id(name_label)
+        if not drf_id:
+            return
+        with self.lock:
+            if self.notified.get(drf_id, None) == uid:
+                return
+        logs_extra = {"uuidcode": "StatusNotifier", "drf_id": drf_id}
+        status = k8s._status_from_pod(
+            k8s._k8s_get_client_core(),
+            k8s._k8s_get_namespace(),
+            self.config,
+            pod,
+            time.monotonic() + k8s._get_status_timeout(self.config),
+            20,
+            logs_extra,
+        )
+        if status.get("running", True):
+            return
+        with self.lock:
+            if self.notified.get(drf_id, None) == uid:
+                # Reported by a concurrent check of the same pod
+                return
+            self.notified[drf_id] = uid
+            self.notified.move_to_end(drf_id)
+            while len(self.notified) > self.notified_max:
+                self.notified.popitem(last=False)
+        log.info("StatusNotifier - service failed", extra=logs_extra)
+        self.queue.put({"drf_id": drf_id, "status": status, "attempt": 0})
+
+    def _get_status_url_and_token(self, drf_id):
+        secret = (
+            k8s._k8s_get_client_core()
+            .read_namespaced_secret(
+                name=k8s._k8s_get_secret_name(drf_id),
+                namespace=k8s._k8s_get_namespace(),
+            )
+            .data
+        )
+        url = base64.b64decode(secret["JUPYTERHUB_STATUS_URL"]).decode()
+        token = base64.b64decode(secret["JUPYTERHUB_API_TOKEN"]).decode()
+        return url, token
+
+    def send(self, item):
+        # JupyterHub has one status URL per server, so each failed service
+        # is sent on its own. The secret is read once, not for each retry.
+        if "url" not in item.keys():
+            item["url"], item["token"] = self._get_status_url_and_token(item["drf_id"])
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"token {item['token']}",
+        }
+        r = self.session.post(
+            url=item["url"],
+            headers=headers,
+            json=item["status"],
+            timeout=self.notifier_config.get("timeout", 10),
+            verify=self.notifier_config.get("certificate_path", True),
+        )
+        r.raise_for_status()
+
+    def send_pending(self):
+        """
+        Sends the queued failed services and the retries which are due.
+        If there's nothing to send, waits for the next one (at most a second).
+        """
+        retry_backoff = self.notifier_config.get("retry_backoff", 2)
+        max_attempts = self.notifier_config.get("max_attempts", 5)
+        now = time.monotonic()
+        pending = [item for item in self.retries if item["not_before"] <= now]
+        self.retries = [item for item in self.retries if item["not_before"] > now]
+        try:
+            if not pending:
+                next_retry = min(
+                    [item["not_before"] for item in self.retries] + [now + 1]
+                )
+                pending.append(self.queue.get(timeout=max(next_retry - now, 0.01)))
+            while True:
+                pending.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        for item in pending:
+            logs_extra = {"uuidcode": "StatusNotifier", "drf_id": item["drf_id"]}
+            try:
+                self.send(item)
+                log.debug("StatusNotifier - sent", extra=logs_extra)
+            except:
+                item["attempt"] += 1
+                if item["attempt"] >= max_attempts:
+                    log.warning(
+                        "StatusNotifier - giving up", extra=logs_extra, exc_info=True
+                    )
+                    continue
+                log.debug(
+                    "StatusNotifier - send failed, retry later",
+                    extra=logs_extra,
+                    exc_info=True,
+                )
+                item["not_before"] = (
+                    time.monotonic() + retry_backoff * 2 ** item["attempt"]
+                )
+                self.retries.append(item)
+
+
+def start_status_notifier():
+    config = _config()
+    if not _get_notifier_config(config).get("enabled", False):
+        return None
+    with _status_notifier_lock:
+        if _status_notifier["pid"] != os.getpid():
+            _status_notifier["notifier"] = StatusNotifier(config)
+            _status_notifier["notifier"].start()
+            _status_notifier["pid"] = os.getpid()
+        return _status_notifier["notifier"]
@@ -0,0 +1,72 @@
+"""
+The kubernetes client deserializes each response into its models. For a pod
+this builds the whole spec, managed fields, etc. as Python objects, only to
+call to_dict() afterwards. The status checks need a few fields only.
+We request the raw JSON (_preload_content=False) and keep only these fields,
+with the same (snake_case) keys to_dict() would return.
+"""
+import json
+import re
+
+_camel_to_snake_re = re.compile(r"(?<!^)(?=[A-Z])")
+
+
+def _camel_to_snake(d):
+    if not isinstance(d, dict):
+        return d
+    return {_camel_to_snake_re.sub("_", key).lower(): value for key, value in d.items()}
+
+
+def read_json(response):
+    return json.loads(response.data)
+
+
+def project_pod(raw_pod):
+    metadata = raw_pod.get("metadata", {}) or {}
+    status = raw_pod.get("status", {}) or {}
+    container_statuses = []
+    for container_status in status.get("containerStatuses", []) or []:
+        state = container_status.get("state", {}) or {}
+        container_statuses.append(
+            {
+                "name": container_status.get("name", ""),
+                "restart_count": container_status.get("restartCount", 0),
+                "state": {
+                    "running": _camel_to_snake(state.get("running", None)),
+                    "terminated": _camel_to_snake(state.get("terminated", None)),
+                    "waiting": _camel_to_snake(state.get("waiting", None)),
+                },
+            }
+        )
+    return {
+        "metadata": {
+            "name": metadata.get("name", ""),
+            "uid": metadata.get("uid", None),
+            "labels": metadata.get("labels", {}) or {},
+            "resource_version": metadata.get("resourceVersion", None),
+        },
+        "status": {
+            "phase": status.get("phase", None),
+            "container_statuses": container_statuses,
+        },
+    }
+
+
+def project_pod_list(raw_pod_list):
+    return {
+        "metadata": {
+            "resource_version": (raw_pod_list.get("metadata", {}) or {}).get(
+                "resourceVersion", None
+            )
+        },
+        "items": [project_pod(x) for x in raw_pod_list.get("items", []) or []],
+    }
+
+
+def project_event_list(raw_event_list):
+    return {
+        "items": [
+            {key: x[key] for key in ["type", "reason", "message"] if key in x}
+            for x in raw_event_list.get("items", []) or []
+        ]
+    }
@@ -0,0 +1,327 @@
+"""
+Delete Kubernetes objects of services which no longer exist in the database,
+e.g. because stop_service failed and the ServicesModel was deleted anyway.
+One worker process (the one holding the lock file) lists all objects with
+this manager's labels every services.reconciler.interval seconds and groups
+them by their drf_id label. Groups without a ServicesModel and older than
+min_age are deleted (bounded by max_workers, max_deletions_per_run and
+deletions_per_second). UserJobs Services of this manager (owner label)
+without a UserJobsModel as well.
+Services whose stop is pending for longer than
+services.async_stop.stale_after are stopped again.
+With dry_run, orphans are only logged and counted.
+The metrics of the last run are written to metrics_file, so every worker
+can answer GET /api/services/_metrics/reconciler/.
+"""
+import datetime
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from django.db import close_old_connections
+from jupyterjsc_k8smgr.settings import LOGGER_NAME
+from services.utils import _config
+from services.utils import k8s
+from services.utils.executor import get_executor
+from services.utils.projection import read_json
+
+log = logging.getLogger(LOGGER_NAME)
+assert log.__class__.__name__ == "ExtraLoggerClass"
+
+_reconciler = {"pid": None, "thread": None}
+_reconciler_lock = threading.Lock()
+
+
+def _get_reconciler_config(config):
+    return config.get("services", {}).get("reconciler", {})
+
+
+def _creation_timestamp(obj):
+    creation_timestamp = obj.get("metadata", {}).get("creationTimestamp", None)
+    if not creation_timestamp:
+        return datetime.datetime.now(datetime.timezone.utc)
+    return datetime.datetime.strptime(creation_timestamp, "%Y-%m-%dT%H:%M:%SZ").replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def _get_known_drf_id_label_values():
+    from services.models import ServicesModel
+
+    try:
+        # Services which are stopping are still known, stop_service removes them
+        return {
+            k8s._get_drf_id_label_value(f"{servername}-{start_id}")
+            for servername, start_id in ServicesModel.objects.values_list(
+                "servername", "start_id"
+            )
+        }
+    finally:
+        close_old_connections()
+
+
+def _get_known_userjobs():
+    from services.models import UserJobsModel
+
+    try:
+        return set(UserJobsModel.objects.values_list("service", flat=True))
+    finally:
+        close_old_connections()
+
+
+def find_orphans(config, now=None):
+    """
+    Returns the orphaned services, as dict drf_id label value ->
+    {"kinds": {kind: count}, "input_hashes": [...]}, and a list of the
+    orphaned UserJobs Services.
+    """
+    reconciler_config = _get_reconciler_config(config)
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    min_age = datetime.timedelta(seconds=reconciler_config.get("min_age", 600))
+    owner = os.environ.get("DEPLOYMENT_NAME", "k8smgr")[0:63]
+
+    groups = {}
+    # List objects before reading the database, so services started in
+    # between are known
+    objects = k8s._list_service_objects(
+        f"{k8s._owner_label}={owner},{k8s._drf_id_label}"
+    )
+    known = _get_known_drf_id_label_values()
+    for kind, obj in objects:
+        labels = obj.get("metadata", {}).get("labels", {}) or {}
+        drf_id_label_value = labels.get(k8s._drf_id_label, "")
+        if drf_id_label_value in known:
+            continue
+        group = groups.setdefault(
+            drf_id_label_value, {"kinds": {}, "input_hashes": [], "newest": None}
+        )
+        group["kinds"][kind] = group["kinds"].get(kind, 0) + 1
+        if kind == "Secret" and labels.get(k8s._shared_input_label, None):
+            group["input_hashes"].append(labels[k8s._shared_input_label])
+        creation_timestamp = _creation_timestamp(obj)
+        if group["newest"] is None or creation_timestamp > group["newest"]:
+            group["newest"] = creation_timestamp
+    orphans = {
+        key: {"kinds": group["kinds"], "input_hashes": group["input_hashes"]}
+        for key, group in groups.items()
+        # Objects of a start in progress may exist before the ServicesModel
+        if now - group["newest"] >= min_age
+    }
+
+    userjobs_orphans = []
+    if reconciler_config.get("userjobs", True):
+        services = read_json(
+            k8s._k8s_get_client_core().list_namespaced_service(
+                namespace=k8s._k8s_get_namespace(),
+                label_selector=f"userjobs_servername,{k8s._owner_label}={owner}",
+                _preload_content=False,
+            )
+        )
+        known_userjobs = _get_known_userjobs()
+        userjobs_orphans = [
+            x["metadata"]["name"]
+            for x in services.get("items", [])
+            if x["metadata"]["name"] not in known_userjobs
+            and now - _creation_timestamp(x) >= min_age
+        ]
+    return orphans, userjobs_orphans
+
+
+def _delete_orphan(drf_id_label_value, orphan, config, logs_extra):
+    k8s._delete_objects_by_label_selector(
+        k8s._get_service_label_selector(drf_id_label_value), config, logs_extra
+    )
+    for input_hash in orphan["input_hashes"]:
+        k8s._delete_shared_input_configmap_if_unused(input_hash, logs_extra)
+
+
+def _restart_stale_stops(config, dry_run, logs_extra):
+    """
+    Queues the stop of services again, if the queued stop was lost.
+    Returns the number of these services. Without services.async_stop they
+    are only reported, the next DELETE stops them again.
+    """
+    from services.models import ServicesModel
+    from services.utils.common import async_stop_enabled
+    from services.utils.common import instance_dict_and_custom_headers_to_logs_extra
+    from services.utils.common import stop_pending_stale
+    from services.utils.common import stop_service_async
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    report_only = dry_run or not async_stop_enabled()
+    stale = 0
+    try:
+        for instance in ServicesModel.objects.filter(stop_pending=True):
+            instance_dict = {
+                key: value
+                for key, value in instance.__dict__.items()
+                if not key.startswith("_")
+            }
+            if not stop_pending_stale(instance_dict, now=now):
+                continue
+            stale += 1
+            instance_logs_extra = instance_dict_and_custom_headers_to_logs_extra(
+                instance_dict, {}
+            )
+            log.warning(
+                f"Reconciler - stale stop of {instance.servername}{' (not restarted)' if report_only else ''}",
+                extra=instance_logs_extra,
+            )
+            if report_only:
+                continue
+            # Skip it, if it was stopped again in the meantime
+            if not ServicesModel.objects.filter(
+                id=instance.id,
+                stop_pending=True,
+                stop_pending_date=instance.stop_pending_date,
+            ).update(stop_pending_date=now):
+                continue
+            instance_dict["stop_pending_date"] = now
+            stop_service_async(instance.id, instance_dict, {}, instance_logs_extra)
+    finally:
+        close_old_connections()
+    return stale
+
+
+def reconcile(config, logs_extra):
+    """
+    Returns the metrics of this run.
+    """
+    reconciler_config = _get_reconciler_config(config)
+    dry_run = reconciler_config.get("dry_run", False)
+    max_deletions = reconciler_config.get("max_deletions_per_run", 20)
+    deletions_per_second = reconciler_config.get("deletions_per_second", 1)
+    start = time.monotonic()
+
+    orphans, userjobs_orphans = find_orphans(config)
+    metrics = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "dry_run": dry_run,
+        "orphaned_services": len(orphans),
+        "orphaned_userjobs": len(userjobs_orphans),
+        "orphaned_objects": {},
+        "deleted_services": 0,
+        "deleted_userjobs": 0,
+        "errors": 0,
+    }
+    try:
+        metrics["stale_stops"] = _restart_stale_stops(config, dry_run, logs_extra)
+    except:
+        metrics["errors"] += 1
+        log.warning(
+            "Reconciler - could not restart stale stops",
+            exc_info=True,
+            extra=logs_extra,
+        )
+    for orphan in orphans.values():
+        for kind, count in orphan["kinds"].items():
+            metrics["orphaned_objects"][kind] = (
+                metrics["orphaned_objects"].get(kind, 0) + count
+            )
+
+    deletions = [
+        (
+            f"service {key}",
+            "deleted_services",
+            lambda key=key, orphan=orphan: _delete_orphan(
+                key, orphan, config, logs_extra
+            ),
+        )
+        for key, orphan in orphans.items()
+    ] + [
+        (
+            f"userjobs {name}",
+            "deleted_userjobs",
+            lambda name=name: k8s.k8s_delete_userjobs_svc(name, dict(logs_extra)),
+        )
+        for name in userjobs_orphans
+    ]
+    for description, _, _ in deletions:
+        log.info(
+            f"Reconciler - orphaned {description}{' (dry run)' if dry_run else ''}",
+            extra=logs_extra,
+        )
+    if not dry_run:
+        executor = get_executor("reconciler", reconciler_config.get("max_workers", 2))
+        futures = []
+        for description, metric, delete in deletions[0:max_deletions]:
+            futures.append((description, metric, executor.submit(delete)))
+            if deletions_per_second:
+                time.sleep(1 / deletions_per_second)
+        for description, metric, future in futures:
+            try:
+                future.result()
+                metrics[metric] += 1
+            except:
+                metrics["errors"] += 1
+                log.warning(
+                    f"Reconciler - could not delete {description}",
+                    exc_info=True,
+                    extra=logs_extra,
+                )
+    metrics["duration"] = round(time.monotonic() - start, 3)
+    return metrics
+
+
+def _write_metrics(config, metrics):
+    metrics_file = _get_reconciler_config(config).get(
+        "metrics_file", "/tmp/k8smgr_reconciler.json"
+    )
+    tmp_file = f"{metrics_file}.{os.getpid()}"
+    with open(tmp_file, "w") as f:
+        json.dump(metrics, f)
+    os.replace(tmp_file, metrics_file)
+
+
+def get_metrics(config):
+    reconciler_config = _get_reconciler_config(config)
+    if not reconciler_config.get("enabled", False):
+        return {"enabled": False}
+    try:
+        with open(
+            reconciler_config.get("metrics_file", "/tmp/k8smgr_reconciler.json")
+        ) as f:
+            metrics = json.load(f)
+    except FileNotFoundError:
+        metrics = {}
+    metrics["enabled"] = True
+    return metrics
+
+
+def _run():
+    logs_extra = {"uuidcode": "Reconciler"}
+    lock_file = _get_reconciler_config(_config()).get(
+        "lock_file", "/tmp/k8smgr_reconciler.lock"
+    )
+    with open(lock_file, "w") as f:
+        # Only one worker reconciles. The others wait here
+        # and take over, if the current one dies.
+        fcntl.flock(f, fcntl.LOCK_EX)
+        log.info("Reconciler - started", extra=logs_extra)
+        while True:
+            config = _config()
+            try:
+                metrics = reconcile(config, logs_extra)
+                _write_metrics(config, metrics)
+                metrics_logs_extra = dict(logs_extra)
+                metrics_logs_extra["metrics"] = metrics
+                log.info("Reconciler - run finished", extra=metrics_logs_extra)
+            except:
+                log.exception("Reconciler - run failed", extra=logs_extra)
+            time.sleep(_get_reconciler_config(config).get("interval", 300))
+
+
+def start_reconciler():
+    if not _get_reconciler_config(_config()).get("enabled", False):
+        return None
+    with _reconciler_lock:
+        if _reconciler["pid"] != os.getpid():
+            _reconciler["thread"] = threading.Thread(
+                target=_run, name="reconciler", daemon=True
+            )
+            _reconciler["thread"].start()
+            _reconciler["pid"] = os.getpid()
+        return _reconciler["thread"]
@@ -87,7 +87,7 @@ def forward(ports, hostname, target_node, logs_extra):
         os.environ.get("SSHCONFIGFILE", "/home/k8smgr/.ssh/config"),
     ]
     for key, value in ports.items():
-        if type(value) == set:
+        if type(value) == tuple:
             port = value[0]
             v = value[1]
         else:
@@ -0,0 +1,265 @@
+"""
+Client for the multiplexing protocol of the OpenSSH ControlMaster
+(userjobs.ssh_mux.enabled, see PROTOCOL.mux in the OpenSSH sources).
+Instead of one `ssh -O forward|cancel|check` process per port, each worker
+process keeps one connection to the control socket of tunnel_<hostname>.
+All forwards of a request are sent at once and the replies are read
+afterwards. The control path is taken from `ssh -G` once per host.
+The ControlMaster accepts clients with its own uid or root only.
+If the control socket can't be used, SSHMuxError is raised and the caller
+falls back to the ssh processes (services.utils.ssh).
+"""
+import logging
+import os
+import socket
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+
+from jupyterjsc_k8smgr.settings import LOGGER_NAME
+from services.utils.ssh import get_port
+from services.utils.ssh import set_uid
+
+log = logging.getLogger(LOGGER_NAME)
+assert log.__class__.__name__ == "ExtraLoggerClass"
+
+MUX_MSG_HELLO = 0x00000001
+MUX_C_ALIVE_CHECK = 0x10000004
+MUX_C_OPEN_FWD = 0x10000006
+MUX_C_CLOSE_FWD = 0x10000007
+MUX_S_OK = 0x80000001
+MUX_S_PERMISSION_DENIED = 0x80000002
+MUX_S_FAILURE = 0x80000003
+MUX_S_ALIVE = 0x80000005
+MUX_FWD_LOCAL = 1
+SSHMUX_VER = 4
+
+_connections = {"pid": None, "hosts": {}}
+_connections_lock = threading.Lock()
+
+_control_path_cache = OrderedDict()
+_control_path_cache_lock = threading.Lock()
+_control_path_cache_max = 100
+
+
+class SSHMuxError(Exception):
+    pass
+
+
+def get_ssh_mux_config(config):
+    return config.get("userjobs", {}).get("ssh_mux", {})
+
+
+def _get_control_path(hostname):
+    with _control_path_cache_lock:
+        if hostname in _control_path_cache.keys():
+            _control_path_cache.move_to_end(hostname)
+            return _control_path_cache[hostname]
+    cmd = [
+        "ssh",
+        "-F",
+        os.environ.get("SSHCONFIGFILE", "/home/k8smgr/.ssh/config"),
+        "-G",
+        f"tunnel_{hostname}",
+    ]
+    # Same user as ssh -O, the control path may depend on it
+    with subprocess.Popen(
+        cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, preexec_fn=set_uid
+    ) as p:
+        stdout, _ = p.communicate()
+    control_path = None
+    for line in stdout.decode(errors="replace").splitlines():
+        key, _, value = line.partition(" ")
+        if key.lower() == "controlpath":
+            control_path = os.path.expanduser(value.strip())
+    if p.returncode != 0 or not control_path or control_path == "none":
+        raise SSHMuxError(f"No control path for tunnel_{hostname}")
+    with _control_path_cache_lock:
+        _control_path_cache[hostname] = control_path
+        while len(_control_path_cache) > _control_path_cache_max:
+            _control_path_cache.popitem(last=False)
+    return control_path
+
+
+def _string(value):
+    value = str(value).encode()
+    return struct.pack(">I", len(value)) + value
+
+
+def _send(sock, payload):
+    sock.sendall(struct.pack(">I", len(payload)) + payload)
+
+
+def _recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise SSHMuxError("Control socket closed")
+        data += chunk
+    return data
+
+
+def _recv(sock):
+    (length,) = struct.unpack(">I", _recv_exact(sock, 4))
+    return _recv_exact(sock, length)
+
+
+def _read_string(payload, offset):
+    (length,) = struct.unpack_from(">I", payload, offset)
+    offset += 4
+    return payload[offset : offset + length].decode(errors="replace"), offset + length
+
+
+def _connect(hostname, timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(_get_control_path(hostname))
+        _send(sock, struct.pack(">II", MUX_MSG_HELLO, SSHMUX_VER))
+        msg_type, version = struct.unpack_from(">II", _recv(sock))
+        if msg_type != MUX_MSG_HELLO or version != SSHMUX_VER:
+            raise SSHMuxError(f"Unexpected hello {msg_type:#x} version {version}")
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+def _get_connection(hostname):
+    with _connections_lock:
+        if _connections["pid"] != os.getpid():
+            # Connections of the parent process are not ours
+            _connections["hosts"] = {}
+            _connections["pid"] = os.getpid()
+        if hostname not in _connections["hosts"].keys():
+            _connections["hosts"][hostname] = {
+                "sock": None,
+                "lock": threading.Lock(),
+                "request_id": 0,
+            }
+        return _connections["hosts"][hostname]
+
+
+def _close(connection):
+    if connection["sock"] is not None:
+        try:
+            connection["sock"].close()
+        except OSError:
+            pass
+    connection["sock"] = None
+
+
+def _request(hostname, requests, timeout):
+    """
+    requests: list of (message type, body). All requests are sent before the
+    first reply is read.
+    Returns a list of (reply type, reply payload after the request id).
+    """
+    connection = _get_connection(hostname)
+    with connection["lock"]:
+        for attempt in range(2):
+            try:
+                if connection["sock"] is None:
+                    connection["sock"] = _connect(hostname, timeout)
+                sock = connection["sock"]
+                request_ids = []
+                for msg_type, body in requests:
+                    connection["request_id"] = (
+                        connection["request_id"] + 1
+                    ) & 0xFFFFFFFF
+                    request_ids.append(connection["request_id"])
+                    _send(
+                        sock,
+                        struct.pack(">II", msg_type, connection["request_id"]) + body,
+                    )
+                replies = {}
+                while len(replies) < len(request_ids):
+                    payload = _recv(sock)
+                    reply_type, request_id = struct.unpack_from(">II", payload)
+                    replies[request_id] = (reply_type, payload[8:])
+                return [replies[x] for x in request_ids]
+            except (OSError, struct.error, SSHMuxError) as e:
+                # The master may have been restarted, reconnect once.
+                # Forwards which exist already are answered with MUX_S_OK.
+                _close(connection)
+                if attempt == 1:
+                    raise SSHMuxError(f"tunnel_{hostname}: {e}") from e
+
+
+def _forward_body(listen_port, target_node, port):
+    return (
+        struct.pack(">I", MUX_FWD_LOCAL)
+        + _string("0.0.0.0")
+        + struct.pack(">I", int(listen_port))
+        + _string(target_node)
+        + struct.pack(">I", int(port))
+    )
+
+
+def _failed(hostname, msg_type, replies, used_ports, logs_extra):
+    failed = {}
+    for key, (reply_type, payload) in zip(used_ports.keys(), replies):
+        if reply_type == MUX_S_OK:
+            continue
+        reason = f"Unexpected reply {reply_type:#x}"
+        if reply_type in [MUX_S_FAILURE, MUX_S_PERMISSION_DENIED]:
+            reason, _ = _read_string(payload, 0)
+        failed[key] = reason
+    if failed:
+        failed_logs_extra = dict(logs_extra)
+        failed_logs_extra["failed"] = failed
+        log.warning(f"tunnel_{hostname} - {msg_type} failed", extra=failed_logs_extra)
+    return failed
+
+
+def check_connection(hostname, timeout, logs_extra):
+    """
+    Returns the pid of the ControlMaster.
+    """
+    ((reply_type, payload),) = _request(hostname, [(MUX_C_ALIVE_CHECK, b"")], timeout)
+    if reply_type != MUX_S_ALIVE:
+        raise SSHMuxError(f"Unexpected reply {reply_type:#x} to alive check")
+    (pid,) = struct.unpack_from(">I", payload)
+    log.debug(f"UserJobs - tunnel_{hostname} alive (pid {pid})", extra=logs_extra)
+    return pid
+
+
+def forward(ports, hostname, target_node, timeout, logs_extra):
+    """
+    Same arguments and return value as services.utils.ssh.forward: values
+    of ports may be (local port, port) tuples to use the given local port.
+    Returns the used ports and 255 if one of the forwards failed, 0 otherwise.
+    """
+    log.debug("Forward ports (mux)", extra=logs_extra)
+    used_ports = {
+        key: value if type(value) == tuple else (get_port(), value)
+        for key, value in ports.items()
+    }
+    replies = _request(
+        hostname,
+        [
+            (MUX_C_OPEN_FWD, _forward_body(port, target_node, value))
+            for port, value in used_ports.values()
+        ],
+        timeout,
+    )
+    if _failed(hostname, "forward", replies, used_ports, logs_extra):
+        return used_ports, 255
+    log.debug("Forward ports (mux) done", extra=logs_extra)
+    return used_ports, 0
+
+
+def cancel(used_ports, hostname, target_node, timeout, logs_extra):
+    log.debug("Cancel ports (mux)", extra=logs_extra)
+    replies = _request(
+        hostname,
+        [
+            (MUX_C_CLOSE_FWD, _forward_body(value[0], target_node, value[1]))
+            for value in used_ports.values()
+        ],
+        timeout,
+    )
+    _failed(hostname, "cancel", replies, used_ports, logs_extra)
+    log.debug("Cancel ports (mux) done", extra=logs_extra)
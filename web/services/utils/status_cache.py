@@ -0,0 +1,86 @@
+"""
+Status results shared by all gunicorn workers (and all hub replicas talking
+to them). Entries are stored in the Django cache configured as "status"
+in settings.CACHES. An entry is only valid for the pod resourceVersion it
+was computed for and expires after services.status_cache.ttl seconds.
+Events of the pod are not part of the resourceVersion, so a new event
+(e.g. a Warning while pulling the image) is shown after at most ttl seconds.
+Hits and misses are counted in the same cache, so get_counters() reports
+them for all workers sharing it. Depending on the backend, incr() is not
+atomic (e.g. file based cache), so concurrent lookups may be undercounted.
+"""
+import logging
+
+from django.core.cache import caches
+from jupyterjsc_k8smgr.settings import LOGGER_NAME
+
+log = logging.getLogger(LOGGER_NAME)
+assert log.__class__.__name__ == "ExtraLoggerClass"
+
+_counter_keys = {"hits": "status-counter-hits", "misses": "status-counter-misses"}
+
+
+def _get_status_cache_config(config):
+    return config.get("services", {}).get("status_cache", {})
+
+
+def _get_status_cache(config):
+    status_cache_config = _get_status_cache_config(config)
+    if not status_cache_config.get("enabled", False):
+        return None
+    return caches[status_cache_config.get("alias", "status")]
+
+
+def _incr(cache, key):
+    cache_key = _counter_keys[key]
+    # Counters don't expire. add() does nothing, if the key exists already.
+    cache.add(cache_key, 0, timeout=None)
+    try:
+        cache.incr(cache_key)
+    except ValueError:
+        # Culled between add() and incr()
+        cache.add(cache_key, 1, timeout=None)
+
+
+def get_status(drf_id, resource_version, config):
+    """
+    Returns the cached status for drf_id, or None if there is no valid entry.
+    """
+    cache = _get_status_cache(config)
+    if cache is None or not resource_version:
+        return None
+    entry = cache.get(f"status-{drf_id}")
+    if entry and entry.get("resource_version") == resource_version:
+        _incr(cache, "hits")
+        return entry["status"]
+    _incr(cache, "misses")
+    return None
+
+
+def set_status(drf_id, resource_version, status, config):
+    cache = _get_status_cache(config)
+    if cache is None or not resource_version:
+        return
+    cache.set(
+        f"status-{drf_id}",
+        {"resource_version": resource_version, "status": status},
+        timeout=_get_status_cache_config(config).get("ttl", 10),
+    )
+
+
+def remove_status(drf_id, config):
+    cache = _get_status_cache(config)
+    if cache is None:
+        return
+    cache.delete(f"status-{drf_id}")
+
+
+def get_counters(config):
+    cache = _get_status_cache(config)
+    if cache is None:
+        return {"enabled": False}
+    counters = cache.get_many(_counter_keys.values())
+    ret = {"enabled": True}
+    for key, cache_key in _counter_keys.items():
+        ret[key] = counters.get(cache_key, 0)
+    return ret
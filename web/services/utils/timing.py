@@ -0,0 +1,203 @@
+"""
+Wall time of the phases of a pipeline (start, stop, ...).
+
+    with timing.collect("start") as timings:
+        with timing.span("create_user_home"):
+            ...
+
+Spans within collect() are summed up in the timings dict (phase -> seconds),
+which can be added to the final log record. Each span is also counted in a
+per process histogram "<pipeline>.<phase>" (see get_histograms()).
+Spans outside of collect() are counted as pipeline "other".
+Use run_in_context() for functions running in another thread.
+With services.timings.shared (default), each process stores its histograms
+in the Django cache services.timings.alias at the end of every collect(),
+and get_merged_histograms() sums up the ones of all processes.
+"""
+import bisect
+import contextlib
+import contextvars
+import copy
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.core.cache import caches
+from jupyterjsc_k8smgr.settings import LOGGER_NAME
+from services.utils import _config
+
+log = logging.getLogger(LOGGER_NAME)
+assert log.__class__.__name__ == "ExtraLoggerClass"
+
+_current = contextvars.ContextVar("k8smgr_timings", default=None)
+
+_histogram_buckets = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+_histograms = {}
+_histograms_pid = None
+_histograms_lock = threading.Lock()
+_processes_key = "timings-processes"
+
+
+def _observe(name, duration):
+    global _histograms, _histograms_pid
+    with _histograms_lock:
+        if _histograms_pid != os.getpid():
+            # Histograms of the parent process are not ours
+            _histograms = {}
+            _histograms_pid = os.getpid()
+        if name not in _histograms.keys():
+            _histograms[name] = {
+                "count": 0,
+                "sum": 0.0,
+                "buckets": [0] * (len(_histogram_buckets) + 1),
+            }
+        histogram = _histograms[name]
+        histogram["count"] += 1
+        histogram["sum"] += duration
+        histogram["buckets"][bisect.bisect_left(_histogram_buckets, duration)] += 1
+
+
+def _record(name, duration):
+    current = _current.get()
+    pipeline = "other"
+    if current is not None:
+        pipeline = current["pipeline"]
+        with current["lock"]:
+            current["timings"][name] = current["timings"].get(name, 0.0) + duration
+    _observe(f"{pipeline}.{name}", duration)
+
+
+@contextlib.contextmanager
+def span(name):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        _record(name, time.monotonic() - start)
+
+
+@contextlib.contextmanager
+def collect(pipeline):
+    """
+    Yields the timings dict of this pipeline. It contains "total" at the end.
+    """
+    current = {"pipeline": pipeline, "timings": {}, "lock": threading.Lock()}
+    token = _current.set(current)
+    try:
+        with span("total"):
+            yield current["timings"]
+    finally:
+        _current.reset(token)
+        publish_histograms(_config())
+
+
+def run_in_context(func):
+    """
+    Binds func to the current pipeline, e.g. for executor.submit().
+    Call it for each submit, a context can't be entered by two threads.
+    """
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(func, *args, **kwargs)
+
+
+def rounded(timings):
+    return {key: round(value, 3) for key, value in timings.items()}
+
+
+def _cumulative(histograms):
+    """
+    Cumulative buckets (upper bound in seconds -> count), like Prometheus.
+    """
+    ret = {}
+    for name, histogram in sorted(histograms.items()):
+        buckets = {}
+        cumulative = 0
+        for le, count in zip(_histogram_buckets + ["+Inf"], histogram["buckets"]):
+            cumulative += count
+            buckets[str(le)] = cumulative
+        ret[name] = {
+            "count": histogram["count"],
+            "sum": round(histogram["sum"], 3),
+            "buckets": buckets,
+        }
+    return ret
+
+
+def _copy_histograms():
+    with _histograms_lock:
+        if _histograms_pid != os.getpid():
+            return {}
+        return copy.deepcopy(_histograms)
+
+
+def get_histograms():
+    """
+    Histograms of this process.
+    """
+    return _cumulative(_copy_histograms())
+
+
+def _get_process_key():
+    return f"timings-{socket.gethostname()}-{os.getpid()}"
+
+
+def _get_timings_cache(config):
+    timings_config = config.get("services", {}).get("timings", {})
+    if not timings_config.get("shared", True):
+        return None
+    return caches[timings_config.get("alias", "timings")]
+
+
+def publish_histograms(config):
+    cache = _get_timings_cache(config)
+    if cache is None:
+        return
+    try:
+        key = _get_process_key()
+        cache.set(key, _copy_histograms(), timeout=None)
+        keys = cache.get(_processes_key, [])
+        if key not in keys:
+            # Lost updates are fixed with the next publish of that process
+            cache.set(_processes_key, keys + [key], timeout=None)
+    except:
+        log.debug("Could not publish histograms", exc_info=True)
+
+
+def get_merged_histograms(config):
+    """
+    Histograms of all processes which stored them in the timings cache, or
+    of this process only, if services.timings.shared is disabled.
+    """
+    cache = _get_timings_cache(config)
+    if cache is None:
+        return get_histograms()
+    publish_histograms(config)
+    keys = cache.get(_processes_key, [])
+    published = cache.get_many(keys)
+    if len(published) < len(keys):
+        # Culled entries
+        cache.set(
+            _processes_key, [x for x in keys if x in published.keys()], timeout=None
+        )
+    merged = {}
+    for histograms in published.values():
+        for name, histogram in histograms.items():
+            if name not in merged.keys():
+                merged[name] = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "buckets": [0] * (len(_histogram_buckets) + 1),
+                }
+            merged[name]["count"] += histogram["count"]
+            merged[name]["sum"] += histogram["sum"]
+            merged[name]["buckets"] = [
+                x + y for x, y in zip(merged[name]["buckets"], histogram["buckets"])
+            ]
+    return _cumulative(merged)
+
+
+def reset_histograms():
+    with _histograms_lock:
+        _histograms.clear()
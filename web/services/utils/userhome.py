@@ -0,0 +1,255 @@
+"""
+Create a user home directory from the skel directory.
+The skel is listed once (cached for userhomes.skel_listing_ttl seconds).
+Each directory is created and chowned relative to its parent's fd, then
+the files of each directory are copied and chowned right away on a thread
+pool. There's no second walk over the new home directory. Everything is
+created in a temporary directory next to the home directory, which is
+renamed at the end, so an interrupted copy does not leave a half populated
+home behind.
+
+userhomes.copy_mode:
+  copy     - copy the files (default)
+  reflink  - clone the files (FICLONE) if the filesystem supports it,
+             copy them otherwise
+  hardlink - hardlink files matching userhomes.link_files, if the user
+             can't change them: owned by another user (e.g. root) and not
+             writable by the user's group or others. The link shares the
+             inode with the skel file, every other home links to it as well.
+             Other files are copied.
+  deferred - only create the (empty) home directory. The pod has to
+             populate it, e.g. in an init container.
+"""
+import errno
+import fcntl
+import fnmatch
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from stat import S_IWGRP
+from stat import S_IWOTH
+
+from jupyterjsc_k8smgr.settings import LOGGER_NAME
+from services.utils.executor import get_executor
+
+log = logging.getLogger(LOGGER_NAME)
+assert log.__class__.__name__ == "ExtraLoggerClass"
+
+_FICLONE = 0x40049409
+
+_skel_listing_cache = OrderedDict()
+_skel_listing_cache_lock = threading.Lock()
+_skel_listing_cache_max = 100
+
+
+def _ignored(name, ignore_files):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in ignore_files)
+
+
+def _list_skel(skel, ignore_files):
+    """
+    Returns a list of (relative directory, [filenames]), parents first.
+    Same files as shutil.copytree(ignore=shutil.ignore_patterns(*ignore_files))
+    would copy.
+    """
+    listing = []
+    for dirpath, dirnames, filenames in os.walk(skel, followlinks=True):
+        dirnames[:] = sorted(x for x in dirnames if not _ignored(x, ignore_files))
+        listing.append(
+            (
+                os.path.relpath(dirpath, skel),
+                sorted(x for x in filenames if not _ignored(x, ignore_files)),
+            )
+        )
+    return listing
+
+
+def _get_skel_listing(skel, ignore_files, ttl):
+    key = (skel, tuple(ignore_files))
+    now = time.monotonic()
+    with _skel_listing_cache_lock:
+        if (
+            key in _skel_listing_cache.keys()
+            and now - _skel_listing_cache[key][0] < ttl
+        ):
+            _skel_listing_cache.move_to_end(key)
+            return _skel_listing_cache[key][1]
+    listing = _list_skel(skel, ignore_files)
+    with _skel_listing_cache_lock:
+        _skel_listing_cache[key] = (now, listing)
+        while len(_skel_listing_cache) > _skel_listing_cache_max:
+            _skel_listing_cache.popitem(last=False)
+    return listing
+
+
+def _remove_skel_listing(skel, ignore_files):
+    with _skel_listing_cache_lock:
+        _skel_listing_cache.pop((skel, tuple(ignore_files)), None)
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def _immutable_for(stat, uid, gid):
+    """
+    True, if the user uid/gid can neither write nor chmod the file.
+    """
+    if stat.st_uid == uid:
+        return False
+    if stat.st_mode & S_IWOTH:
+        return False
+    if stat.st_gid == gid and stat.st_mode & S_IWGRP:
+        return False
+    return True
+
+
+def _copy_file(src, dst, copy_mode, link_files, uid, gid):
+    """
+    Returns the method used for this file.
+    """
+    if copy_mode == "hardlink" and _ignored(os.path.basename(src), link_files):
+        if _immutable_for(os.stat(src), uid, gid):
+            try:
+                os.link(src, dst)
+                return "hardlink"
+            except OSError as e:
+                if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+                    raise
+    if copy_mode == "reflink":
+        try:
+            _reflink(src, dst)
+            os.chown(dst, uid, gid)
+            return "reflink"
+        except OSError as e:
+            if e.errno not in [
+                errno.EOPNOTSUPP,
+                errno.ENOTTY,
+                errno.EXDEV,
+                errno.EINVAL,
+            ]:
+                raise
+    shutil.copy2(src, dst)
+    os.chown(dst, uid, gid)
+    return "copy"
+
+
+def _copy_directory_files(src_dir, dst_dir, filenames, copy_mode, link_files, uid, gid):
+    methods = {}
+    for filename in filenames:
+        src = os.path.join(src_dir, filename)
+        try:
+            method = _copy_file(
+                src,
+                os.path.join(dst_dir, filename),
+                copy_mode,
+                link_files,
+                uid,
+                gid,
+            )
+        except FileNotFoundError:
+            if os.path.lexists(src):
+                raise
+            # Removed from skel since it was listed
+            method = "missing"
+        methods[method] = methods.get(method, 0) + 1
+    return methods
+
+
+def _mkdir_chown(path, uid, gid, mode=0o755):
+    parent, name = os.path.split(path)
+    dir_fd = os.open(parent, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.mkdir(name, mode, dir_fd=dir_fd)
+        os.chown(name, uid, gid, dir_fd=dir_fd, follow_symlinks=False)
+        # mkdir applies the umask
+        os.chmod(name, mode, dir_fd=dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def create_user_home(path, skel, ignore_files, uid, gid, userhomes_config, logs_extra):
+    """
+    Returns a dict with the duration of each phase in seconds.
+    """
+    copy_mode = userhomes_config.get("copy_mode", "copy")
+    timings = {}
+    start = time.monotonic()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if copy_mode == "deferred":
+        try:
+            _mkdir_chown(path, uid, gid)
+        except FileExistsError:
+            pass
+        timings["total"] = time.monotonic() - start
+        return timings
+
+    listing = _get_skel_listing(
+        skel, ignore_files, userhomes_config.get("skel_listing_ttl", 60)
+    )
+    timings["listing"] = time.monotonic() - start
+
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+    try:
+        t = time.monotonic()
+        missing_dirs = set()
+        for reldir, filenames in listing:
+            dst_dir = os.path.normpath(os.path.join(tmp_path, reldir))
+            try:
+                mode = os.stat(os.path.join(skel, reldir)).st_mode & 0o7777
+            except FileNotFoundError:
+                # Removed from skel since it was listed, subdirectories too
+                missing_dirs.add(reldir)
+                continue
+            _mkdir_chown(dst_dir, uid, gid, mode)
+        timings["directories"] = time.monotonic() - t
+
+        t = time.monotonic()
+        executor = get_executor("userhome", userhomes_config.get("max_workers", 8))
+        futures = [
+            executor.submit(
+                _copy_directory_files,
+                os.path.join(skel, reldir),
+                os.path.normpath(os.path.join(tmp_path, reldir)),
+                filenames,
+                copy_mode,
+                userhomes_config.get("link_files", []),
+                uid,
+                gid,
+            )
+            for reldir, filenames in listing
+            if filenames and reldir not in missing_dirs
+        ]
+        methods = {}
+        for future in futures:
+            for method, count in future.result().items():
+                methods[method] = methods.get(method, 0) + count
+        timings["files"] = time.monotonic() - t
+        if missing_dirs or methods.get("missing", 0):
+            # The cached listing is outdated
+            _remove_skel_listing(skel, ignore_files)
+
+        t = time.monotonic()
+        try:
+            os.rename(tmp_path, path)
+        except OSError as e:
+            if e.errno not in [errno.EEXIST, errno.ENOTEMPTY]:
+                raise
+            # Created by a concurrent start for the same user
+            log.debug(
+                f"Home directory {path} created in the meantime", extra=logs_extra
+            )
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        timings["rename"] = time.monotonic() - t
+    except:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    timings["total"] = time.monotonic() - start
+    log.debug(f"Home directory files: {methods}", extra=logs_extra)
+    return timings
@@ -0,0 +1,54 @@
+"""
+Keep the warm pools (see services.utils.k8s) at their configured size.
+Claimed pods are replaced by the pool's ReplicaSet, this refiller creates
+missing pool Deployments, applies size changes and removes pools which are
+no longer configured. One worker process (the one holding the lock file)
+does this every services.warm_pool.refill_interval seconds.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+
+from jupyterjsc_k8smgr.settings import LOGGER_NAME
+from services.utils import _config
+from services.utils import k8s
+
+log = logging.getLogger(LOGGER_NAME)
+assert log.__class__.__name__ == "ExtraLoggerClass"
+
+_warm_pool_refiller = {"pid": None, "thread": None}
+_warm_pool_refiller_lock = threading.Lock()
+
+
+def _run():
+    logs_extra = {"uuidcode": "WarmPoolRefiller"}
+    lock_file = k8s._get_warm_pool_config(_config()).get(
+        "lock_file", "/tmp/k8smgr_warm_pool.lock"
+    )
+    with open(lock_file, "w") as f:
+        # Only one worker refills the pools. The others wait here
+        # and take over, if the current one dies.
+        fcntl.flock(f, fcntl.LOCK_EX)
+        log.info("WarmPoolRefiller - started", extra=logs_extra)
+        while True:
+            config = _config()
+            try:
+                k8s._ensure_warm_pools(config, logs_extra)
+            except:
+                log.exception("WarmPoolRefiller - refill failed", extra=logs_extra)
+            time.sleep(k8s._get_warm_pool_config(config).get("refill_interval", 30))
+
+
+def start_warm_pool_refiller():
+    if not k8s._get_warm_pool_config(_config()).get("enabled", False):
+        return None
+    with _warm_pool_refiller_lock:
+        if _warm_pool_refiller["pid"] != os.getpid():
+            _warm_pool_refiller["thread"] = threading.Thread(
+                target=_run, name="warm-pool-refiller", daemon=True
+            )
+            _warm_pool_refiller["thread"].start()
+            _warm_pool_refiller["pid"] = os.getpid()
+        return _warm_pool_refiller["thread"]
@@ -1,25 +1,42 @@
 import logging
 
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from jupyterjsc_k8smgr.decorators import request_decorator
 from jupyterjsc_k8smgr.permissions import HasGroupPermission
 from jupyterjsc_k8smgr.settings import LOGGER_NAME
 from rest_framework import mixins
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
 from .models import ServicesModel
 from .models import UserJobsModel
 from .serializers import ServicesSerializer
 from .serializers import UserJobsSerializer
 from .utils import get_custom_headers
+from .utils.common import async_start_enabled
+from .utils.common import async_stop_enabled
 from .utils.common import initial_data_to_logs_extra
 from .utils.common import instance_dict_and_custom_headers_to_logs_extra
+from .utils.common import reconciler_metrics
+from .utils.common import start_phase_status
 from .utils.common import start_service
+from .utils.common import start_service_async
+from .utils.common import status_cache_counters
+from .utils.common import status_services
+from .utils.common import stop_pending_stale_before
 from .utils.common import stop_service
+from .utils.common import stop_service_async
+from .utils.common import stop_services
+from .utils.common import timing_histograms
 from .utils.common import update_service
 from .utils.common import userjobs_create_k8s_svc
 from .utils.common import userjobs_create_ssh_tunnels
 from .utils.common import userjobs_delete_k8s_svc
 from .utils.common import userjobs_delete_ssh_tunnels
+from .utils.common import userjobs_tunnels
 
 log = logging.getLogger(LOGGER_NAME)
 assert log.__class__.__name__ == "ExtraLoggerClass"
@@ -50,6 +67,21 @@ class ServicesViewSet(
             serializer.initial_data,
             custom_headers,
         )
+        self.start_async = async_start_enabled()
+        if self.start_async:
+            validated_data = dict(serializer.validated_data)
+            instance = serializer.save(
+                start_phase="queued", start_phase_date=timezone.now()
+            )
+            start_service_async(
+                instance.id,
+                validated_data,
+                serializer.initial_data,
+                custom_headers,
+                self.request.user.username,
+                logs_extra,
+            )
+            return
         start_service(
             serializer.validated_data,
             serializer.initial_data,
@@ -64,12 +96,37 @@ class ServicesViewSet(
         logs_extra = instance_dict_and_custom_headers_to_logs_extra(
             instance.__dict__, custom_headers
         )
-        if instance.stop_pending:
+        # Claim the service with a conditional update of the stop columns
+        # only. A concurrent DELETE or stop doesn't stop it twice and an
+        # update of the start phase running at the same time is kept.
+        claim_date = timezone.now()
+        claimed = (
+            ServicesModel.objects.filter(id=instance.id)
+            .filter(
+                Q(stop_pending=False)
+                | Q(stop_pending_date=None)
+                | Q(stop_pending_date__lt=stop_pending_stale_before(claim_date))
+            )
+            .update(stop_pending=True, stop_pending_date=claim_date)
+        )
+        if not claimed:
             log.info("Service is already stopping. Do nothing.", extra=logs_extra)
             return
+        if instance.stop_pending:
+            log.warning(
+                "Service is stopping for too long. Stop it again.", extra=logs_extra
+            )
+        instance.stop_pending = True
+        instance.stop_pending_date = claim_date
+        if async_stop_enabled():
+            instance_dict = {
+                key: value
+                for key, value in instance.__dict__.items()
+                if not key.startswith("_")
+            }
+            stop_service_async(instance.id, instance_dict, custom_headers, logs_extra)
+            return
         try:
-            instance.stop_pending = True
-            instance.save()
             stop_service(instance.__dict__, custom_headers, logs_extra)
         except Exception as e:
             log.critical(
@@ -94,7 +151,11 @@ class ServicesViewSet(
 
     @request_decorator
     def create(self, request, *args, **kwargs):
-        return super().create(request, *args, **kwargs)
+        response = super().create(request, *args, **kwargs)
+        if getattr(self, "start_async", False):
+            # Service is saved, but not started yet
+            response.status_code = 202
+        return response
 
     @request_decorator
     def retrieve(self, request, *args, **kwargs):
@@ -108,6 +169,160 @@ class ServicesViewSet(
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    # Actions on the collection live under _bulk/ and _metrics/. Detail
+    # routes match one path segment (the servername), which can't start
+    # with "_" (see ServicesSerializer), so these paths never collide.
+    @action(detail=False, methods=["post"], url_path="_bulk/status")
+    @request_decorator
+    def status(self, request, *args, **kwargs):
+        servernames = request.data.get("servernames", [])
+        if type(servernames) != list:
+            return Response(["servernames must be a list"], status=400)
+
+        # Keep only the latest service for each servername
+        instances = {}
+        for instance in self.get_queryset().filter(servername__in=servernames):
+            if (
+                instance.servername not in instances.keys()
+                or instances[instance.servername].id < instance.id
+            ):
+                instances[instance.servername] = instance
+
+        custom_headers = get_custom_headers(self.request._request.META)
+        logs_extra = {
+            servername: instance_dict_and_custom_headers_to_logs_extra(
+                instance.__dict__, custom_headers
+            )
+            for servername, instance in instances.items()
+        }
+        services_status = status_services(
+            [
+                x.__dict__
+                for x in instances.values()
+                if not x.stop_pending and start_phase_status(x.__dict__) is None
+            ],
+            custom_headers,
+            logs_extra,
+        )
+        context = self.get_serializer_context()
+        context["services_status"] = services_status
+        ret = {
+            servername: self.get_serializer(instance, context=context).data
+            for servername, instance in instances.items()
+        }
+        return Response(ret, status=200)
+
+    @action(detail=False, methods=["post"], url_path="_bulk/stop")
+    @request_decorator
+    def stop(self, request, *args, **kwargs):
+        """
+        Stops all services of the user matching all given filters:
+        servernames (list), jhub_user_id, start_date_before (ISO 8601).
+        """
+        queryset = self.get_queryset()
+        filtered = False
+        servernames = request.data.get("servernames", None)
+        if servernames is not None:
+            if type(servernames) != list:
+                return Response(["servernames must be a list"], status=400)
+            queryset = queryset.filter(servername__in=servernames)
+            filtered = True
+        jhub_user_id = request.data.get("jhub_user_id", None)
+        if jhub_user_id is not None:
+            queryset = queryset.filter(jhub_user_id=jhub_user_id)
+            filtered = True
+        start_date_before = request.data.get("start_date_before", None)
+        if start_date_before is not None:
+            try:
+                start_date_before = parse_datetime(start_date_before)
+            except (TypeError, ValueError):
+                start_date_before = None
+            if start_date_before is None:
+                return Response(
+                    ["start_date_before must be an ISO 8601 datetime"], status=400
+                )
+            queryset = queryset.filter(start_date__lt=start_date_before)
+            filtered = True
+        if not filtered:
+            return Response(
+                ["servernames, jhub_user_id or start_date_before required"],
+                status=400,
+            )
+
+        ret = {}
+        for servername in servernames or []:
+            ret[servername] = {"stopped": False, "error": "Service not found"}
+        candidates = list(queryset)
+        # Claim the services with one conditional update, so a concurrent
+        # stop (or DELETE) of the same service doesn't stop it twice. The
+        # claimed rows are the ones with our stop_pending_date.
+        # Status checks report these as stopped from now on.
+        claim_date = timezone.now()
+        self.get_queryset().filter(id__in=[x.id for x in candidates]).filter(
+            Q(stop_pending=False)
+            | Q(stop_pending_date=None)
+            | Q(stop_pending_date__lt=stop_pending_stale_before(claim_date))
+        ).update(stop_pending=True, stop_pending_date=claim_date)
+        claimed_ids = set(
+            self.get_queryset()
+            .filter(id__in=[x.id for x in candidates], stop_pending_date=claim_date)
+            .values_list("id", flat=True)
+        )
+        instances = []
+        for instance in candidates:
+            if instance.id in claimed_ids:
+                instances.append(instance)
+            else:
+                ret[instance.servername] = {
+                    "stopped": False,
+                    "error": "Service is already stopping",
+                }
+
+        custom_headers = get_custom_headers(self.request._request.META)
+        logs_extra = {
+            instance.servername: instance_dict_and_custom_headers_to_logs_extra(
+                instance.__dict__, custom_headers
+            )
+            for instance in instances
+        }
+        results = stop_services(
+            [x.__dict__ for x in instances], custom_headers, logs_extra
+        )
+        stopped_ids = []
+        failed_ids = []
+        for instance in instances:
+            error = results.get(instance.servername, None)
+            if error is None:
+                stopped_ids.append(instance.id)
+                ret[instance.servername] = {"stopped": True}
+            else:
+                failed_ids.append(instance.id)
+                ret[instance.servername] = {
+                    "stopped": False,
+                    "error": error.args[0],
+                    "detailed_error": error.args[1] if len(error.args) > 1 else "",
+                }
+        ServicesModel.objects.filter(id__in=stopped_ids).delete()
+        # Keep the failed ones, so they can be stopped again
+        ServicesModel.objects.filter(id__in=failed_ids).update(stop_pending=False)
+        return Response(ret, status=200)
+
+    @action(detail=False, methods=["get"], url_path="_metrics/status_cache")
+    @request_decorator
+    def status_cache(self, request, *args, **kwargs):
+        return Response(status_cache_counters(), status=200)
+
+    @action(detail=False, methods=["get"], url_path="_metrics/timings")
+    @request_decorator
+    def timings(self, request, *args, **kwargs):
+        # All worker processes sharing the timings cache (services.timings)
+        return Response(timing_histograms(), status=200)
+
+    @action(detail=False, methods=["get"], url_path="_metrics/reconciler")
+    @request_decorator
+    def reconciler(self, request, *args, **kwargs):
+        return Response(reconciler_metrics(), status=200)
+
     @request_decorator
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -201,6 +416,20 @@ class UserJobsViewSet(
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
 
+    # The service of a UserJob can't start with "_" (see UserJobsSerializer)
+    @action(detail=False, methods=["get"], url_path="_metrics/tunnels")
+    @request_decorator
+    def tunnels(self, request, *args, **kwargs):
+        custom_headers = get_custom_headers(self.request._request.META)
+        logs_extra = {"uuidcode": custom_headers.get("uuidcode", "")}
+        return Response(
+            userjobs_tunnels(
+                [x.__dict__ for x in self.get_queryset()],
+                logs_extra,
+            ),
+            status=200,
+        )
+
     @request_decorator
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
@@ -94,6 +94,30 @@ class LogsUnitTest(UserCredentials):
         self.client.get(logtest_url)
         self.assertEqual(len(log.handlers), 0)
 
+    def test_min_handler_level_follows_handler_updates(self):
+        url = reverse("handler-list")
+        logtest_url = reverse("logtest-list")
+        log = logging.getLogger(LOGGER_NAME)
+        self.client.post(url, data=self.stream_config, format="json")
+        self.client.get(logtest_url)
+        self.assertEqual(utils.get_min_handler_level(log), 10)
+        config = copy.deepcopy(self.stream_config)
+        config["configuration"]["level"] = 5
+        self.client.patch(f"{url}stream/", data=config, format="json")
+        self.client.get(logtest_url)
+        self.assertEqual(utils.get_min_handler_level(log), 5)
+        self.client.delete(f"{url}stream/", format="json")
+        self.client.get(logtest_url)
+        self.assertEqual(utils.get_min_handler_level(log), 20)
+
+    def test_lazy_trace_payload(self):
+        payload = utils.LazyTracePayload({"key": object})
+        formatter = utils.JsonFormatter(**utils.supported_formatter_kwargs["json"])
+        record = logging.LogRecord(LOGGER_NAME, 5, "", 0, "msg", (), None)
+        record.payload = payload
+        self.assertIn('"payload": {"key": "<class', formatter.format(record))
+        self.assertEqual(str(payload), str({"key": str(object)}))
+
     def test_post_and_update(self):
         url = reverse("handler-list")
         logtest_url = reverse("logtest-list")
@@ -4,6 +4,8 @@ userhomes_base = "web/tests/files/userhomes"
 userhomes_skel = "web/tests/files/userhomes_skel"
 
 import datetime
+import json
+import types
 from dateutil.tz import tzutc
 
 
@@ -110,6 +112,27 @@ def config_mock_userhome_mapping():
     }
 
 
+def config_mock_async_start():
+    config = config_mock()
+    config["services"]["async_start"] = {"enabled": True}
+    return config
+
+
+def config_mock_async_stop():
+    config = config_mock()
+    config["services"]["async_stop"] = {"enabled": True, "max_attempts": 3}
+    return config
+
+
+class executor_sync:
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+def mocked_get_executor(*args, **kwargs):
+    return executor_sync()
+
+
 def mocked_popen_init(*args, **kwargs):
     return PopenMocked(*args, **kwargs)
 
@@ -225,6 +248,19 @@ class k8s_V1Secret:
     type = ""
 
 
+def _snake_to_camel(d):
+    # to_dict() returns snake_case keys, the raw API response uses camelCase
+    if isinstance(d, list):
+        return [_snake_to_camel(x) for x in d]
+    if not isinstance(d, dict):
+        return d
+    ret = {}
+    for key, value in d.items():
+        first, *rest = key.split("_")
+        ret[first + "".join(x.title() for x in rest)] = _snake_to_camel(value)
+    return ret
+
+
 class k8s_pods:
     d = {}
 
@@ -234,6 +270,11 @@ class k8s_pods:
     def to_dict(self):
         return self.d
 
+    @property
+    def data(self):
+        # response with _preload_content=False
+        return json.dumps(_snake_to_camel(self.d), default=str).encode()
+
 
 class k8s_apiclient:
     def __init__(self, *args, **kwargs):
@@ -241,6 +282,9 @@ class k8s_apiclient:
 
 
 class k8s_client:
+    # Stop of a single service: "k8smgr-drf-id=abc"
+    drf_id_selector = "k8smgr-drf-id="
+
     def __init__(self, *args, **kwargs):
         pass
 
@@ -326,35 +370,124 @@ class k8s_client:
     def delete_namespaced_service_account(self, name, namespace):
         assert name.startswith("svcacc-")
 
+    def read_namespaced_secret(self, name, namespace):
+        assert name.startswith("secret-")
+        labels = {"k8smgr-owner": "k8smgr", "k8smgr-drf-id": "abc"}
+        return types.SimpleNamespace(metadata=types.SimpleNamespace(labels=labels))
+
+    def list_namespaced_secret(self, namespace, label_selector, **kwargs):
+        # Only listed for services stopped at once
+        assert "k8smgr-drf-id in (" in label_selector
+        values = label_selector.split("(")[1].rstrip(")").split(",")
+        items = [
+            {"metadata": {"labels": {"k8smgr-owner": "k8smgr", "k8smgr-drf-id": x}}}
+            for x in values
+        ]
+        return k8s_pods({"items": items})
+
+    def list_namespaced_service(self, namespace, label_selector, **kwargs):
+        assert self.drf_id_selector in label_selector
+        return k8s_pods({"items": [{"metadata": {"name": "svc-abc"}}]})
+
+    def delete_collection_namespaced_pod(self, namespace, label_selector, **kwargs):
+        assert self.drf_id_selector in label_selector
+
+    def delete_collection_namespaced_config_map(
+        self, namespace, label_selector, **kwargs
+    ):
+        assert self.drf_id_selector in label_selector
+
+    def delete_collection_namespaced_secret(self, namespace, label_selector, **kwargs):
+        assert self.drf_id_selector in label_selector
+
 
 class k8s_client_appsv1_api:
+    drf_id_selector = "k8smgr-drf-id="
+
     def __init__(self, *args, **kwargs):
         pass
 
     def delete_namespaced_deployment(self, name, namespace):
         assert name.startswith("deployment-")
 
+    def delete_collection_namespaced_deployment(
+        self, namespace, label_selector, **kwargs
+    ):
+        assert self.drf_id_selector in label_selector
+
+    def delete_collection_namespaced_stateful_set(
+        self, namespace, label_selector, **kwargs
+    ):
+        assert self.drf_id_selector in label_selector
+
+    def delete_collection_namespaced_daemon_set(
+        self, namespace, label_selector, **kwargs
+    ):
+        assert self.drf_id_selector in label_selector
+
+
+class k8s_client_batchv1_api:
+    drf_id_selector = "k8smgr-drf-id="
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def delete_collection_namespaced_job(self, namespace, label_selector, **kwargs):
+        assert self.drf_id_selector in label_selector
+
+
+# Services stopped at once: "k8smgr-drf-id in (abc,def)"
+class k8s_client_bulk(k8s_client):
+    drf_id_selector = "k8smgr-drf-id in ("
+
+
+class k8s_client_appsv1_api_bulk(k8s_client_appsv1_api):
+    drf_id_selector = "k8smgr-drf-id in ("
+
+
+class k8s_client_batchv1_api_bulk(k8s_client_batchv1_api):
+    drf_id_selector = "k8smgr-drf-id in ("
+
 
 def k8s_client_CoreV1Api(*args, **kwargs):
     return k8s_client()
 
 
+def k8s_client_CoreV1Api_bulk(*args, **kwargs):
+    return k8s_client_bulk()
+
+
 def k8s_ApiClient(*args, **kwargs):
     return k8s_apiclient()
 
 
 def k8s_client_AppsV1Api(k8s_client):
-    assert k8s_client.__class__.__name__ == "k8s_client"
+    assert k8s_client.__class__.__name__ == "k8s_apiclient"
     return k8s_client_appsv1_api()
 
 
+def k8s_client_BatchV1Api(k8s_client):
+    assert k8s_client.__class__.__name__ == "k8s_apiclient"
+    return k8s_client_batchv1_api()
+
+
+def k8s_client_AppsV1Api_bulk(k8s_client):
+    assert k8s_client.__class__.__name__ == "k8s_apiclient"
+    return k8s_client_appsv1_api_bulk()
+
+
+def k8s_client_BatchV1Api_bulk(k8s_client):
+    assert k8s_client.__class__.__name__ == "k8s_apiclient"
+    return k8s_client_batchv1_api_bulk()
+
+
 # from kubernetes import config
-def k8s_config_load_incluster_config():
+def k8s_config_load_incluster_config(*args, **kwargs):
     pass
 
 
 # from kubernetes import utils as k8s_utils
-def k8s_utils_create_from_yaml(k8s_client, yaml_file, namespace):
+def k8s_utils_create_from_dict(k8s_client, data, namespace):
     assert k8s_client.__class__.__name__ == "k8s_apiclient"
-    assert yaml_file
+    assert data
     assert namespace
@@ -0,0 +1,1374 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+import yaml
+from django.test import override_settings
+from django.test import SimpleTestCase
+from kubernetes.client.rest import ApiException
+from services.utils import k8s
+from services.utils import status_cache
+from services.utils import timing
+from services.utils import userhome
+from services.utils.informer import PodInformer
+from services.utils.projection import project_pod
+from tests.mocks import config_mock
+from tests.mocks import k8s_ApiClient
+from tests.mocks import k8s_client
+from tests.mocks import k8s_config_load_incluster_config
+from tests.mocks import k8s_pods
+
+
+def pod_dict(pod_name, name_label, phase="Running"):
+    # Same keys as services.utils.projection.project_pod
+    return {
+        "metadata": {
+            "name": pod_name,
+            "uid": None,
+            "labels": {"name": name_label},
+            "resource_version": None,
+        },
+        "status": {"phase": phase, "container_statuses": []},
+    }
+
+
+class k8s_client_informer(k8s_client):
+    def list_namespaced_pod(self, namespace, **kwargs):
+        return k8s_pods(
+            {
+                "metadata": {"resource_version": "10"},
+                "items": [
+                    pod_dict("pod-a", "deployment-a"),
+                    pod_dict("pod-b", "deployment-b"),
+                ],
+            }
+        )
+
+
+class watch_response:
+    def __init__(self, events, chunk_size=7):
+        data = b"".join(json.dumps(x).encode() + b"\n" for x in events)
+        self.chunks = [
+            data[i : i + chunk_size] for i in range(0, len(data), chunk_size)
+        ]
+        self.closed = False
+
+    def stream(self, amt=None, decode_content=None):
+        yield from self.chunks
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        pass
+
+
+class PodInformerTests(SimpleTestCase):
+    def test_not_synced(self):
+        informer = PodInformer(k8s_client_informer, "default")
+        self.assertIsNone(informer.get("deployment-a"))
+
+    def test_list_and_events(self):
+        informer = PodInformer(k8s_client_informer, "default")
+        informer._list(k8s_client_informer())
+        self.assertEqual(informer.resource_version, "10")
+        self.assertEqual(
+            informer.get("deployment-a"), [pod_dict("pod-a", "deployment-a")]
+        )
+
+        informer._apply("MODIFIED", pod_dict("pod-a", "deployment-a", "Failed"))
+        informer._apply("DELETED", pod_dict("pod-b", "deployment-b"))
+        informer._apply("ADDED", pod_dict("pod-c", "deployment-c"))
+        self.assertEqual(informer.get("deployment-a")[0]["status"]["phase"], "Failed")
+        self.assertEqual(informer.get("deployment-b"), [])
+        self.assertEqual(len(informer.get("deployment-c")), 1)
+
+    def test_watch(self):
+        raw_pod = {
+            "metadata": {
+                "name": "pod-c",
+                "labels": {"name": "deployment-c"},
+                "resourceVersion": "11",
+            },
+            "status": {"phase": "Running"},
+        }
+        resp = watch_response(
+            [
+                {"type": "ADDED", "object": raw_pod},
+                {"type": "DELETED", "object": pod_dict("pod-b", "deployment-b")},
+                {"type": "ERROR", "object": {"code": 410}},
+                {"type": "ADDED", "object": pod_dict("pod-d", "deployment-d")},
+            ]
+        )
+        api = mock.Mock()
+        api.list_namespaced_pod.return_value = resp
+        informer = PodInformer(k8s_client_informer, "default")
+        informer._list(k8s_client_informer())
+        informer._watch(api)
+        api.list_namespaced_pod.assert_called_once_with(
+            namespace="default",
+            watch=True,
+            resource_version="10",
+            timeout_seconds=300,
+            _preload_content=False,
+        )
+        self.assertEqual(informer.get("deployment-c"), [project_pod(raw_pod)])
+        self.assertEqual(informer.get("deployment-b"), [])
+        self.assertEqual(informer.get("deployment-d"), [])
+        self.assertIsNone(informer.resource_version)
+        self.assertTrue(resp.closed)
+
+    def test_get_pod_uses_informer(self):
+        informer = PodInformer(k8s_client_informer, "default")
+        informer._list(k8s_client_informer())
+        deployment_main = {
+            "spec": {"selector": {"matchLabels": {"name": "deployment-a"}}}
+        }
+        api = mock.Mock()
+        with mock.patch("services.utils.k8s.get_pod_informer", return_value=informer):
+            pod = k8s._get_pod(api, "default", deployment_main, config_mock(), 20, {})
+        self.assertEqual(pod["metadata"]["name"], "pod-a")
+        api.list_namespaced_pod.assert_not_called()
+
+
+class DeploymentMainCacheTests(SimpleTestCase):
+    drf_id = "cachetest-abcdefgh"
+    service_yaml = """apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: deployment-main-<drf_id>
+spec:
+  selector:
+    matchLabels:
+      name: <name>
+"""
+
+    def setUp(self):
+        self.config = config_mock()
+        self.service_yaml_file = k8s._get_yaml_file_name(self.drf_id, self.config)
+        os.makedirs(os.path.dirname(self.service_yaml_file), exist_ok=True)
+        self.write_service_yaml("deployment-1")
+        k8s._deployment_main_cache_remove(self.drf_id)
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.service_yaml_file))
+        return super().tearDown()
+
+    def write_service_yaml(self, name):
+        with open(self.service_yaml_file, "w") as f:
+            f.write(
+                self.service_yaml.replace("<drf_id>", self.drf_id).replace(
+                    "<name>", name
+                )
+            )
+
+    def get_name_label(self):
+        deployment_main = k8s._get_deployment_main(self.drf_id, self.config, 20, {})
+        return deployment_main["spec"]["selector"]["matchLabels"]["name"]
+
+    def test_parsed_once(self):
+        with mock.patch(
+            "services.utils.k8s.yaml.safe_load_all", side_effect=yaml.safe_load_all
+        ) as safe_load_all:
+            self.assertEqual(self.get_name_label(), "deployment-1")
+            self.assertEqual(self.get_name_label(), "deployment-1")
+        self.assertEqual(safe_load_all.call_count, 1)
+
+    def test_invalidated_on_change(self):
+        self.assertEqual(self.get_name_label(), "deployment-1")
+        self.write_service_yaml("deployment-22")
+        self.assertEqual(self.get_name_label(), "deployment-22")
+
+    def test_select_without_main(self):
+        service_objects = [
+            None,
+            {"apiVersion": "v1", "kind": "Service", "metadata": {"name": "svc"}},
+            {"kind": "Deployment", "metadata": {"name": "other"}},
+            {"metadata": {"name": "no-kind"}},
+        ]
+        deployments, deployment_main_list = k8s._select_deployment_main(
+            self.drf_id, self.config, service_objects
+        )
+        self.assertEqual(deployments, [service_objects[2]])
+        self.assertEqual(deployment_main_list, [])
+        with self.assertRaisesMessage(Exception, "No deployment configured"):
+            k8s._find_deployment_main(
+                self.drf_id, self.config, service_objects, self.service_yaml_file, {}
+            )
+
+
+class ApiClientTests(SimpleTestCase):
+    def setUp(self):
+        k8s._k8s_api_client["client"] = None
+        return super().setUp()
+
+    @mock.patch("services.utils.k8s.client.ApiClient", side_effect=k8s_ApiClient)
+    @mock.patch(
+        "services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    def test_client_reused(self, load_config, api_client):
+        first = k8s._k8s_get_api_client()
+        self.assertIs(first, k8s._k8s_get_api_client())
+        self.assertEqual(load_config.call_count, 1)
+        configuration = api_client.call_args[0][0]
+        self.assertEqual(
+            configuration.connection_pool_maxsize,
+            k8s._k8s_get_connection_pool_maxsize(k8s._config()),
+        )
+
+    @mock.patch.dict(os.environ, {"GUNICORN_THREADS": "25"})
+    def test_connection_pool_maxsize(self):
+        config = config_mock()
+        # 25 threads, 50 status, 10 create, 8 delete, 4 bulk stop, 1 informer
+        self.assertEqual(k8s._k8s_get_connection_pool_maxsize(config), 98)
+        config["services"]["async_stop"] = {"enabled": True, "max_workers": 2}
+        self.assertEqual(k8s._k8s_get_connection_pool_maxsize(config), 100)
+        with mock.patch.dict(os.environ, {"K8S_CONNECTION_POOL_MAXSIZE": "7"}):
+            self.assertEqual(k8s._k8s_get_connection_pool_maxsize(config), 7)
+
+    @mock.patch("services.utils.k8s.client.ApiClient", side_effect=k8s_ApiClient)
+    @mock.patch(
+        "services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    def test_client_recreated_after_fork(self, load_config, api_client):
+        first = k8s._k8s_get_api_client()
+        k8s._k8s_api_client["pid"] = -1
+        self.assertIsNot(first, k8s._k8s_get_api_client())
+        self.assertEqual(load_config.call_count, 2)
+
+
+class BulkStatusTests(SimpleTestCase):
+    def test_get_pods_one_request(self):
+        api = mock.Mock()
+        api.list_namespaced_pod.return_value = k8s_pods(
+            {
+                "items": [
+                    pod_dict("pod-a", "deployment-a"),
+                    pod_dict("pod-b", "deployment-b"),
+                ]
+            }
+        )
+        pods = k8s._get_pods(
+            api, "default", ["deployment-a", "deployment-b"], config_mock()
+        )
+        self.assertEqual(api.list_namespaced_pod.call_count, 1)
+        label_selector = api.list_namespaced_pod.call_args.kwargs["label_selector"]
+        self.assertTrue(label_selector.startswith("name in ("))
+        self.assertEqual(pods["deployment-a"], [pod_dict("pod-a", "deployment-a")])
+        self.assertEqual(pods["deployment-b"], [pod_dict("pod-b", "deployment-b")])
+
+
+class DetailedErrorLogsTests(SimpleTestCase):
+    def failed_pod(self, uid, restart_count=0):
+        pod = pod_dict("pod-a", "deployment-a", "Failed")
+        pod["metadata"]["uid"] = uid
+        pod["status"]["container_statuses"] = [
+            {"name": "main", "restart_count": restart_count}
+        ]
+        return pod
+
+    def test_logs_tail_bounded_and_cached(self):
+        api = mock.Mock()
+        api.read_namespaced_pod_log.return_value = "line1\nline2\n<b>line3</b>\n"
+        config = config_mock()
+        config["services"]["status_information"] = {"container_logs_lines": 2}
+        pod = self.failed_pod(uuid.uuid4().hex)
+        logs = k8s._get_detailed_error_logs(api, pod, "default", config, 20, {})
+        self.assertIn("line2<br>&lt;b&gt;line3&lt;/b&gt;", logs)
+        self.assertNotIn("line1", logs)
+        kwargs = api.read_namespaced_pod_log.call_args.kwargs
+        self.assertEqual(kwargs["tail_lines"], 2)
+        self.assertIn("limit_bytes", kwargs.keys())
+
+        self.assertEqual(
+            k8s._get_detailed_error_logs(api, pod, "default", config, 20, {}), logs
+        )
+        self.assertEqual(api.read_namespaced_pod_log.call_count, 1)
+
+        # A container restart invalidates the cached logs
+        pod = self.failed_pod(pod["metadata"]["uid"], restart_count=1)
+        k8s._get_detailed_error_logs(api, pod, "default", config, 20, {})
+        self.assertEqual(api.read_namespaced_pod_log.call_count, 2)
+
+
+class StatusDeadlineTests(SimpleTestCase):
+    def waiting_pod(self, reason):
+        pod = pod_dict("pod-a", "deployment-a", "Pending")
+        pod["metadata"]["uid"] = uuid.uuid4().hex
+        pod["status"]["container_statuses"] = [
+            {
+                "name": "main",
+                "restart_count": 0,
+                "state": {
+                    "running": None,
+                    "terminated": None,
+                    "waiting": {"reason": reason},
+                },
+            }
+        ]
+        return pod
+
+    def warning_events(self, **kwargs):
+        return k8s_pods(
+            {"items": [{"type": "Warning", "reason": "BackOff", "message": "back"}]}
+        )
+
+    def test_events_and_logs_concurrent(self):
+        both_running = threading.Barrier(2, timeout=5)
+
+        def list_namespaced_event(**kwargs):
+            both_running.wait()
+            return self.warning_events()
+
+        def read_namespaced_pod_log(**kwargs):
+            both_running.wait()
+            return "error"
+
+        api = mock.Mock()
+        api.list_namespaced_event.side_effect = list_namespaced_event
+        api.read_namespaced_pod_log.side_effect = read_namespaced_pod_log
+        status = k8s._status_from_pod(
+            api,
+            "default",
+            config_mock(),
+            self.waiting_pod("CrashLoopBackOff"),
+            time.monotonic() + 10,
+            20,
+            {},
+        )
+        self.assertFalse(status["running"])
+        self.assertIn("back", status["details"]["detailed_error"])
+        self.assertIn("error", status["details"]["detailed_error"])
+
+    def test_deadline_partial_detailed_error(self):
+        release = threading.Event()
+
+        def read_namespaced_pod_log(**kwargs):
+            release.wait(5)
+            return "error"
+
+        api = mock.Mock()
+        api.list_namespaced_event.side_effect = self.warning_events
+        api.read_namespaced_pod_log.side_effect = read_namespaced_pod_log
+        try:
+            status = k8s._status_from_pod(
+                api,
+                "default",
+                config_mock(),
+                self.waiting_pod("CrashLoopBackOff"),
+                time.monotonic() + 0.2,
+                20,
+                {},
+            )
+        finally:
+            release.set()
+        self.assertFalse(status["running"])
+        self.assertIn("back", status["details"]["detailed_error"])
+        self.assertIn("No logs available", status["details"]["detailed_error"])
+
+    def test_no_log_request_while_creating(self):
+        api = mock.Mock()
+        api.list_namespaced_event.return_value = k8s_pods(
+            {"items": [{"type": "Normal", "reason": "Pulling", "message": "pull"}]}
+        )
+        status = k8s._status_from_pod(
+            api,
+            "default",
+            config_mock(),
+            self.waiting_pod("ContainerCreating"),
+            time.monotonic() + 10,
+            20,
+            {},
+        )
+        self.assertEqual(status, {"running": True})
+        api.read_namespaced_pod_log.assert_not_called()
+
+
+@override_settings(
+    CACHES={"status": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class StatusCacheTests(SimpleTestCase):
+    drf_id = "statuscache-abcdefgh"
+
+    def setUp(self):
+        self.config = config_mock()
+        self.config["services"]["status_cache"] = {"enabled": True, "ttl": 60}
+        status_cache._get_status_cache(self.config).clear()
+        return super().setUp()
+
+    def status(self, resource_version):
+        pod = pod_dict("pod-a", "deployment-a")
+        pod["metadata"]["resource_version"] = resource_version
+        return k8s._status_from_pod_cached(
+            self.drf_id, None, "default", self.config, pod, time.monotonic(), 20, {}
+        )
+
+    @mock.patch("services.utils.k8s._status_from_pod", return_value={"running": True})
+    def test_cached_by_resource_version(self, status_from_pod):
+        self.assertEqual(self.status("1"), {"running": True})
+        self.assertEqual(self.status("1"), {"running": True})
+        self.assertEqual(status_from_pod.call_count, 1)
+        self.assertEqual(
+            status_cache.get_counters(self.config),
+            {"enabled": True, "hits": 1, "misses": 1},
+        )
+
+        # The pod changed, the cached status is no longer valid
+        status_from_pod.return_value = {"running": False}
+        self.assertEqual(self.status("2"), {"running": False})
+        self.assertEqual(status_from_pod.call_count, 2)
+
+        status_cache.remove_status(self.drf_id, self.config)
+        self.status("2")
+        self.assertEqual(status_from_pod.call_count, 3)
+
+    @mock.patch("services.utils.k8s._status_from_pod", return_value={"running": True})
+    def test_counters_shared(self, status_from_pod):
+        self.status("1")
+        # Counted by another worker process sharing the cache
+        cache = status_cache._get_status_cache(self.config)
+        cache.set("status-counter-hits", 5, timeout=None)
+        self.status("1")
+        self.assertEqual(
+            status_cache.get_counters(self.config),
+            {"enabled": True, "hits": 6, "misses": 1},
+        )
+
+    @mock.patch("services.utils.k8s._status_from_pod", return_value={"running": True})
+    def test_disabled(self, status_from_pod):
+        self.config["services"]["status_cache"]["enabled"] = False
+        self.status("1")
+        self.status("1")
+        self.assertEqual(status_from_pod.call_count, 2)
+
+
+class ProjectionTests(SimpleTestCase):
+    def test_project_pod(self):
+        raw_pod = {
+            "metadata": {
+                "name": "pod-a",
+                "uid": "1234",
+                "resourceVersion": "42",
+                "labels": {"name": "deployment-a"},
+                "managedFields": [{"manager": "kubelet"}],
+            },
+            "spec": {"containers": [{"name": "main"}]},
+            "status": {
+                "phase": "Pending",
+                "containerStatuses": [
+                    {
+                        "name": "main",
+                        "restartCount": 3,
+                        "image": "image",
+                        "state": {
+                            "waiting": {
+                                "reason": "CrashLoopBackOff",
+                                "message": "back-off",
+                            }
+                        },
+                    }
+                ],
+            },
+        }
+        pod = project_pod(raw_pod)
+        self.assertNotIn("spec", pod.keys())
+        self.assertEqual(pod["metadata"]["resource_version"], "42")
+        self.assertEqual(
+            pod["status"]["container_statuses"],
+            [
+                {
+                    "name": "main",
+                    "restart_count": 3,
+                    "state": {
+                        "running": None,
+                        "terminated": None,
+                        "waiting": {
+                            "reason": "CrashLoopBackOff",
+                            "message": "back-off",
+                        },
+                    },
+                }
+            ],
+        )
+
+    def test_events_raw(self):
+        api = mock.Mock()
+        api.list_namespaced_event.return_value = k8s_pods(
+            {
+                "items": [
+                    {"type": "Normal", "reason": "Pulled", "message": "a"},
+                    {"type": "Warning", "reason": "BackOff", "message": "b"},
+                ]
+            }
+        )
+        events = k8s._get_pod_recent_events(
+            api, "pod-a", "default", config_mock(), 20, {}
+        )
+        self.assertEqual(
+            events[-1], {"type": "Warning", "reason": "BackOff", "message": "b"}
+        )
+        self.assertFalse(api.list_namespaced_event.call_args.kwargs["_preload_content"])
+
+
+class ServiceBundleCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        k8s._service_bundle_cache.clear()
+        self.config = config_mock()
+        self.config["services"]["descriptions"] = f"{self.tmp_dir}/descriptions"
+        self.config["services"]["base"] = f"{self.tmp_dir}/services"
+        shutil.copytree(
+            "web/tests/files/services_descriptions/authorized",
+            f"{self.tmp_dir}/descriptions/authorized",
+        )
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        return super().tearDown()
+
+    def get_service(self, drf_id):
+        return k8s._yaml_get_service_as_string(
+            self.config,
+            "authorized",
+            {"user_options": {"service": "JupyterLab/JupyterLab"}},
+            k8s._get_yaml_file_name(drf_id, self.config),
+            "input",
+            {},
+        )
+
+    def test_bundle_reused_until_descriptions_change(self):
+        with mock.patch(
+            "services.utils.k8s._build_service_bundle",
+            side_effect=k8s._build_service_bundle,
+        ) as build:
+            service_yaml_1, input_1 = self.get_service("bundle-1")
+            service_yaml_2, input_2 = self.get_service("bundle-2")
+            self.assertEqual(build.call_count, 1)
+            self.assertEqual((service_yaml_1, input_1), (service_yaml_2, input_2))
+            self.assertTrue(
+                os.path.isfile(k8s._get_yaml_file_name("bundle-2", self.config))
+            )
+
+            start_sh = f"{self.tmp_dir}/descriptions/authorized/JupyterLab/JupyterLab/input/start.sh"
+            with open(start_sh, "a") as f:
+                f.write("echo changed\n")
+            service_yaml_3, input_3 = self.get_service("bundle-3")
+            self.assertEqual(build.call_count, 2)
+            self.assertNotEqual(input_1, input_3)
+
+
+class InputStringTests(SimpleTestCase):
+    def create_input(self, tmp_dir):
+        os.makedirs(f"{tmp_dir}/input/sub")
+        with open(f"{tmp_dir}/input/start.sh", "w") as f:
+            f.write("echo start\n")
+        with open(f"{tmp_dir}/input/sub/file.txt", "w") as f:
+            f.write("content\n")
+
+    def test_deterministic_in_memory(self):
+        input_strings = []
+        for i in range(2):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                self.create_input(tmp_dir)
+                os.utime(f"{tmp_dir}/input/start.sh", (i, i))
+                input_strings.append(
+                    k8s._create_input_string(f"{tmp_dir}/service.yaml", "input")
+                )
+                self.assertEqual(os.listdir(tmp_dir), [])
+        self.assertEqual(input_strings[0], input_strings[1])
+
+        with tarfile.open(
+            fileobj=io.BytesIO(base64.b64decode(input_strings[0])), mode="r:gz"
+        ) as tar:
+            self.assertEqual(
+                tar.getnames(),
+                ["input", "input/start.sh", "input/sub", "input/sub/file.txt"],
+            )
+            self.assertEqual({x.mtime for x in tar.getmembers()}, {0})
+
+
+class YamlReplaceTests(SimpleTestCase):
+    @mock.patch.dict(os.environ, {"STAGE": "stage1"})
+    def test_precedence(self):
+        config = config_mock()
+        config["services"]["replace"] = {
+            "stage_credential": {"stage1": {"authorized": {"nfs": "stagecred-nfs"}}},
+            "stage": {"stage1": {"nfs": "stage-nfs", "id": "ignored", "a": "b"}},
+            "credential": {"authorized": {"a": "c", "server": "cred-server"}},
+        }
+        yaml_s = "<id> <nfs> <a> <server> <user_id> <input> <unknown>"
+        ret = k8s._yaml_replace(
+            "drf-1", config, yaml_s, "authorized", 7, "<server>", {}
+        )
+        # The first definition wins, later groups expand inserted keywords
+        self.assertEqual(
+            ret, "drf-1 stagecred-nfs b cred-server 7 cred-server <unknown>"
+        )
+
+    @mock.patch.dict(os.environ, {"STAGE": "stage1"})
+    def test_chained(self):
+        config = config_mock()
+        config["services"]["replace"] = {
+            "stage_credential": {
+                "stage1": {"authorized": {"image": "<registry>/lab:<tag>"}}
+            },
+            "stage": {"stage1": {"registry": "<host>:5000", "tag": "1.0"}},
+            "credential": {"authorized": {"host": "registry.example"}},
+        }
+        ret = k8s._yaml_replace(
+            "drf-1", config, "image: <image>", "authorized", 7, "", {}
+        )
+        self.assertEqual(ret, "image: registry.example:5000/lab:1.0")
+
+
+class SharedInputTests(SimpleTestCase):
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_create_existing(self, get_client):
+        api = get_client.return_value
+        api.create_namespaced_config_map.side_effect = ApiException(status=409)
+        k8s._create_shared_input_configmap("input-abc", "abc", "aW5wdXQ=", "drf-1", {})
+        body = api.create_namespaced_config_map.call_args.kwargs["body"]
+        self.assertEqual(body["binaryData"], {"input.tar.gz": "aW5wdXQ="})
+        self.assertEqual(body["metadata"]["labels"], {"k8smgr-input": "abc"})
+        # The existing one gets a new resourceVersion
+        self.assertEqual(
+            api.patch_namespaced_config_map.call_args.kwargs["body"],
+            {"metadata": {"annotations": {"k8smgr/input-last-used-by": "drf-1"}}},
+        )
+
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_create_deleted_in_between(self, get_client):
+        api = get_client.return_value
+        api.create_namespaced_config_map.side_effect = [
+            ApiException(status=409),
+            None,
+        ]
+        api.patch_namespaced_config_map.side_effect = ApiException(status=404)
+        k8s._create_shared_input_configmap("input-abc", "abc", "aW5wdXQ=", "drf-1", {})
+        self.assertEqual(api.create_namespaced_config_map.call_count, 2)
+
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_delete_if_unused(self, get_client):
+        api = get_client.return_value
+        api.read_namespaced_config_map.return_value = k8s_pods(
+            {"metadata": {"name": "input-abc", "resourceVersion": "7"}}
+        )
+        api.list_namespaced_secret.return_value = k8s_pods(
+            {"items": [{"metadata": {"name": "secret-other"}}]}
+        )
+        k8s._delete_shared_input_configmap_if_unused("abc", {})
+        api.delete_namespaced_config_map.assert_not_called()
+        self.assertEqual(
+            api.list_namespaced_secret.call_args.kwargs["label_selector"],
+            "k8smgr-input=abc",
+        )
+
+        api.list_namespaced_secret.return_value = k8s_pods({"items": []})
+        k8s._delete_shared_input_configmap_if_unused("abc", {})
+        self.assertEqual(
+            api.delete_namespaced_config_map.call_args.kwargs["name"],
+            k8s._get_shared_input_configmap_name("abc"),
+        )
+        # A start after the reference check changed the resourceVersion
+        self.assertEqual(
+            api.delete_namespaced_config_map.call_args.kwargs["body"],
+            {"preconditions": {"resourceVersion": "7"}},
+        )
+
+    def test_keyword(self):
+        config = config_mock()
+        ret = k8s._yaml_replace(
+            "drf-1",
+            config,
+            "<input_configmap>",
+            "authorized",
+            7,
+            "",
+            {},
+            input_configmap="input-abc",
+        )
+        self.assertEqual(ret, "input-abc")
+
+
+class CreateServiceResourcesTests(SimpleTestCase):
+    service_objects = [
+        {"kind": "Deployment", "metadata": {"name": "deployment-a"}},
+        {"kind": "ConfigMap", "metadata": {"name": "cm-a"}},
+        {"kind": "Service", "metadata": {"name": "svc-a"}},
+    ]
+
+    @mock.patch("services.utils.k8s._k8s_get_api_client")
+    @mock.patch("services.utils.k8s.k8s_utils.create_from_dict")
+    def test_independent_concurrent_then_dependent(self, create, get_api_client):
+        independent_running = threading.Barrier(3, timeout=5)
+        created = []
+
+        def create_from_dict(k8s_client, data, namespace):
+            if data["kind"] != "Deployment":
+                independent_running.wait()
+            created.append(data["kind"])
+
+        create.side_effect = create_from_dict
+        k8s._create_service_resources(
+            [("Secret secret-a", independent_running.wait)],
+            self.service_objects,
+            config_mock(),
+            {},
+        )
+        self.assertEqual(created[-1], "Deployment")
+        self.assertEqual(len(created), 3)
+
+    @mock.patch("services.utils.k8s._k8s_get_api_client")
+    @mock.patch("services.utils.k8s.k8s_utils.create_from_dict")
+    def test_no_deployment_on_error(self, create, get_api_client):
+        def create_from_dict(k8s_client, data, namespace):
+            if data["kind"] == "ConfigMap":
+                raise Exception("Could not create ConfigMap")
+
+        create.side_effect = create_from_dict
+        with self.assertRaises(Exception):
+            k8s._create_service_resources([], self.service_objects, config_mock(), {})
+        kinds = [x.kwargs["data"]["kind"] for x in create.call_args_list]
+        self.assertNotIn("Deployment", kinds)
+
+
+class UserHomeTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.skel = f"{self.tmp_dir}/skel"
+        os.makedirs(f"{self.skel}/.config/app")
+        for path in [".bashrc", ".config/app/settings.json", "notes.swp"]:
+            with open(f"{self.skel}/{path}", "w") as f:
+                f.write(path)
+        os.chmod(f"{self.skel}/.config", 0o700)
+        userhome._skel_listing_cache.clear()
+        return super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        return super().tearDown()
+
+    def create_user_home(self, userhomes_config, uid=None, gid=None):
+        path = f"{self.tmp_dir}/homes/jupyterhub/{uuid.uuid4().hex}"
+        timings = userhome.create_user_home(
+            path,
+            self.skel,
+            ["*.swp"],
+            os.getuid() if uid is None else uid,
+            os.getgid() if gid is None else gid,
+            userhomes_config,
+            {},
+        )
+        return path, timings
+
+    def test_copy(self):
+        path, timings = self.create_user_home({})
+        self.assertEqual(
+            sorted(os.listdir(path)), [".bashrc", ".config"], os.listdir(path)
+        )
+        self.assertEqual(os.stat(f"{path}/.config").st_mode & 0o777, 0o700)
+        with open(f"{path}/.config/app/settings.json") as f:
+            self.assertEqual(f.read(), ".config/app/settings.json")
+        self.assertNotEqual(
+            os.stat(f"{path}/.bashrc").st_ino, os.stat(f"{self.skel}/.bashrc").st_ino
+        )
+        self.assertEqual(
+            set(timings.keys()),
+            {"listing", "directories", "files", "rename", "total"},
+        )
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+    def test_hardlink(self):
+        if os.getuid() != 0:
+            self.skipTest("chown to another user requires root")
+        settings = ".config/app/settings.json"
+        config = {"copy_mode": "hardlink", "link_files": ["*.json", ".bashrc"]}
+        os.chmod(f"{self.skel}/{settings}", 0o644)
+        os.chmod(f"{self.skel}/.bashrc", 0o666)
+        path, _ = self.create_user_home(config, uid=1000, gid=1000)
+        # Owned by root, read-only for the user
+        self.assertEqual(
+            os.stat(f"{path}/{settings}").st_ino,
+            os.stat(f"{self.skel}/{settings}").st_ino,
+        )
+        # Writable by the user
+        self.assertNotEqual(
+            os.stat(f"{path}/.bashrc").st_ino, os.stat(f"{self.skel}/.bashrc").st_ino
+        )
+        # Owned by the user, who could chmod it
+        os.chown(f"{self.skel}/{settings}", 1000, 1000)
+        path, _ = self.create_user_home(config, uid=1000, gid=1000)
+        self.assertNotEqual(
+            os.stat(f"{path}/{settings}").st_ino,
+            os.stat(f"{self.skel}/{settings}").st_ino,
+        )
+
+    def test_reflink_fallback(self):
+        path, _ = self.create_user_home({"copy_mode": "reflink"})
+        with open(f"{path}/.bashrc") as f:
+            self.assertEqual(f.read(), ".bashrc")
+
+    def test_deferred(self):
+        path, timings = self.create_user_home({"copy_mode": "deferred"})
+        self.assertEqual(os.listdir(path), [])
+        self.assertEqual(list(timings.keys()), ["total"])
+
+    def test_skel_listing_cached(self):
+        self.create_user_home({})
+        with open(f"{self.skel}/new_file", "w") as f:
+            f.write("new")
+        path, _ = self.create_user_home({})
+        self.assertNotIn("new_file", os.listdir(path))
+        path, _ = self.create_user_home({"skel_listing_ttl": 0})
+        self.assertIn("new_file", os.listdir(path))
+
+    def test_skel_removed_while_cached(self):
+        listing = userhome._get_skel_listing(self.skel, ["*.swp"], 60)
+        os.remove(f"{self.skel}/.bashrc")
+        shutil.rmtree(f"{self.skel}/.config")
+        for copy_mode in ["copy", "hardlink", "reflink"]:
+            userhome._skel_listing_cache[(self.skel, ("*.swp",))] = (
+                time.monotonic(),
+                listing,
+            )
+            path, _ = self.create_user_home(
+                {"copy_mode": copy_mode, "link_files": [".bashrc"]}
+            )
+            self.assertEqual(os.listdir(path), [])
+        # The outdated listing was dropped
+        self.assertEqual(
+            userhome._get_skel_listing(self.skel, ["*.swp"], 60), [(".", [])]
+        )
+
+
+class TimingTests(SimpleTestCase):
+    def setUp(self):
+        timing.reset_histograms()
+        return super().setUp()
+
+    @override_settings(
+        CACHES={"timings": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_merged_histograms(self):
+        config = config_mock()
+        # Independent of the status cache
+        config["services"]["status_cache"] = {"enabled": False}
+        with mock.patch("services.utils.timing._config", return_value=config):
+            with timing.collect("start"):
+                pass
+        # Another worker process
+        with mock.patch(
+            "services.utils.timing._get_process_key", return_value="timings-other"
+        ):
+            timing.publish_histograms(config)
+        histograms = timing.get_merged_histograms(config)
+        self.assertEqual(histograms["start.total"]["count"], 2)
+        self.assertEqual(histograms["start.total"]["buckets"]["+Inf"], 2)
+        # This process only
+        self.assertEqual(timing.get_histograms()["start.total"]["count"], 1)
+        config["services"]["timings"] = {"shared": False}
+        self.assertEqual(
+            timing.get_merged_histograms(config)["start.total"]["count"], 1
+        )
+
+    def test_collect_spans(self):
+        with timing.collect("start") as timings:
+            with timing.span("phase_a"):
+                pass
+            with timing.span("phase_a"):
+                pass
+            with timing.span("phase_c"):
+                time.sleep(0.02)
+        with timing.span("phase_d"):
+            pass
+        self.assertEqual(set(timings.keys()), {"phase_a", "phase_c", "total"})
+        self.assertGreaterEqual(timings["total"], timings["phase_c"])
+        histograms = timing.get_histograms()
+        self.assertEqual(histograms["start.phase_a"]["count"], 2)
+        self.assertEqual(histograms["start.phase_c"]["buckets"]["0.01"], 0)
+        self.assertEqual(histograms["start.phase_c"]["buckets"]["+Inf"], 1)
+        self.assertEqual(histograms["other.phase_d"]["count"], 1)
+
+    def test_run_in_context(self):
+        def phase_b():
+            with timing.span("phase_b"):
+                pass
+
+        with timing.collect("stop") as timings:
+            thread = threading.Thread(target=timing.run_in_context(phase_b))
+            thread.start()
+            thread.join()
+        self.assertIn("phase_b", timings.keys())
+        self.assertEqual(timing.get_histograms()["stop.phase_b"]["count"], 1)
+
+
+class WarmPoolTests(SimpleTestCase):
+    deployment_main = {
+        "kind": "Deployment",
+        "metadata": {"name": "deployment-main-drf-1"},
+        "spec": {
+            "selector": {"matchLabels": {"name": "drf-1"}},
+            "template": {
+                "metadata": {"labels": {"name": "drf-1", "app": "lab"}},
+                "spec": {"containers": [{"name": "lab", "image": "lab:1"}]},
+            },
+        },
+    }
+
+    def warm_pod(self, name, ready=True, pod_spec=None):
+        if pod_spec is None:
+            pod_spec = self.deployment_main["spec"]["template"]["spec"]
+        return {
+            "metadata": {
+                "name": name,
+                "resourceVersion": f"rv-{name}",
+                "annotations": {
+                    "k8smgr/warm-pool-spec": k8s._get_pod_spec_hash(pod_spec)
+                },
+            },
+            "status": {
+                "phase": "Running",
+                "conditions": [{"type": "Ready", "status": str(ready)}],
+            },
+        }
+
+    # Description following the contract: only the objects outside of the
+    # main Deployment's pod template use the keywords of the start
+    description = """apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: cm-<servername>
+  namespace: <namespace>
+binaryData:
+  input.tar.gz: <input>
+---
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: deployment-main-<servername>
+  namespace: <namespace>
+spec:
+  selector:
+    matchLabels:
+      name: <servername>
+  template:
+    metadata:
+      labels:
+        name: <servername>
+    spec:
+      containers:
+      - name: lab
+        image: lab:1
+"""
+    # Description as without a pool: the pod template uses the keywords
+    description_per_start = """apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: deployment-main-<servername>
+  namespace: <namespace>
+spec:
+  selector:
+    matchLabels:
+      name: <servername>
+  template:
+    metadata:
+      labels:
+        name: <servername>
+    spec:
+      containers:
+      - name: lab-<servername>
+        image: lab:1
+        envFrom:
+        - secretRef:
+            name: <secret_name>
+"""
+
+    def setUp(self):
+        k8s._warm_pool_warnings.clear()
+        return super().setUp()
+
+    def pool_config(self, image="lab:1", description=None):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        os.makedirs(f"{tmp_dir}/authorized/JupyterLab")
+        with open(f"{tmp_dir}/authorized/JupyterLab/service.yaml", "w") as f:
+            f.write(description or self.description)
+        with open(f"{tmp_dir}/authorized/JupyterLab/warm_pool.yaml", "w") as f:
+            f.write(
+                "kind: Deployment\n"
+                "metadata:\n  name: <warm_pool>\n  namespace: <namespace>\n"
+                "spec:\n  selector:\n    matchLabels:\n      app: standby\n"
+                "  template:\n    metadata:\n      labels:\n        app: standby\n"
+                "    spec:\n      containers:\n      - name: lab\n"
+                f"        image: {image}\n"
+            )
+        config = config_mock()
+        config["services"]["descriptions"] = tmp_dir
+        config["services"]["warm_pool"] = {
+            "enabled": True,
+            "pools": {"authorized/JupyterLab": {"size": 3}},
+        }
+        return config
+
+    def test_render(self):
+        config = self.pool_config()
+        pool_key = k8s._get_warm_pool_key(config, "authorized", "JupyterLab/")
+        self.assertEqual(pool_key, "authorized/JupyterLab")
+        self.assertIsNone(k8s._get_warm_pool_key(config, "authorized", "Other"))
+
+        deployment = k8s._render_warm_pool_deployment(config, pool_key)
+        pool_name = k8s._get_warm_pool_name(pool_key)
+        self.assertEqual(deployment["metadata"]["name"], pool_name)
+        self.assertEqual(deployment["spec"]["replicas"], 3)
+        self.assertEqual(
+            deployment["spec"]["selector"],
+            {"matchLabels": {"k8smgr-warm-pool": pool_name}},
+        )
+        self.assertEqual(
+            deployment["spec"]["template"]["metadata"]["labels"],
+            {"app": "standby", "k8smgr-warm-pool": pool_name},
+        )
+        # Same pod spec as the main Deployment
+        spec_hash = k8s._get_pod_spec_hash(
+            self.deployment_main["spec"]["template"]["spec"]
+        )
+        self.assertEqual(
+            deployment["metadata"]["annotations"], {"k8smgr/warm-pool-spec": spec_hash}
+        )
+        self.assertEqual(
+            deployment["spec"]["template"]["metadata"]["annotations"],
+            {"k8smgr/warm-pool-spec": spec_hash},
+        )
+
+    def test_description_contract(self):
+        config = self.pool_config()
+        deployment = k8s._render_warm_pool_deployment(config, "authorized/JupyterLab")
+        spec_hash = deployment["metadata"]["annotations"]["k8smgr/warm-pool-spec"]
+        self.assertIsNone(
+            k8s._check_warm_pool_description(config, "authorized/JupyterLab", spec_hash)
+        )
+        # Different image in the description
+        self.assertEqual(
+            k8s._check_warm_pool_description(
+                self.pool_config(
+                    description=self.description.replace("lab:1", "lab:2")
+                ),
+                "authorized/JupyterLab",
+                spec_hash,
+            ),
+            "Pod template of deployment-main-<servername> differs from the pool",
+        )
+
+    @mock.patch("services.utils.k8s.log")
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_description_per_start_keywords(self, get_client, log):
+        config = self.pool_config(description=self.description_per_start)
+        pool_key = "authorized/JupyterLab"
+        k8s._render_warm_pool_deployment(config, pool_key)
+        deployment = k8s._render_warm_pool_deployment(config, pool_key)
+        # Logged once, not on every refill
+        log.warning.assert_called_once_with(
+            f"Warm pool {pool_key}: Pod template of deployment-main-<servername>"
+            " uses <secret_name>, <servername>. Its pods will not be claimed.",
+            extra={"pool_key": pool_key},
+        )
+
+        # A start of this description never claims a pod of the pool
+        service_yaml_s = k8s._yaml_replace(
+            "drf-1", config, self.description_per_start, "authorized", "1", "", {}
+        )
+        deployment_main = list(yaml.safe_load_all(service_yaml_s))[0]
+        get_client.return_value.list_namespaced_pod.return_value = k8s_pods(
+            {
+                "items": [
+                    self.warm_pod(
+                        "pod-a", pod_spec=deployment["spec"]["template"]["spec"]
+                    )
+                ]
+            }
+        )
+        pod_name = k8s._claim_warm_pod(pool_key, "drf-1", deployment_main, {}, {})
+        self.assertIsNone(pod_name)
+        get_client.return_value.patch_namespaced_pod.assert_not_called()
+        self.assertEqual(log.warning.call_count, 2)
+
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_claim(self, get_client):
+        api = get_client.return_value
+        api.list_namespaced_pod.return_value = k8s_pods(
+            {
+                "items": [
+                    self.warm_pod("pod-a", ready=False),
+                    self.warm_pod("pod-b"),
+                    self.warm_pod("pod-c"),
+                ]
+            }
+        )
+        # pod-b was claimed by another worker in the meantime
+        api.patch_namespaced_pod.side_effect = [ApiException(status=409), None]
+        pod_name = k8s._claim_warm_pod(
+            "authorized/JupyterLab",
+            "drf-1",
+            self.deployment_main,
+            {"k8smgr/drf-id": "drf-1"},
+            {},
+        )
+        self.assertEqual(pod_name, "pod-c")
+        body = api.patch_namespaced_pod.call_args.kwargs["body"]
+        self.assertEqual(body["metadata"]["resourceVersion"], "rv-pod-c")
+        self.assertEqual(
+            body["metadata"]["labels"],
+            {
+                "k8smgr-warm-pool": None,
+                "name": "drf-1",
+                "app": "lab",
+                "k8smgr-owner": "k8smgr",
+                "k8smgr-drf-id": k8s._get_drf_id_label_value("drf-1"),
+            },
+        )
+        self.assertEqual(body["metadata"]["annotations"], {"k8smgr/drf-id": "drf-1"})
+
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_claim_other_pod_spec(self, get_client):
+        api = get_client.return_value
+        api.list_namespaced_pod.return_value = k8s_pods(
+            {
+                "items": [
+                    self.warm_pod(
+                        "pod-a",
+                        pod_spec={"containers": [{"name": "lab", "image": "lab:2"}]},
+                    )
+                ]
+            }
+        )
+        pod_name = k8s._claim_warm_pod(
+            "authorized/JupyterLab",
+            "drf-1",
+            self.deployment_main,
+            {"k8smgr/drf-id": "drf-1"},
+            {},
+        )
+        self.assertIsNone(pod_name)
+        api.patch_namespaced_pod.assert_not_called()
+
+    @mock.patch("services.utils.k8s.client.AppsV1Api")
+    @mock.patch("services.utils.k8s._k8s_get_api_client")
+    def test_ensure_changed_pool(self, get_api_client, apps):
+        apps_api = apps.return_value
+        apps_api.list_namespaced_deployment.return_value = k8s_pods({"items": []})
+        current = k8s._render_warm_pool_deployment(
+            self.pool_config(), "authorized/JupyterLab"
+        )
+        apps_api.read_namespaced_deployment.return_value = k8s_pods(current)
+
+        # Unchanged warm_pool.yaml, only scaled
+        config = self.pool_config()
+        config["services"]["warm_pool"]["pools"]["authorized/JupyterLab"]["size"] = 5
+        k8s._ensure_warm_pools(config, {})
+        apps_api.replace_namespaced_deployment.assert_not_called()
+        self.assertEqual(
+            apps_api.patch_namespaced_deployment_scale.call_args.kwargs["body"],
+            {"spec": {"replicas": 5}},
+        )
+
+        # New image in warm_pool.yaml
+        k8s._ensure_warm_pools(self.pool_config(image="lab:2"), {})
+        body = apps_api.replace_namespaced_deployment.call_args.kwargs["body"]
+        self.assertEqual(
+            body["spec"]["template"]["spec"]["containers"][0]["image"], "lab:2"
+        )
+
+    @mock.patch("services.utils.k8s._k8s_get_api_client")
+    @mock.patch("services.utils.k8s.k8s_utils.create_from_dict")
+    def test_claimed_deployment_not_created(self, create, get_api_client):
+        service_objects = [
+            self.deployment_main,
+            {"kind": "Deployment", "metadata": {"name": "deployment-sidecar"}},
+            {"kind": "Service", "metadata": {"name": "svc-a"}},
+        ]
+        k8s._create_service_resources(
+            [],
+            service_objects,
+            config_mock(),
+            {},
+            claim_deployment_main=("deployment-main-drf-1", lambda: "pod-c"),
+        )
+        names = [x.kwargs["data"]["metadata"]["name"] for x in create.call_args_list]
+        self.assertEqual(sorted(names), ["deployment-sidecar", "svc-a"])
+
+
+class LabelTeardownTests(SimpleTestCase):
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_userjobs_svc_labels(self, get_client):
+        k8s.k8s_create_userjobs_svc("userjobs-a", {"8080": [40000, "59998"]}, {})
+        body = get_client.return_value.create_namespaced_service.call_args.kwargs[
+            "body"
+        ]
+        self.assertEqual(
+            body["metadata"]["labels"],
+            {"userjobs_servername": "userjobs-a", "k8smgr-owner": "k8smgr"},
+        )
+
+    def test_with_service_labels(self):
+        labels = k8s._get_service_labels("drf-1")
+        deployment = {
+            "kind": "Deployment",
+            "metadata": {"name": "deployment-a", "labels": None},
+            "spec": {"template": {"metadata": {"labels": {"app": "lab"}}}},
+        }
+        ret = k8s._with_service_labels(deployment, labels)
+        self.assertEqual(ret["metadata"]["labels"], labels)
+        self.assertEqual(
+            ret["spec"]["template"]["metadata"]["labels"], dict(labels, app="lab")
+        )
+        # The parsed service description is not changed
+        self.assertIsNone(deployment["metadata"]["labels"])
+        self.assertEqual(
+            deployment["spec"]["template"]["metadata"]["labels"], {"app": "lab"}
+        )
+
+    @mock.patch("services.utils.k8s._delete_service_yaml_objects")
+    @mock.patch("services.utils.k8s.client.BatchV1Api")
+    @mock.patch("services.utils.k8s.client.AppsV1Api")
+    @mock.patch("services.utils.k8s._k8s_get_api_client")
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_delete_by_label(self, get_client, get_api_client, apps, batch, by_yaml):
+        api = get_client.return_value
+        api.read_namespaced_secret.return_value.metadata.labels = (
+            k8s._get_service_labels("drf-1")
+        )
+        api.list_namespaced_service.return_value = k8s_pods(
+            {"items": [{"metadata": {"name": "svc-a"}}]}
+        )
+        k8s._delete_service_yaml("drf-1", config_mock(), {})
+        label_selector = api.delete_collection_namespaced_secret.call_args.kwargs[
+            "label_selector"
+        ]
+        self.assertIn(
+            f"k8smgr-drf-id={k8s._get_drf_id_label_value('drf-1')}", label_selector
+        )
+        api.delete_collection_namespaced_config_map.assert_called_once()
+        api.delete_collection_namespaced_pod.assert_called_once()
+        apps.return_value.delete_collection_namespaced_deployment.assert_called_once()
+        batch.return_value.delete_collection_namespaced_job.assert_called_once()
+        api.delete_namespaced_service.assert_called_once_with(
+            name="svc-a", namespace=k8s._k8s_get_namespace()
+        )
+        by_yaml.assert_not_called()
+
+    @mock.patch("services.utils.k8s._delete_service_objects_by_label")
+    @mock.patch("services.utils.k8s._delete_service_yaml_objects")
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_delete_unlabelled_by_yaml(self, get_client, by_yaml, by_label):
+        get_client.return_value.read_namespaced_secret.return_value.metadata.labels = {}
+        k8s._delete_service_yaml("drf-1", config_mock(), {})
+        by_yaml.assert_called_once()
+        by_label.assert_not_called()
+
+    @mock.patch("services.utils.k8s.status_cache.remove_status")
+    @mock.patch("services.utils.k8s._delete_service_objects_by_label")
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_delete_failed(self, get_client, by_label, remove_status):
+        get_client.return_value.read_namespaced_secret.return_value.metadata.labels = (
+            k8s._get_service_labels("drf-1")
+        )
+        by_label.return_value = ["Pod"]
+        with self.assertRaisesRegex(Exception, "Could not delete Pod"):
+            k8s.stop_service("drf-1", config_mock(), {})
+        # Stopped again later, the status is still needed until then
+        remove_status.assert_not_called()
+
+
+class OwnerReferencesTests(SimpleTestCase):
+    owner_references = [
+        {"apiVersion": "v1", "kind": "ConfigMap", "name": "anchor-a", "uid": "123"}
+    ]
+
+    @mock.patch("services.utils.k8s._k8s_get_api_client")
+    @mock.patch("services.utils.k8s.k8s_utils.create_from_dict")
+    def test_create_with_owner_references(self, create, get_api_client):
+        service_objects = [
+            {"kind": "Deployment", "metadata": {"name": "deployment-a"}},
+            {"kind": "Service", "metadata": {"name": "svc-a"}},
+        ]
+        k8s._create_service_resources(
+            [],
+            service_objects,
+            config_mock(),
+            {},
+            labels=k8s._get_service_labels("drf-1"),
+            owner_references=self.owner_references,
+        )
+        for call in create.call_args_list:
+            metadata = call.kwargs["data"]["metadata"]
+            self.assertEqual(metadata["ownerReferences"], self.owner_references)
+            self.assertEqual(metadata["labels"], k8s._get_service_labels("drf-1"))
+        self.assertNotIn("ownerReferences", service_objects[0]["metadata"])
+
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_create_anchor(self, get_client):
+        get_client.return_value.create_namespaced_config_map.return_value = k8s_pods(
+            {"metadata": {"name": k8s._k8s_get_anchor_name("drf-1"), "uid": "123"}}
+        )
+        owner_references = k8s._create_anchor("drf-1", {})
+        self.assertEqual(owner_references[0]["uid"], "123")
+        self.assertEqual(owner_references[0]["kind"], "ConfigMap")
+        body = get_client.return_value.create_namespaced_config_map.call_args.kwargs[
+            "body"
+        ]
+        self.assertEqual(body["metadata"]["labels"], k8s._get_service_labels("drf-1"))
+
+    def anchored_secret(self, get_client, input_hash=None):
+        labels = k8s._get_service_labels("drf-1")
+        if input_hash:
+            labels[k8s._shared_input_label] = input_hash
+        metadata = get_client.return_value.read_namespaced_secret.return_value.metadata
+        metadata.labels = labels
+        owner_reference = mock.Mock()
+        owner_reference.name = k8s._k8s_get_anchor_name("drf-1")
+        metadata.owner_references = [owner_reference]
+
+    @mock.patch("services.utils.k8s._delete_shared_input_configmap_if_unused")
+    @mock.patch("services.utils.k8s._delete_service_objects_by_label")
+    @mock.patch("services.utils.k8s._delete_service_yaml_objects")
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_delete_anchor(self, get_client, by_yaml, by_label, delete_input):
+        self.anchored_secret(get_client, input_hash="abc")
+        config = config_mock()
+        config["services"]["shared_input"] = {"enabled": True}
+        config["services"]["owner_references"] = {"propagation_policy": "Foreground"}
+        k8s._delete_service_yaml("drf-1", config, {})
+        get_client.return_value.delete_namespaced_config_map.assert_called_once_with(
+            name=k8s._k8s_get_anchor_name("drf-1"),
+            namespace=k8s._k8s_get_namespace(),
+            propagation_policy="Foreground",
+        )
+        # Reference count of the shared input
+        get_client.return_value.delete_namespaced_secret.assert_called_once()
+        delete_input.assert_called_once_with("abc", {})
+        by_label.assert_not_called()
+        by_yaml.assert_not_called()
+
+    @mock.patch("services.utils.k8s._delete_service_objects_by_label")
+    @mock.patch("services.utils.k8s._delete_service_yaml_objects")
+    @mock.patch("services.utils.k8s._k8s_get_client_core")
+    def test_delete_anchor_missing(self, get_client, by_yaml, by_label):
+        self.anchored_secret(get_client)
+        get_client.return_value.delete_namespaced_config_map.side_effect = ApiException(
+            status=404
+        )
+        k8s._delete_service_yaml("drf-1", config_mock(), {})
+        by_label.assert_called_once()
+        by_yaml.assert_not_called()
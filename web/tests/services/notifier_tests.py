@@ -0,0 +1,143 @@
+import base64
+import time
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase
+from services.utils.notifier import StatusNotifier
+from tests.mocks import config_mock
+from tests.mocks import mocked_get_executor
+
+
+def pod_dict(uid, phase):
+    return {
+        "metadata": {"name": "pod-a", "uid": uid, "labels": {"name": "deployment-a"}},
+        "status": {
+            "phase": phase,
+            "container_statuses": [{"name": "main", "restart_count": 0}],
+        },
+    }
+
+
+class StatusNotifierTests(SimpleTestCase):
+    def setUp(self):
+        config = config_mock()
+        config["services"]["status_notifier"] = {
+            "enabled": True,
+            "retry_backoff": 0.01,
+            "max_attempts": 2,
+        }
+        self.notifier = StatusNotifier(config)
+        self.notifier.drf_ids = {"deployment-a": "servername-1"}
+        self.notifier.drf_ids_updated = time.monotonic()
+        return super().setUp()
+
+    @mock.patch("services.utils.notifier.get_executor", side_effect=mocked_get_executor)
+    @mock.patch("services.utils.notifier.k8s._k8s_get_client_core")
+    def test_failed_pod_queued_once(self, get_client, get_executor):
+        get_client.return_value.read_namespaced_pod_log.return_value = "error"
+        uid = uuid.uuid4().hex
+        self.notifier.on_pod_event("MODIFIED", pod_dict(uid, "Pending"))
+        self.assertTrue(self.notifier.queue.empty())
+        # The watch thread only runs the pre-check
+        get_executor.assert_not_called()
+
+        self.notifier.on_pod_event("MODIFIED", pod_dict(uid, "Failed"))
+        self.notifier.on_pod_event("MODIFIED", pod_dict(uid, "Failed"))
+        self.assertEqual(self.notifier.queue.qsize(), 1)
+        item = self.notifier.queue.get()
+        self.assertEqual(item["drf_id"], "servername-1")
+        self.assertFalse(item["status"]["running"])
+        self.assertEqual(item["status"]["details"]["error"], "Service status is Failed")
+
+    @mock.patch("services.utils.notifier.k8s._k8s_get_client_core")
+    def test_notified_bounded(self, get_client):
+        self.notifier.notified_max = 2
+        for i in range(3):
+            self.notifier.drf_ids[f"deployment-{i}"] = f"servername-{i}"
+        with mock.patch(
+            "services.utils.notifier.k8s._status_from_pod",
+            return_value={"running": False},
+        ):
+            for i in range(3):
+                self.notifier.check_pod(f"deployment-{i}", pod_dict(str(i), "Failed"))
+        self.assertEqual(
+            list(self.notifier.notified.keys()), ["servername-1", "servername-2"]
+        )
+
+    @mock.patch("services.utils.notifier.k8s._get_deployment_main")
+    def test_refresh_only_new_services(self, get_deployment_main):
+        get_deployment_main.side_effect = lambda drf_id, *args: {
+            "spec": {"selector": {"matchLabels": {"name": f"deployment-{drf_id}"}}}
+        }
+        self.notifier.notified["servername-1"] = "uid"
+        with mock.patch("services.models.ServicesModel.objects") as objects:
+            objects.filter.return_value.values_list.return_value = [
+                ("servername", "2"),
+                ("servername", "3"),
+            ]
+            self.notifier._refresh_drf_ids()
+            self.assertEqual(
+                self.notifier.drf_ids,
+                {
+                    "deployment-servername-2": "servername-2",
+                    "deployment-servername-3": "servername-3",
+                },
+            )
+            # servername-1 is gone
+            self.assertEqual(self.notifier.notified, {})
+
+            objects.filter.return_value.values_list.return_value = [("servername", "3")]
+            self.notifier._refresh_drf_ids()
+        self.assertEqual(
+            self.notifier.drf_ids, {"deployment-servername-3": "servername-3"}
+        )
+        # service.yaml of known services isn't read again
+        self.assertEqual(get_deployment_main.call_count, 2)
+
+    @mock.patch("services.utils.notifier.log")
+    @mock.patch("services.utils.notifier.k8s._get_deployment_main")
+    def test_refresh_failed(self, get_deployment_main, log):
+        def deployment_main(drf_id, *args):
+            if drf_id == "servername-2":
+                raise FileNotFoundError("service.yaml")
+            return {"spec": {"selector": {"matchLabels": {"name": "deployment-3"}}}}
+
+        get_deployment_main.side_effect = deployment_main
+        with mock.patch("services.models.ServicesModel.objects") as objects:
+            objects.filter.return_value.values_list.return_value = [
+                ("servername", "2"),
+                ("servername", "3"),
+            ]
+            self.notifier._refresh_drf_ids()
+        self.assertEqual(self.notifier.drf_ids, {"deployment-3": "servername-3"})
+        log.debug.assert_called_once()
+        self.assertEqual(
+            log.debug.call_args.args[0],
+            "StatusNotifier - no main deployment for servername-2",
+        )
+
+    @mock.patch("services.utils.notifier.k8s._k8s_get_client_core")
+    def test_send_with_retry(self, get_client):
+        get_client.return_value.read_namespaced_secret.return_value.data = {
+            "JUPYTERHUB_STATUS_URL": base64.b64encode(b"http://hub/status").decode(),
+            "JUPYTERHUB_API_TOKEN": base64.b64encode(b"secret").decode(),
+        }
+        self.notifier.session = mock.Mock()
+        self.notifier.session.post.side_effect = [Exception("down"), mock.Mock()]
+        status = {"running": False, "details": {"error": "e"}}
+        self.notifier.queue.put(
+            {"drf_id": "servername-1", "status": status, "attempt": 0}
+        )
+        self.notifier.send_pending()
+        self.assertEqual(len(self.notifier.retries), 1)
+
+        self.notifier.retries[0]["not_before"] = 0
+        self.notifier.send_pending()
+        self.assertEqual(self.notifier.retries, [])
+        kwargs = self.notifier.session.post.call_args.kwargs
+        self.assertEqual(kwargs["url"], "http://hub/status")
+        self.assertEqual(kwargs["json"], status)
+        self.assertEqual(kwargs["headers"]["Authorization"], "token secret")
+        # The secret is read once for all attempts
+        get_client.return_value.read_namespaced_secret.assert_called_once()
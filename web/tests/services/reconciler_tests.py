@@ -0,0 +1,170 @@
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+from services.models import ServicesModel
+from services.models import UserJobsModel
+from services.utils import k8s
+from services.utils import reconciler
+from tests.mocks import config_mock
+from tests.mocks import k8s_pods
+
+
+def managed_object(drf_id, age, labels={}):
+    creation_timestamp = datetime.datetime.now(
+        datetime.timezone.utc
+    ) - datetime.timedelta(seconds=age)
+    return {
+        "metadata": {
+            "labels": dict(k8s._get_service_labels(drf_id), **labels),
+            "creationTimestamp": creation_timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+    }
+
+
+class ReconcilerTests(TestCase):
+    def setUp(self):
+        ServicesModel(
+            servername="known", start_id="1", jhub_user_id=1, jhub_credential="a"
+        ).save()
+        UserJobsModel(
+            service="userjobs-known", hostname="h", target_node="t", jhub_credential="a"
+        ).save()
+        self.config = config_mock()
+        self.config["services"]["reconciler"] = {
+            "enabled": True,
+            "min_age": 60,
+            "deletions_per_second": 0,
+        }
+        return super().setUp()
+
+    def list_service_objects(self, label_selector):
+        return [
+            ("Deployment", managed_object("known-1", 3600)),
+            ("Deployment", managed_object("orphan-1", 3600)),
+            (
+                "Secret",
+                managed_object("orphan-1", 3600, labels={"k8smgr-input": "abc"}),
+            ),
+            ("Pod", managed_object("orphan-1", 3600)),
+            # a start in progress, the ServicesModel is saved afterwards
+            ("Secret", managed_object("starting-1", 5)),
+        ]
+
+    def list_userjobs_services(self, *args, **kwargs):
+        items = []
+        for name in ["userjobs-known", "userjobs-orphan"]:
+            item = managed_object(name, 3600)
+            item["metadata"]["name"] = name
+            items.append(item)
+        return k8s_pods({"items": items})
+
+    @mock.patch(
+        "services.utils.reconciler.k8s._delete_shared_input_configmap_if_unused"
+    )
+    @mock.patch("services.utils.reconciler.k8s.k8s_delete_userjobs_svc")
+    @mock.patch("services.utils.reconciler.k8s._delete_objects_by_label_selector")
+    @mock.patch("services.utils.reconciler.k8s._k8s_get_client_core")
+    @mock.patch("services.utils.reconciler.k8s._list_service_objects")
+    def test_reconcile(
+        self, list_objects, get_client, delete, delete_userjobs, delete_input
+    ):
+        list_objects.side_effect = self.list_service_objects
+        get_client.return_value.list_namespaced_service.side_effect = (
+            self.list_userjobs_services
+        )
+        metrics = reconciler.reconcile(self.config, {})
+        self.assertEqual(metrics["orphaned_services"], 1)
+        self.assertEqual(
+            metrics["orphaned_objects"], {"Deployment": 1, "Secret": 1, "Pod": 1}
+        )
+        self.assertEqual(metrics["deleted_services"], 1)
+        self.assertEqual(metrics["deleted_userjobs"], 1)
+        delete.assert_called_once()
+        self.assertEqual(
+            delete.call_args.args[0],
+            k8s._get_service_label_selector(k8s._get_drf_id_label_value("orphan-1")),
+        )
+        delete_input.assert_called_once_with("abc", {})
+        self.assertEqual(delete_userjobs.call_args.args[0], "userjobs-orphan")
+        # Only UserJobs Services of this manager
+        self.assertEqual(
+            get_client.return_value.list_namespaced_service.call_args.kwargs[
+                "label_selector"
+            ],
+            "userjobs_servername,k8smgr-owner=k8smgr",
+        )
+
+    @mock.patch("services.utils.reconciler.k8s.k8s_delete_userjobs_svc")
+    @mock.patch("services.utils.reconciler.k8s._delete_objects_by_label_selector")
+    @mock.patch("services.utils.reconciler.k8s._k8s_get_client_core")
+    @mock.patch("services.utils.reconciler.k8s._list_service_objects")
+    def test_dry_run(self, list_objects, get_client, delete, delete_userjobs):
+        list_objects.side_effect = self.list_service_objects
+        get_client.return_value.list_namespaced_service.side_effect = (
+            self.list_userjobs_services
+        )
+        self.config["services"]["reconciler"]["dry_run"] = True
+        metrics = reconciler.reconcile(self.config, {})
+        self.assertEqual(metrics["orphaned_services"], 1)
+        self.assertEqual(metrics["orphaned_userjobs"], 1)
+        self.assertEqual(metrics["deleted_services"], 0)
+        delete.assert_not_called()
+        delete_userjobs.assert_not_called()
+
+    @mock.patch("services.utils.common.stop_service_async")
+    @mock.patch("services.utils.common._config")
+    def test_stale_stops(self, config, stop_service_async):
+        self.config["services"]["async_stop"] = {"enabled": True}
+        config.return_value = self.config
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for servername, age in [("stopping", 5), ("lost", 3600)]:
+            ServicesModel(
+                servername=servername,
+                start_id="1",
+                jhub_user_id=1,
+                stop_pending=True,
+                stop_pending_date=now - datetime.timedelta(seconds=age),
+            ).save()
+        self.assertEqual(reconciler._restart_stale_stops(self.config, True, {}), 1)
+        stop_service_async.assert_not_called()
+
+        self.assertEqual(reconciler._restart_stale_stops(self.config, False, {}), 1)
+        stop_service_async.assert_called_once()
+        self.assertEqual(
+            stop_service_async.call_args.args[0],
+            ServicesModel.objects.get(servername="lost").id,
+        )
+        # Not stale again until stale_after has passed
+        self.assertEqual(reconciler._restart_stale_stops(self.config, False, {}), 0)
+
+    @mock.patch("services.utils.common.stop_service_async")
+    @mock.patch("services.utils.common._config")
+    def test_stale_stops_sync(self, config, stop_service_async):
+        config.return_value = self.config
+        ServicesModel(
+            servername="lost",
+            start_id="1",
+            jhub_user_id=1,
+            stop_pending=True,
+            stop_pending_date=datetime.datetime.now(datetime.timezone.utc)
+            - datetime.timedelta(hours=1),
+        ).save()
+        # Without async stop, stale stops are only reported
+        self.assertEqual(reconciler._restart_stale_stops(self.config, False, {}), 1)
+        stop_service_async.assert_not_called()
+        self.assertEqual(reconciler._restart_stale_stops(self.config, False, {}), 1)
+
+    def test_metrics(self):
+        metrics_file = f"{tempfile.mkdtemp()}/reconciler.json"
+        self.addCleanup(shutil.rmtree, os.path.dirname(metrics_file))
+        self.config["services"]["reconciler"]["metrics_file"] = metrics_file
+        reconciler._write_metrics(self.config, {"deleted_services": 2})
+        self.assertEqual(
+            reconciler.get_metrics(self.config),
+            {"deleted_services": 2, "enabled": True},
+        )
+        self.assertEqual(reconciler.get_metrics(config_mock()), {"enabled": False})
@@ -0,0 +1,317 @@
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+from services.utils import common
+from services.utils import ssh_mux
+from tests.mocks import config_mock
+from tests.mocks import mocked_popen_init
+
+
+def read_string(payload, offset):
+    (length,) = struct.unpack_from(">I", payload, offset)
+    offset += 4
+    return payload[offset : offset + length].decode(), offset + length
+
+
+class ScriptedMaster:
+    """
+    Sends and expects fixed bytes, independent of the codec in ssh_mux.
+    script: list of ("send", bytes) and ("recv", number of bytes).
+    """
+
+    def __init__(self, path, script):
+        self.received = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.thread = threading.Thread(target=self.serve, args=(script,))
+        self.thread.start()
+
+    def serve(self, script):
+        conn, _ = self.server.accept()
+        with conn:
+            for action, value in script:
+                if action == "send":
+                    conn.sendall(value)
+                    continue
+                data = b""
+                while len(data) < value:
+                    data += conn.recv(value - len(data))
+                self.received.append(data)
+        self.server.close()
+
+
+# Messages as in PROTOCOL.mux of OpenSSH: uint32 length, uint32 type, ...
+HELLO = b"\x00\x00\x00\x08" b"\x00\x00\x00\x01" b"\x00\x00\x00\x04"
+ALIVE_CHECK = b"\x00\x00\x00\x08" b"\x10\x00\x00\x04" b"\x00\x00\x00\x01"
+ALIVE = b"\x00\x00\x00\x0c" b"\x80\x00\x00\x05" b"\x00\x00\x00\x01" b"\x00\x00\x10\x92"
+# request id 1, MUX_FWD_LOCAL, 0.0.0.0:40000 -> node:8888
+OPEN_FWD = (
+    b"\x00\x00\x00\x27"
+    b"\x10\x00\x00\x06"
+    b"\x00\x00\x00\x01"
+    b"\x00\x00\x00\x01"
+    b"\x00\x00\x00\x070.0.0.0"
+    b"\x00\x00\x9c\x40"
+    b"\x00\x00\x00\x04node"
+    b"\x00\x00\x22\xb8"
+)
+OK = b"\x00\x00\x00\x08" b"\x80\x00\x00\x01" b"\x00\x00\x00\x01"
+FAILURE = (
+    b"\x00\x00\x00\x0f" b"\x80\x00\x00\x03" b"\x00\x00\x00\x01" b"\x00\x00\x00\x03bad"
+)
+
+
+class ControlMaster:
+    """
+    Answers mux requests like an OpenSSH ControlMaster.
+    Forwards to port 9999 fail. With close_after, the master goes away
+    after accepting this many forwards.
+    """
+
+    pid = 4242
+
+    def __init__(self, path, close_after=None):
+        self.path = path
+        self.close_after = close_after
+        self.connections = 0
+        self.forwards = set()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def close(self):
+        self.server.close()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        with conn:
+            ssh_mux._send(
+                conn, struct.pack(">II", ssh_mux.MUX_MSG_HELLO, ssh_mux.SSHMUX_VER)
+            )
+            ssh_mux._recv(conn)
+            while True:
+                try:
+                    payload = ssh_mux._recv(conn)
+                except ssh_mux.SSHMuxError:
+                    return
+                msg_type, request_id = struct.unpack_from(">II", payload)
+                if msg_type == ssh_mux.MUX_C_ALIVE_CHECK:
+                    reply = struct.pack(
+                        ">III", ssh_mux.MUX_S_ALIVE, request_id, self.pid
+                    )
+                else:
+                    _, offset = read_string(payload, 12)
+                    (listen_port,) = struct.unpack_from(">I", payload, offset)
+                    connect_host, offset = read_string(payload, offset + 4)
+                    (connect_port,) = struct.unpack_from(">I", payload, offset)
+                    forward = (listen_port, connect_host, connect_port)
+                    if connect_port == 9999:
+                        reply = struct.pack(
+                            ">II", ssh_mux.MUX_S_FAILURE, request_id
+                        ) + ssh_mux._string("Port forwarding failed")
+                    else:
+                        if msg_type == ssh_mux.MUX_C_OPEN_FWD:
+                            self.forwards.add(forward)
+                        else:
+                            self.forwards.discard(forward)
+                        reply = struct.pack(">II", ssh_mux.MUX_S_OK, request_id)
+                if len(self.forwards) == self.close_after:
+                    self.close()
+                    return
+                ssh_mux._send(conn, reply)
+
+
+class SSHMuxTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.master = ControlMaster(os.path.join(tmp_dir, "control"))
+        self.addCleanup(self.master.close)
+        patcher = mock.patch(
+            "services.utils.ssh_mux._get_control_path",
+            return_value=self.master.path,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ssh_mux._connections["pid"] = None
+        return super().setUp()
+
+    def test_forward_and_cancel(self):
+        used_ports, returncode = ssh_mux.forward(
+            {"8080": "59998", "8081": "59999"}, "host", "node", 5, {}
+        )
+        self.assertEqual(returncode, 0)
+        self.assertEqual(
+            self.master.forwards,
+            {
+                (used_ports["8080"][0], "node", 59998),
+                (used_ports["8081"][0], "node", 59999),
+            },
+        )
+        self.assertEqual(ssh_mux.check_connection("host", 5, {}), 4242)
+        ssh_mux.cancel(used_ports, "host", "node", 5, {})
+        self.assertEqual(self.master.forwards, set())
+        # One control connection for all of it
+        self.assertEqual(self.master.connections, 1)
+
+    def test_forward_failed(self):
+        used_ports, returncode = ssh_mux.forward(
+            {"8080": "59998", "8081": "9999"}, "host", "node", 5, {}
+        )
+        self.assertEqual(returncode, 255)
+        self.assertEqual(len(used_ports), 2)
+
+    def test_reconnect(self):
+        self.assertEqual(ssh_mux.check_connection("host", 5, {}), 4242)
+        connection = ssh_mux._get_connection("host")
+        connection["sock"].shutdown(socket.SHUT_RDWR)
+        self.assertEqual(ssh_mux.check_connection("host", 5, {}), 4242)
+        self.assertEqual(self.master.connections, 2)
+
+    @mock.patch("services.utils.ssh.subprocess.Popen", side_effect=mocked_popen_init)
+    @mock.patch("services.utils.common._config")
+    def test_fallback_to_ssh(self, config, popen):
+        config.return_value = config_mock()
+        config.return_value["userjobs"] = {"ssh_mux": {"enabled": True}}
+        self.master.close()
+        ssh_mux._control_path_cache.clear()
+        with mock.patch(
+            "services.utils.ssh_mux._get_control_path",
+            side_effect=ssh_mux.SSHMuxError("No control path"),
+        ):
+            used_ports, returncode = common.userjobs_create_ssh_tunnels(
+                {"8080": "59998"}, "host", "node", {}
+            )
+        self.assertEqual(returncode, 0)
+        commands = [x.args[0][3:5] for x in popen.call_args_list]
+        self.assertIn(["-O", "check"], commands)
+        self.assertIn(["-O", "forward"], commands)
+
+    @mock.patch("services.utils.ssh.subprocess.Popen", side_effect=mocked_popen_init)
+    @mock.patch("services.utils.common._config")
+    def test_fallback_same_ports(self, config, popen):
+        config.return_value = config_mock()
+        config.return_value["userjobs"] = {"ssh_mux": {"enabled": True}}
+        self.master.close_after = 1
+        used_ports, returncode = common.userjobs_create_ssh_tunnels(
+            {"8080": "59998", "8081": "59999"}, "host", "node", {}
+        )
+        self.assertEqual(returncode, 0)
+        # The forward the master accepted before it went away is requested
+        # again with the same local port, instead of a new one
+        ((listen_port, _, target_port),) = self.master.forwards
+        forwards = [x.args[0][-1] for x in popen.call_args_list]
+        self.assertIn(f"0.0.0.0:{listen_port}:node:{target_port}", forwards)
+        self.assertEqual(
+            sorted(forwards),
+            sorted(
+                f"0.0.0.0:{local_port}:node:{port}"
+                for local_port, port in used_ports.values()
+            ),
+        )
+
+    @mock.patch("services.utils.common._config")
+    def test_tunnels(self, config):
+        config.return_value = config_mock()
+        config.return_value["userjobs"] = {"ssh_mux": {"enabled": True}}
+        instance_dict = {
+            "service": "abc",
+            "hostname": "host",
+            "target_node": "node",
+            "used_ports": {"8080": [40000, "59998"]},
+        }
+        self.assertEqual(
+            common.userjobs_tunnels([instance_dict], {}),
+            {
+                "host": {
+                    "alive": True,
+                    "pid": 4242,
+                    "forwards": [
+                        {
+                            "service": "abc",
+                            "port": 8080,
+                            "local_port": 40000,
+                            "target_node": "node",
+                            "target_port": 59998,
+                        }
+                    ],
+                }
+            },
+        )
+
+
+class WireFormatTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, "control")
+        patcher = mock.patch(
+            "services.utils.ssh_mux._get_control_path", return_value=self.path
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ssh_mux._connections["pid"] = None
+        return super().setUp()
+
+    def test_alive_check(self):
+        master = ScriptedMaster(
+            self.path,
+            [
+                ("send", HELLO),
+                ("recv", len(HELLO)),
+                ("recv", len(ALIVE_CHECK)),
+                ("send", ALIVE),
+            ],
+        )
+        self.assertEqual(ssh_mux.check_connection("host", 5, {}), 4242)
+        master.thread.join(5)
+        self.assertEqual(master.received, [HELLO, ALIVE_CHECK])
+
+    @mock.patch("services.utils.ssh_mux.get_port", return_value=40000)
+    def test_open_fwd(self, get_port):
+        master = ScriptedMaster(
+            self.path,
+            [
+                ("send", HELLO),
+                ("recv", len(HELLO)),
+                ("recv", len(OPEN_FWD)),
+                ("send", OK),
+            ],
+        )
+        used_ports, returncode = ssh_mux.forward(
+            {"8888": "8888"}, "host", "node", 5, {}
+        )
+        master.thread.join(5)
+        self.assertEqual(master.received, [HELLO, OPEN_FWD])
+        self.assertEqual((used_ports, returncode), ({"8888": (40000, "8888")}, 0))
+
+    @mock.patch("services.utils.ssh_mux.get_port", return_value=40000)
+    def test_open_fwd_failure(self, get_port):
+        master = ScriptedMaster(
+            self.path,
+            [
+                ("send", HELLO),
+                ("recv", len(HELLO)),
+                ("recv", len(OPEN_FWD)),
+                ("send", FAILURE),
+            ],
+        )
+        _, returncode = ssh_mux.forward({"8888": "8888"}, "host", "node", 5, {})
+        master.thread.join(5)
+        self.assertEqual(returncode, 255)
@@ -1,3 +1,4 @@
+import datetime
 import os
 import shutil
 import uuid
@@ -5,19 +6,31 @@ from unittest import mock
 
 from django.http.response import HttpResponse
 from django.urls.base import reverse
+from django.utils import timezone
 from services.models import ServicesModel
 from services.models import UserJobsModel
 from services.models import UserModel
+from services.utils import MgrExceptionError
+from services.utils.common import stop_pending_stale_before
 from tests.mocks import config_mock
+from tests.mocks import config_mock_async_start
+from tests.mocks import config_mock_async_stop
 from tests.mocks import config_mock_services_mapping
 from tests.mocks import config_mock_userhome_mapping
 from tests.mocks import k8s_ApiClient
+from tests.mocks import k8s_client as k8s_client_class
 from tests.mocks import k8s_client_AppsV1Api
+from tests.mocks import k8s_client_AppsV1Api_bulk
+from tests.mocks import k8s_client_BatchV1Api
+from tests.mocks import k8s_client_BatchV1Api_bulk
 from tests.mocks import k8s_client_CoreV1Api
+from tests.mocks import k8s_client_CoreV1Api_bulk
 from tests.mocks import k8s_config_load_incluster_config
-from tests.mocks import k8s_utils_create_from_yaml
+from tests.mocks import k8s_pods
+from tests.mocks import k8s_utils_create_from_dict
 from tests.mocks import k8s_V1Secret
 from tests.mocks import mocked_exception
+from tests.mocks import mocked_get_executor
 from tests.mocks import mocked_popen_init
 from tests.mocks import mocked_popen_init_all_fail
 from tests.mocks import mocked_popen_init_cancel_fail
@@ -96,8 +109,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(r.json(), ["Missing key in input data: env"])
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -123,7 +136,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -131,8 +144,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(len(r.data["servername"]), 32)
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -160,7 +173,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -174,8 +187,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(first_line, "# Mapped version")
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -201,7 +214,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -231,8 +244,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(len(models), 0)
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -258,7 +271,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         pre_models = ServicesModel.objects.all()
@@ -268,8 +281,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(len(models), 1)
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -295,7 +308,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         pre_models = UserModel.objects.all()
@@ -305,8 +318,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(len(models), 1)
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -332,15 +345,15 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
         self.assertTrue(os.path.isdir(f"{userhomes_base}/authorized/17"))
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -368,15 +381,15 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
         self.assertTrue(os.path.isdir(f"{userhomes_base}/mapped_suffix/17"))
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -402,7 +415,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -412,8 +425,8 @@ class ServiceViewTests(UserCredentials):
         )
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -439,7 +452,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -451,8 +464,8 @@ class ServiceViewTests(UserCredentials):
         )
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -478,7 +491,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         update_yaml_skel = f"{services_descriptions}/{self.user_authorized_username}/{self.simple_request_data['user_options']['service']}/update.yaml"
@@ -496,8 +509,8 @@ class ServiceViewTests(UserCredentials):
         self.assertTrue("<servername>" not in update_yaml_s)
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -523,7 +536,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -534,8 +547,8 @@ class ServiceViewTests(UserCredentials):
         self.assertTrue(r.data["running"])
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -561,7 +574,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         servername = "12345"
@@ -576,9 +589,31 @@ class ServiceViewTests(UserCredentials):
         service_model = ServicesModel.objects.first()
         self.assertEqual(service_model.servername, servername)
 
+        # A service named like an action on all services is still reachable
+        r = self.client.post(
+            url,
+            headers={"uuidcode": "status"},
+            data=self.simple_request_data,
+            format="json",
+        )
+        self.assertEqual(r.status_code, 201)
+        r = self.client.get(f"{url}status/", format="json")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data["servername"], "status")
+
+        # Reserved for the actions on all services
+        r = self.client.post(
+            url,
+            headers={"uuidcode": "_bulk"},
+            data=self.simple_request_data,
+            format="json",
+        )
+        self.assertEqual(r.status_code, 400)
+        self.assertFalse(ServicesModel.objects.filter(servername="_bulk").exists())
+
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -604,7 +639,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -614,13 +649,351 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(r.status_code, 200)
         self.assertTrue(r.data["running"])
 
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(target="services.utils.common._config", side_effect=config_mock)
+    def test_get_services_status(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+    ):
+        url = reverse("services-list")
+        servernames = []
+        for _ in range(2):
+            r = self.client.post(url, data=self.simple_request_data, format="json")
+            self.assertEqual(r.status_code, 201)
+            servernames.append(r.data["servername"])
+        status_url = reverse("services-status")
+        r = self.client.post(
+            status_url,
+            data={"servernames": servernames + ["unknown"]},
+            format="json",
+        )
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(set(r.data.keys()), set(servernames))
+        for servername in servernames:
+            self.assertEqual(r.data[servername]["servername"], servername)
+            self.assertIn("running", r.data[servername].keys())
+
+    def test_get_services_status_invalid_input(self):
+        status_url = reverse("services-status")
+        r = self.client.post(status_url, data={"servernames": "abc"}, format="json")
+        self.assertEqual(r.status_code, 400)
+
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(target="services.utils.common._config", side_effect=config_mock)
+    def test_get_services_timings(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+    ):
+        url = reverse("services-list")
+        r = self.client.post(url, data=self.simple_request_data, format="json")
+        self.assertEqual(r.status_code, 201)
+        r = self.client.get(reverse("services-timings"), format="json")
+        self.assertEqual(r.status_code, 200)
+        for phase in [
+            "start.total",
+            "start.create_user_home",
+            "start.yaml_replace",
+            "start.create_secret",
+            "start.create_resources",
+        ]:
+            self.assertIn(phase, r.data.keys())
+            self.assertGreaterEqual(r.data[phase]["buckets"]["+Inf"], 1)
+
+    def test_get_services_status_cache(self):
+        url = reverse("services-status-cache")
+        r = self.client.get(url, format="json")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data, {"enabled": False})
+
+    @mock.patch(
+        target="services.utils.common.get_executor",
+        side_effect=mocked_get_executor,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(
+        target="services.utils.common._config", side_effect=config_mock_async_start
+    )
+    def test_create_async_lost(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        get_executor,
+    ):
+        url = reverse("services-list")
+        # The queued start is never run, e.g. the worker was restarted
+        with self.captureOnCommitCallbacks(execute=False):
+            r = self.client.post(url, data=self.simple_request_data, format="json")
+        servername = r.data["servername"]
+        r = self.client.get(f"{url}{servername}/")
+        self.assertTrue(r.data["running"])
+        ServicesModel.objects.filter(servername=servername).update(
+            start_phase_date=timezone.now() - datetime.timedelta(hours=1)
+        )
+        r = self.client.get(f"{url}{servername}/")
+        self.assertFalse(r.data["running"])
+        self.assertEqual(r.data["details"]["phase"], "failed")
+
+    @mock.patch(
+        target="services.utils.common.get_executor",
+        side_effect=mocked_get_executor,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(
+        target="services.utils.common._config", side_effect=config_mock_async_start
+    )
+    def test_create_async(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        get_executor,
+    ):
+        url = reverse("services-list")
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            r = self.client.post(url, data=self.simple_request_data, format="json")
+        self.assertEqual(r.status_code, 202)
+        servername = r.data["servername"]
+        self.assertEqual(
+            ServicesModel.objects.get(servername=servername).start_phase, "queued"
+        )
+        self.assertEqual(k8s_create_from_dict.call_count, 0)
+        r = self.client.get(f"{url}{servername}/")
+        self.assertTrue(r.data["running"])
+        self.assertEqual(r.data["details"], {"phase": "queued"})
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            ServicesModel.objects.get(servername=servername).start_phase, "created"
+        )
+        self.assertTrue(k8s_create_from_dict.called)
+        r = self.client.get(f"{url}{servername}/")
+        self.assertTrue(r.data["running"])
+
+    @mock.patch(
+        target="services.utils.common.get_executor",
+        side_effect=mocked_get_executor,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=mocked_exception,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(
+        target="services.utils.common._config", side_effect=config_mock_async_start
+    )
+    def test_create_async_failed(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        get_executor,
+    ):
+        url = reverse("services-list")
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(url, data=self.simple_request_data, format="json")
+        self.assertEqual(r.status_code, 202)
+        servername = r.data["servername"]
+        self.assertEqual(
+            ServicesModel.objects.get(servername=servername).start_phase, "failed"
+        )
+        status_url = reverse("services-status")
+        r = self.client.post(
+            status_url, data={"servernames": [servername]}, format="json"
+        )
+        self.assertFalse(r.data[servername]["running"])
+        self.assertEqual(r.data[servername]["details"]["phase"], "failed")
+
+    @mock.patch(
+        target="services.utils.common.get_executor",
+        side_effect=mocked_get_executor,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(
+        target="services.utils.common._config", side_effect=config_mock_async_start
+    )
+    def test_create_async_pod_grace(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        get_executor,
+    ):
+        url = reverse("services-list")
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(url, data=self.simple_request_data, format="json")
+        self.assertEqual(r.status_code, 202)
+        servername = r.data["servername"]
+        status_url = reverse("services-status")
+        # The pod does not exist yet, _select_pod raises PodNotFoundError
+        deployment_main = {"spec": {"selector": {"matchLabels": {"name": "lab"}}}}
+        with mock.patch(
+            "services.utils.k8s._get_deployment_main", return_value=deployment_main
+        ), mock.patch.object(
+            k8s_client_class,
+            "list_namespaced_pod",
+            return_value=k8s_pods({"items": []}),
+        ):
+            r = self.client.get(f"{url}{servername}/")
+            self.assertTrue(r.data["running"])
+            self.assertEqual(r.data["details"], {"phase": "created"})
+            r = self.client.post(
+                status_url, data={"servernames": [servername]}, format="json"
+            )
+            self.assertTrue(r.data[servername]["running"])
+
+            config = config_mock_async_start()
+            config["services"]["async_start"]["pod_grace"] = 0
+            config_mocked.side_effect = None
+            config_mocked.return_value = config
+            r = self.client.get(f"{url}{servername}/")
+            self.assertFalse(r.data["running"])
+            self.assertIn("No pod found", r.data["details"]["detailed_error"])
+
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api,
+    )
     @mock.patch(
         target="services.utils.k8s.client.AppsV1Api",
         side_effect=k8s_client_AppsV1Api,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -646,8 +1019,9 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         k8s_apps,
+        k8s_batch,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -656,13 +1030,17 @@ class ServiceViewTests(UserCredentials):
         r = self.client.delete(service_url)
         self.assertEqual(r.status_code, 204)
 
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api,
+    )
     @mock.patch(
         target="services.utils.k8s.client.AppsV1Api",
         side_effect=k8s_client_AppsV1Api,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -688,8 +1066,9 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         k8s_apps,
+        k8s_batch,
     ):
         url = reverse("services-list")
         pre_models = ServicesModel.objects.all()
@@ -704,13 +1083,438 @@ class ServiceViewTests(UserCredentials):
         post_models = ServicesModel.objects.all()
         self.assertEqual(len(post_models), 0)
 
+    @mock.patch(
+        target="services.utils.common.get_executor",
+        side_effect=mocked_get_executor,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.AppsV1Api",
+        side_effect=k8s_client_AppsV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(
+        target="services.utils.common._config", side_effect=config_mock_async_stop
+    )
+    def test_delete_async(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        k8s_apps,
+        k8s_batch,
+        get_executor,
+    ):
+        url = reverse("services-list")
+        r = self.client.post(url, data=self.simple_request_data, format="json")
+        self.assertEqual(r.status_code, 201)
+        servername = r.data["servername"]
+        # The start phase is updated while the DELETE holds an older instance
+        instance = ServicesModel.objects.get(servername=servername)
+        ServicesModel.objects.filter(servername=servername).update(start_phase="failed")
+        with mock.patch(
+            "services.views.ServicesViewSet.get_object", return_value=instance
+        ):
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                r = self.client.delete(f"{url}{servername}/")
+        self.assertEqual(r.status_code, 204)
+        # Row is kept until the teardown is done
+        self.assertTrue(ServicesModel.objects.get(servername=servername).stop_pending)
+        self.assertEqual(
+            ServicesModel.objects.get(servername=servername).start_phase, "failed"
+        )
+        r = self.client.get(f"{url}{servername}/")
+        self.assertFalse(r.data["running"])
+
+        # Already stopping
+        with self.captureOnCommitCallbacks(execute=False) as callbacks_again:
+            r = self.client.delete(f"{url}{servername}/")
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(len(callbacks_again), 0)
+
+        # The queued stop was lost, stop it again
+        ServicesModel.objects.filter(servername=servername).update(
+            stop_pending_date=timezone.now() - datetime.timedelta(hours=1)
+        )
+        with self.captureOnCommitCallbacks(execute=False) as callbacks_again:
+            r = self.client.delete(f"{url}{servername}/")
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(len(callbacks_again), 1)
+
+        for callback in callbacks:
+            callback()
+        self.assertFalse(ServicesModel.objects.filter(servername=servername).exists())
+
+    @mock.patch(target="services.utils.common.time.sleep")
+    @mock.patch(target="services.utils.common.stop_service")
+    @mock.patch(
+        target="services.utils.common.get_executor",
+        side_effect=mocked_get_executor,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.AppsV1Api",
+        side_effect=k8s_client_AppsV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(
+        target="services.utils.common._config", side_effect=config_mock_async_stop
+    )
+    def test_delete_async_retry(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        k8s_apps,
+        k8s_batch,
+        get_executor,
+        stop_service,
+        sleep,
+    ):
+        url = reverse("services-list")
+        r = self.client.post(url, data=self.simple_request_data, format="json")
+        self.assertEqual(r.status_code, 201)
+        servername = r.data["servername"]
+
+        stop_service.side_effect = [MgrExceptionError("failed"), None]
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.delete(f"{url}{servername}/")
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(stop_service.call_count, 2)
+        sleep.assert_called_once_with(2)
+        self.assertFalse(ServicesModel.objects.filter(servername=servername).exists())
+
+    @mock.patch(target="services.utils.common.time.sleep")
+    @mock.patch(target="services.utils.common.stop_service")
+    @mock.patch(
+        target="services.utils.common.get_executor",
+        side_effect=mocked_get_executor,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.AppsV1Api",
+        side_effect=k8s_client_AppsV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(
+        target="services.utils.common._config", side_effect=config_mock_async_stop
+    )
+    def test_delete_async_give_up(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        k8s_apps,
+        k8s_batch,
+        get_executor,
+        stop_service,
+        sleep,
+    ):
+        url = reverse("services-list")
+        r = self.client.post(url, data=self.simple_request_data, format="json")
+        self.assertEqual(r.status_code, 201)
+        servername = r.data["servername"]
+
+        stop_service.side_effect = MgrExceptionError("failed")
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.delete(f"{url}{servername}/")
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(stop_service.call_count, 3)
+        self.assertEqual([x.args[0] for x in sleep.call_args_list], [2, 4])
+        # Kept, so the next DELETE tries again
+        self.assertFalse(ServicesModel.objects.get(servername=servername).stop_pending)
+
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.AppsV1Api",
+        side_effect=k8s_client_AppsV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(target="services.utils.common._config", side_effect=config_mock)
+    def test_stop_bulk(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        k8s_apps,
+        k8s_batch,
+    ):
+        url = reverse("services-list")
+        servernames = []
+        for _ in range(2):
+            r = self.client.post(url, data=self.simple_request_data, format="json")
+            self.assertEqual(r.status_code, 201)
+            servernames.append(r.data["servername"])
+        stop_url = reverse("services-stop")
+        with mock.patch(
+            "services.utils.k8s._delete_objects_by_label_selector", return_value=[]
+        ) as delete:
+            r = self.client.post(
+                stop_url,
+                data={"servernames": servernames + ["unknown"]},
+                format="json",
+            )
+        self.assertEqual(r.status_code, 200)
+        for servername in servernames:
+            self.assertEqual(r.data[servername], {"stopped": True})
+        self.assertFalse(r.data["unknown"]["stopped"])
+        self.assertEqual(len(ServicesModel.objects.all()), 0)
+        # One label selector for both services
+        delete.assert_called_once()
+        self.assertTrue("k8smgr-drf-id in (" in delete.call_args.args[0])
+
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.AppsV1Api",
+        side_effect=k8s_client_AppsV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(target="services.utils.common._config", side_effect=config_mock)
+    def test_stop_bulk_claim(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        k8s_apps,
+        k8s_batch,
+    ):
+        url = reverse("services-list")
+        servernames = []
+        for _ in range(3):
+            r = self.client.post(url, data=self.simple_request_data, format="json")
+            self.assertEqual(r.status_code, 201)
+            servernames.append(r.data["servername"])
+        # Stopping for an hour, the stop was lost
+        ServicesModel.objects.filter(servername=servernames[1]).update(
+            stop_pending=True,
+            stop_pending_date=timezone.now() - datetime.timedelta(hours=1),
+        )
+
+        def concurrent_stop(now):
+            # Another request claims this one after it was listed
+            ServicesModel.objects.filter(servername=servernames[2]).update(
+                stop_pending=True, stop_pending_date=timezone.now()
+            )
+            return stop_pending_stale_before(now)
+
+        stop_url = reverse("services-stop")
+        with mock.patch(
+            "services.views.stop_pending_stale_before", side_effect=concurrent_stop
+        ), mock.patch(
+            "services.utils.k8s._delete_objects_by_label_selector", return_value=[]
+        ):
+            r = self.client.post(
+                stop_url, data={"servernames": servernames}, format="json"
+            )
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data[servernames[0]], {"stopped": True})
+        self.assertEqual(r.data[servernames[1]], {"stopped": True})
+        self.assertEqual(
+            r.data[servernames[2]],
+            {"stopped": False, "error": "Service is already stopping"},
+        )
+        self.assertEqual(
+            list(ServicesModel.objects.values_list("servername", flat=True)),
+            [servernames[2]],
+        )
+
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.AppsV1Api",
+        side_effect=k8s_client_AppsV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.V1Secret",
+        side_effect=k8s_V1Secret,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.ApiClient",
+        side_effect=k8s_ApiClient,
+    )
+    @mock.patch(
+        target="services.utils.k8s.client.CoreV1Api",
+        side_effect=k8s_client_CoreV1Api_bulk,
+    )
+    @mock.patch(
+        target="services.utils.k8s.config.load_incluster_config",
+        side_effect=k8s_config_load_incluster_config,
+    )
+    @mock.patch(target="services.utils.common._config", side_effect=config_mock)
+    def test_stop_bulk_filters(
+        self,
+        config_mocked,
+        k8s_config,
+        k8s_client,
+        k8s_api_client,
+        k8s_secret,
+        k8s_create_from_dict,
+        k8s_apps,
+        k8s_batch,
+    ):
+        url = reverse("services-list")
+        r = self.client.post(url, data=self.simple_request_data, format="json")
+        self.assertEqual(r.status_code, 201)
+        servername = r.data["servername"]
+        stop_url = reverse("services-stop")
+        r = self.client.post(stop_url, data={}, format="json")
+        self.assertEqual(r.status_code, 400)
+        r = self.client.post(
+            stop_url, data={"start_date_before": "yesterday"}, format="json"
+        )
+        self.assertEqual(r.status_code, 400)
+        r = self.client.post(
+            stop_url,
+            data={"start_date_before": "2000-01-01T00:00:00Z"},
+            format="json",
+        )
+        self.assertEqual(r.data, {})
+        r = self.client.post(stop_url, data={"jhub_user_id": 17}, format="json")
+        self.assertEqual(r.data, {servername: {"stopped": True}})
+        self.assertEqual(len(ServicesModel.objects.all()), 0)
+
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api,
+    )
     @mock.patch(
         target="services.utils.k8s.client.AppsV1Api",
         side_effect=k8s_client_AppsV1Api,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -736,8 +1540,9 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         k8s_apps,
+        k8s_batch,
     ):
         url = reverse("services-list")
         pre_models = UserModel.objects.all()
@@ -752,13 +1557,17 @@ class ServiceViewTests(UserCredentials):
         post_models = UserModel.objects.all()
         self.assertEqual(len(post_models), 1)
 
+    @mock.patch(
+        target="services.utils.k8s.client.BatchV1Api",
+        side_effect=k8s_client_BatchV1Api,
+    )
     @mock.patch(
         target="services.utils.k8s.client.AppsV1Api",
         side_effect=k8s_client_AppsV1Api,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -784,8 +1593,9 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         k8s_apps,
+        k8s_batch,
     ):
         url = reverse("services-list")
         self.assertFalse(os.path.isdir(f"{userhomes_base}/authorized/17"))
@@ -798,8 +1608,8 @@ class ServiceViewTests(UserCredentials):
         self.assertTrue(os.path.isdir(f"{userhomes_base}/authorized/17"))
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -825,7 +1635,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         self.client.post(url, data=self.simple_request_data, format="json")
@@ -837,8 +1647,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(len(rg2.data), 0)
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -864,7 +1674,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         self.client.post(url, data=self.simple_request_data, format="json")
@@ -880,8 +1690,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(rd1.status_code, 204)
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -908,7 +1718,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -943,8 +1753,8 @@ class ServiceViewTests(UserCredentials):
             self.assertEqual("stage1", f.read().strip())
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -971,7 +1781,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -1009,8 +1819,8 @@ class ServiceViewTests(UserCredentials):
             self.assertEqual("authorized", f.read().strip())
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -1037,7 +1847,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -1053,8 +1863,8 @@ class ServiceViewTests(UserCredentials):
         self.assertEqual(stage_specific_value, "stage2")
 
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -1081,7 +1891,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
     ):
         url = reverse("services-list")
         r = self.client.post(url, data=self.simple_request_data, format="json")
@@ -1103,8 +1913,8 @@ class ServiceViewTests(UserCredentials):
         side_effect=mocked_popen_init,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -1130,7 +1940,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         mocked_popen,
     ):
         data = self.simple_userjobs_data
@@ -1138,13 +1948,19 @@ class ServiceViewTests(UserCredentials):
         r = self.client.post(url, data=self.simple_userjobs_data, format="json")
         self.assertEqual(r.status_code, 201)
 
+        # Reserved for the actions on all UserJobs
+        data = dict(self.simple_userjobs_data)
+        data["service"] = "_metrics"
+        r = self.client.post(url, data=data, format="json")
+        self.assertEqual(r.status_code, 400)
+
     @mock.patch(
         "services.utils.ssh.subprocess.Popen",
         side_effect=mocked_popen_init,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -1170,7 +1986,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         mocked_popen,
     ):
         data = self.simple_userjobs_data
@@ -1186,8 +2002,8 @@ class ServiceViewTests(UserCredentials):
         side_effect=mocked_popen_init,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -1213,7 +2029,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         mocked_popen,
     ):
         data = self.simple_userjobs_data
@@ -1230,8 +2046,8 @@ class ServiceViewTests(UserCredentials):
         side_effect=mocked_popen_init,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -1257,7 +2073,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         mocked_popen,
     ):
         url = reverse("services-list")
@@ -1280,8 +2096,8 @@ class ServiceViewTests(UserCredentials):
         side_effect=mocked_popen_init,
     )
     @mock.patch(
-        target="services.utils.k8s.k8s_utils.create_from_yaml",
-        side_effect=k8s_utils_create_from_yaml,
+        target="services.utils.k8s.k8s_utils.create_from_dict",
+        side_effect=k8s_utils_create_from_dict,
     )
     @mock.patch(
         target="services.utils.k8s.client.V1Secret",
@@ -1307,7 +2123,7 @@ class ServiceViewTests(UserCredentials):
         k8s_client,
         k8s_api_client,
         k8s_secret,
-        k8s_create_from_yaml,
+        k8s_create_from_dict,
         mocked_popen,
     ):
         url = reverse("services-list")